@@ -0,0 +1,50 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import AsyncGenerator, Optional
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe, TelegramMethod
+from aiogram.types import Chat, Message, User
+
+BOT_USER = User(id=1, is_bot=True, first_name="FakeBot", username="fake_bot")
+
+class FakeSession(BaseSession):
+    """Сессия Bot API без сети: отвечает сразу, считает вызовы по методам.
+
+    latency - задержка ответа в секундах, чтобы имитировать сеть.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url: str, headers: Optional[dict] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True
+                             ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def make_request(self, bot, method: TelegramMethod, timeout: Optional[int] = None):
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if isinstance(method, GetMe):
+            return BOT_USER
+        returning = str(method.__returning__)
+        if "Message" not in returning:
+            return True
+        chat_id = getattr(method, "chat_id", None) or 0
+        return Message(
+            message_id=getattr(method, "message_id", None) or next(self._message_ids),
+            date=int(time.time()),
+            chat=Chat(id=int(chat_id), type="private"),
+            from_user=BOT_USER,
+            text=getattr(method, "text", None) or "",
+        )
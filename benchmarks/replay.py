@@ -0,0 +1,278 @@
+# Прогон синтетических сессий пользователей через диспетчер бота без сети.
+#
+#   python -m benchmarks.replay --users 2000 --concurrency 200 --output result.json
+#   python -m benchmarks.replay --baseline result.json   # код выхода 1 при регрессии
+#
+# Каждая сессия: /start -> курсы -> курс -> тест -> прогресс -> покупка ->
+# урок -> рейтинг. База - временный файл SQLite, Bot API - FakeSession.
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+os.environ.setdefault("BOT_TOKEN", "123456:benchmark")
+
+import config
+
+def _percentile(values: List[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+def _latency_summary(values: List[float]) -> Dict[str, float]:
+    """Перцентили задержки в миллисекундах"""
+    return {
+        "p50": round(_percentile(values, 0.50) * 1000, 3),
+        "p95": round(_percentile(values, 0.95) * 1000, 3),
+        "p99": round(_percentile(values, 0.99) * 1000, 3),
+        "max": round(max(values, default=0.0) * 1000, 3),
+    }
+
+def _rss_mb() -> float:
+    """Текущий RSS процесса (на Linux) или пиковый, если /proc недоступен"""
+    try:
+        with open("/proc/self/statm") as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class SessionReplay:
+    """Синтетические сессии пользователей, поданные в dp.feed_update"""
+
+    def __init__(self, main, users: int, concurrency: int, seed: int):
+        self.main = main
+        self.users = users
+        self.concurrency = concurrency
+        self.random = random.Random(seed)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id: int):
+        return User(id=user_id, is_bot=False, first_name=f"User{user_id}", username=f"u{user_id}")
+
+    def _message(self, user, text: str):
+        return Update(update_id=next(self._update_ids), message=Message(
+            message_id=next(self._message_ids), date=int(time.time()),
+            chat=Chat(id=user.id, type="private"), from_user=user, text=text
+        ))
+
+    def _callback(self, user, data: str):
+        message = Message(
+            message_id=next(self._message_ids), date=int(time.time()),
+            chat=Chat(id=user.id, type="private"), text="..."
+        )
+        return Update(update_id=next(self._update_ids), callback_query=CallbackQuery(
+            id=str(next(self._update_ids)), from_user=user, chat_instance="bench",
+            data=data, message=message
+        ))
+
+    def session(self, user_id: int) -> List[Tuple[str, object]]:
+        """Шаги одной сессии: (название шага, Update)"""
+        # quiz импортируется вместе с main, после подмены путей в config
+        from quiz import question_bank
+
+        user = self._user(user_id)
+        steps = [
+            ("start", self._message(user, "/start")),
+            ("courses", self._callback(user, "my_courses")),
+            ("course", self._callback(user, "course_1")),
+            ("quiz_start", self._callback(user, "qs:theory")),
+        ]
+        index = 0
+        question = question_bank.question("theory", index)
+        while question is not None:
+            option = self.random.randrange(len(question.options))
+            steps.append(("quiz_answer", self._callback(user, f"qa:{question.task_id}:{option}")))
+            index += 1
+            question = question_bank.question("theory", index)
+            steps.append(("quiz_next" if question else "quiz_finish",
+                          self._callback(user, "quiz_next" if question else "quiz_finish")))
+
+        lessons = self.main.db.lessons.course_lessons(1)
+        steps += [
+            ("progress", self._callback(user, "my_progress")),
+            ("buy", self._callback(user, "buy_course")),
+            ("purchase", self._callback(user, "test_purchase_1")),
+            ("lessons", self._callback(user, "lessons_1")),
+        ]
+        if lessons:
+            steps += [
+                ("lesson", self._callback(user, f"lesson_{lessons[0].id}")),
+                ("lesson_complete", self._callback(user, f"complete_lesson_{lessons[0].id}")),
+            ]
+        steps.append(("rating", self._callback(user, "rating")))
+        return steps
+
+    async def _run_user(self, user_id: int, semaphore: asyncio.Semaphore, record: bool):
+        async with semaphore:
+            for step, update in self.session(user_id):
+                started = time.perf_counter()
+                await self.main.dp.feed_update(self.main.bot, update)
+                if record:
+                    self.latencies[step].append(time.perf_counter() - started)
+
+    async def run(self, first_user_id: int, users: int, record: bool = True):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(
+            self._run_user(user_id, semaphore, record)
+            for user_id in range(first_user_id, first_user_id + users)
+        ))
+
+async def _seed_lessons(db, count: int = 3):
+    """Уроки первого курса, чтобы сессии проходили и этот раздел"""
+    async with db.transaction() as conn:
+        for order in range(1, count + 1):
+            await conn.execute('''
+                INSERT INTO lessons (course_id, title, description, video_file_id, lesson_order, points_reward)
+                VALUES (1, ?, ?, ?, ?, 10)
+            ''', (f"Урок {order}", "Описание урока " * 20, f"BENCH_VIDEO_{order}", order))
+    await db.lessons.invalidate()
+
+async def run_benchmark(users: int, concurrency: int, warmup: int, seed: int,
+                        latency: float) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    config.DB_PATH = os.path.join(workdir, "bench.db")
+    config.PREVIEWS_DIR = os.path.join(workdir, "previews")
+    # Сессии идут без пауз - ограничение частоты отбросило бы почти всё
+    config.THROTTLE_RATE = config.THROTTLE_BURST = 10 ** 6
+
+    import main
+    from benchmarks.fake_session import FakeSession
+
+    # Сессия без OutboundScheduler: замеряем обработчики, а не лимиты Telegram.
+    # EditCache остаётся: он сокращает число запросов к API
+    main.bot.session = session = FakeSession(latency)
+    session.middleware(main.edit_cache)
+    queries = itertools.count()
+    main.db.trace = lambda statement: next(queries)
+
+    await main.db.connect()
+    main.storage.start()
+    await main.dp.emit_startup(bot=main.bot, **main.dp.workflow_data)
+    await _seed_lessons(main.db)
+
+    replay = SessionReplay(main, users, concurrency, seed)
+    # Разогрев: кэши, подготовленные выражения, ленивые загрузки
+    first_user_id = 10_000_000
+    await replay.run(first_user_id, warmup, record=False)
+    await main.db.ledger.flush()
+
+    gc.collect()
+    rss_before = _rss_mb()
+    queries_before = next(queries)
+    calls_before = sum(session.calls.values())
+
+    started = time.perf_counter()
+    await replay.run(first_user_id + warmup, users)
+    await main.db.ledger.flush()
+    duration = time.perf_counter() - started
+
+    gc.collect()
+    rss_after = _rss_mb()
+    total_queries = next(queries) - queries_before - 1
+    api_calls = sum(session.calls.values()) - calls_before
+
+    await main.dp.emit_shutdown(bot=main.bot, **main.dp.workflow_data)
+    await main.storage.close()
+    await main.db.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    all_latencies = [value for values in replay.latencies.values() for value in values]
+    updates = len(all_latencies)
+    return {
+        "config": {
+            "users": users, "concurrency": concurrency, "warmup": warmup,
+            "seed": seed, "api_latency_s": latency,
+            "python": sys.version.split()[0],
+        },
+        "updates": updates,
+        "duration_s": round(duration, 3),
+        "updates_per_sec": round(updates / duration, 1) if duration else 0.0,
+        "latency_ms": _latency_summary(all_latencies),
+        "steps_ms": {step: _latency_summary(values) for step, values in sorted(replay.latencies.items())},
+        "db_queries_per_update": round(total_queries / updates, 3) if updates else 0.0,
+        "api_calls_per_update": round(api_calls / updates, 3) if updates else 0.0,
+        "rss_mb": {
+            "before": round(rss_before, 1),
+            "after": round(rss_after, 1),
+            "growth": round(rss_after - rss_before, 1),
+        },
+    }
+
+# Метрики для сравнения с эталоном: (путь в результате, больше - лучше)
+CHECKS = [
+    (("updates_per_sec",), True),
+    (("latency_ms", "p95"), False),
+    (("latency_ms", "p99"), False),
+    (("db_queries_per_update",), False),
+    (("api_calls_per_update",), False),
+]
+
+def _value(result: Dict, path: Tuple[str, ...]) -> Optional[float]:
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Регрессии относительно эталонного прогона"""
+    regressions = []
+    for path, higher_is_better in CHECKS:
+        current, reference = _value(result, path), _value(baseline, path)
+        if current is None or not reference:
+            continue
+        change = (current - reference) / reference
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{'.'.join(path)}: {reference} -> {current} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков бота")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="сессий одновременно")
+    parser.add_argument("--warmup", type=int, default=50, help="пользователей для разогрева")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка Bot API, сек")
+    parser.add_argument("--output", help="куда записать результат (JSON)")
+    parser.add_argument("--baseline", help="эталонный результат для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = asyncio.run(run_benchmark(
+        args.users, args.concurrency, args.warmup, args.seed, args.api_latency
+    ))
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram import Bot, F, types
+from aiogram.exceptions import TelegramAPIError
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from callbacks import CallbackRouter
+from config import ADMIN_IDS
+from sender import PRIORITY_LOW, send_priority
+
+broadcast_router = CallbackRouter(name="broadcast")
+
+class BroadcastStates(StatesGroup):
+    waiting_text = State()
+
+class BroadcastEngine:
+    """Рассылка сообщения всем пользователям.
+
+    Получатели читаются из users пачками по batch_size с keyset-пагинацией
+    (user_id > последнего), так что в памяти никогда не бывает всей таблицы.
+    Пока отправляется одна пачка, следующая уже читается из базы. После
+    каждой пачки в broadcasts сохраняются счётчики и последний user_id -
+    после падения рассылка продолжается с этого места (последняя
+    незавершённая пачка может быть отправлена повторно).
+
+    Скорость ограничивает OutboundScheduler сессии бота; рассылка идёт с
+    низким приоритетом, чтобы не задерживать ответы пользователям.
+
+    При нескольких процессах-обработчиках рассылки отправляет только один
+    (см. watch): у него своя доля общего лимита Telegram. В остальных
+    процессах sending = False, и start только оставляет рассылку в базе.
+    """
+
+    def __init__(self, db, bot: Bot, batch_size: int = 500, concurrency: int = 50):
+        self.db = db
+        self.bot = bot
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        # id рассылки -> задача, которая её отправляет
+        self._running: Dict[int, asyncio.Task] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+        self.sending = True
+
+    async def create(self, text: str, admin_id: int) -> int:
+        """Новая рассылка; возвращает её id"""
+        async with self.db.transaction() as conn:
+            cursor = await conn.execute('''
+                INSERT INTO broadcasts (text, admin_id, created_at, status)
+                VALUES (?, ?, ?, 'running')
+            ''', (text, admin_id, datetime.now()))
+            return cursor.lastrowid
+
+    def start(self, broadcast_id: int) -> Optional[asyncio.Task]:
+        """Запуск рассылки в фоне, если рассылки отправляет этот процесс"""
+        if not self.sending:
+            return None
+        task = self._running.get(broadcast_id)
+        if task is None:
+            task = self._running[broadcast_id] = asyncio.create_task(self.run(broadcast_id))
+            task.add_done_callback(lambda done: self._running.pop(broadcast_id, None))
+        return task
+
+    async def resume_unfinished(self):
+        """Продолжить рассылки, прерванные остановкой бота"""
+        for (broadcast_id,) in await self.db.fetchall(
+            "SELECT id FROM broadcasts WHERE status = 'running'"
+        ):
+            if broadcast_id not in self._running:
+                logging.info("Продолжаем рассылку #%s", broadcast_id)
+                self.start(broadcast_id)
+
+    def watch(self, interval: float):
+        """Отправлять и рассылки, запущенные в других процессах.
+
+        Раз в interval секунд ищет в базе незавершённые рассылки, которые
+        ещё не отправляются, - в том числе прерванные остановкой бота.
+        """
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_loop(interval))
+
+    async def _watch_loop(self, interval: float):
+        while True:
+            try:
+                await self.resume_unfinished()
+            except Exception:
+                logging.exception("Не удалось проверить рассылки")
+            await asyncio.sleep(interval)
+
+    async def stop(self):
+        """Остановить рассылки; прогресс уже сохранён в базе"""
+        tasks = list(self._running.values())
+        if self._watch_task is not None:
+            tasks.append(self._watch_task)
+            self._watch_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _next_batch(self, after_user_id: int) -> List[int]:
+        rows = await self.db.fetchall(
+            'SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?',
+            (after_user_id, self.batch_size)
+        )
+        return [user_id for (user_id,) in rows]
+
+    async def _send(self, semaphore: asyncio.Semaphore, user_id: int, text: str) -> bool:
+        async with semaphore:
+            try:
+                await self.bot.send_message(user_id, text, parse_mode="HTML")
+                return True
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат удалён и т.п.
+                logging.debug("Рассылка: %s не получил сообщение: %s", user_id, e)
+                return False
+
+    async def run(self, broadcast_id: int) -> Optional[Dict]:
+        """Отправка рассылки с места последней сохранённой пачки"""
+        row = await self.db.fetchone('''
+            SELECT text, admin_id, last_user_id, delivered, failed
+            FROM broadcasts WHERE id = ?
+        ''', (broadcast_id,))
+        if not row:
+            return None
+        text, admin_id, last_user_id, delivered, failed = row
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = datetime.now()
+
+        with send_priority(PRIORITY_LOW):
+            batch = await self._next_batch(last_user_id)
+            while batch:
+                prefetch = asyncio.create_task(self._next_batch(batch[-1]))
+                try:
+                    results = await asyncio.gather(
+                        *(self._send(semaphore, user_id, text) for user_id in batch)
+                    )
+                except BaseException:
+                    prefetch.cancel()
+                    raise
+
+                sent = sum(results)
+                delivered += sent
+                failed += len(results) - sent
+                last_user_id = batch[-1]
+                await self.db.execute('''
+                    UPDATE broadcasts SET last_user_id = ?, delivered = ?, failed = ?
+                    WHERE id = ?
+                ''', (last_user_id, delivered, failed, broadcast_id))
+
+                batch = await prefetch
+
+        await self.db.execute('''
+            UPDATE broadcasts SET status = 'done', finished_at = ? WHERE id = ?
+        ''', (datetime.now(), broadcast_id))
+
+        stats = {'delivered': delivered, 'failed': failed}
+        logging.info("Рассылка #%s завершена: %s", broadcast_id, stats)
+
+        if admin_id:
+            seconds = (datetime.now() - started).total_seconds()
+            try:
+                await self.bot.send_message(
+                    admin_id,
+                    f"📢 <b>Рассылка #{broadcast_id} завершена</b>\n\n"
+                    f"✅ <b>Доставлено:</b> {delivered}\n"
+                    f"❌ <b>Не доставлено:</b> {failed}\n"
+                    f"⏱ <b>Время:</b> {seconds:.0f} сек.",
+                    parse_mode="HTML"
+                )
+            except TelegramAPIError:
+                pass
+        return stats
+
+    async def last_broadcast(self) -> Optional[tuple]:
+        """Последняя рассылка: id, статус, доставлено, не доставлено"""
+        return await self.db.fetchone('''
+            SELECT id, status, delivered, failed FROM broadcasts
+            ORDER BY id DESC LIMIT 1
+        ''')
+
+# Рассылка из админ-панели
+@broadcast_router.exact("admin_broadcast")
+async def broadcast_menu(callback: types.CallbackQuery, state: FSMContext,
+                         broadcaster: BroadcastEngine):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("❌ У вас нет прав доступа!")
+        return
+
+    text = (
+        "📢 <b>Рассылка</b>\n\n"
+        "✍️ Отправьте сообщение, которое получат все пользователи бота.\n"
+        "Можно использовать форматирование."
+    )
+
+    last = await broadcaster.last_broadcast()
+    if last:
+        broadcast_id, status, delivered, failed = last
+        status_text = "⏳ идёт" if status == 'running' else "✅ завершена"
+        text += (
+            f"\n\n<b>Последняя рассылка #{broadcast_id}:</b> {status_text}\n"
+            f"✅ Доставлено: {delivered} • ❌ Ошибок: {failed}"
+        )
+
+    await state.set_state(BroadcastStates.waiting_text)
+    await callback.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="broadcast_cancel")]
+        ]),
+        parse_mode="HTML"
+    )
+
+@broadcast_router.message(BroadcastStates.waiting_text, F.text)
+async def broadcast_preview(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    await state.update_data(broadcast_text=message.html_text)
+    await message.answer(
+        f"👀 <b>Предпросмотр рассылки:</b>\n\n{message.html_text}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Отправить всем", callback_data="broadcast_confirm")],
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="broadcast_cancel")]
+        ]),
+        parse_mode="HTML"
+    )
+
+@broadcast_router.exact("broadcast_confirm")
+async def broadcast_confirm(callback: types.CallbackQuery, state: FSMContext,
+                            broadcaster: BroadcastEngine):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("❌ У вас нет прав доступа!")
+        return
+
+    data = await state.get_data()
+    text = data.get("broadcast_text")
+    await state.clear()
+
+    if not text:
+        await callback.answer("❌ Текст рассылки не найден")
+        return
+
+    broadcast_id = await broadcaster.create(text, callback.from_user.id)
+    broadcaster.start(broadcast_id)
+
+    await callback.message.edit_text(
+        f"🚀 <b>Рассылка #{broadcast_id} запущена</b>\n\n"
+        "📬 Отчёт придёт сюда после отправки всем пользователям.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="main_menu")]
+        ]),
+        parse_mode="HTML"
+    )
+
+@broadcast_router.exact("broadcast_cancel")
+async def broadcast_cancel(callback: types.CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text(
+        "❌ Рассылка отменена",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔙 Админ-панель", callback_data="main_menu")]
+        ])
+    )
@@ -0,0 +1,113 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Router, types
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.dispatcher.event.handler import CallableObject
+
+# Ключ конца префикса в узле дерева
+_END = ""
+
+# payload, который parse не смог разобрать
+INVALID = object()
+
+BAD_REQUEST_TEXT = "❌ Некорректный запрос"
+
+class CallbackRoute(CallableObject):
+    """Обработчик маршрута и функция разбора его payload"""
+
+    def __init__(self, callback: Callable, parse: Callable[[str], Any] = str):
+        super().__init__(callback)
+        self.parse = parse
+
+class CallbackRouter(Router):
+    """Router, который выбирает обработчик callback_data по таблице.
+
+    Вместо перебора фильтров F.data у каждого обработчика:
+    - точные значения ищутся в словаре;
+    - префиксы ищутся в префиксном дереве, побеждает самый длинный
+      совпавший префикс, поэтому порядок регистрации не важен.
+
+    Обработчик получает разобранный payload в аргументе payload: для точных
+    маршрутов - саму callback_data, для префиксных - остаток строки после
+    префикса, пропущенный через parse (например, int). Если разобрать его
+    не удалось, обработчик не вызывается, а на callback отвечается
+    BAD_REQUEST_TEXT.
+    """
+
+    def __init__(self, *, name: Optional[str] = None):
+        super().__init__(name=name)
+        self._exact: Dict[str, CallbackRoute] = {}
+        self._prefixes: Dict[str, Any] = {}
+        self.callback_query.register(self._dispatch)
+
+    def exact(self, *values: str):
+        """Маршрут для одного или нескольких точных значений callback_data"""
+        def decorator(handler):
+            route = CallbackRoute(handler)
+            for value in values:
+                if value in self._exact:
+                    raise ValueError(f"Маршрут для '{value}' уже зарегистрирован")
+                self._exact[value] = route
+            return handler
+        return decorator
+
+    def prefix(self, prefix: str, parse: Callable[[str], Any] = str):
+        """Маршрут для callback_data, начинающейся с prefix"""
+        def decorator(handler):
+            node = self._prefixes
+            for char in prefix:
+                node = node.setdefault(char, {})
+            if _END in node:
+                raise ValueError(f"Маршрут для префикса '{prefix}' уже зарегистрирован")
+            node[_END] = CallbackRoute(handler, parse)
+            return handler
+        return decorator
+
+    def routes(self) -> List[CallbackRoute]:
+        """Все зарегистрированные маршруты (точные и префиксные)"""
+        routes = list(self._exact.values())
+        nodes = [self._prefixes]
+        while nodes:
+            node = nodes.pop()
+            for key, value in node.items():
+                if key == _END:
+                    routes.append(value)
+                else:
+                    nodes.append(value)
+        return routes
+
+    def resolve(self, data: str) -> Optional[Tuple[CallbackRoute, Any]]:
+        """Найти маршрут и payload (INVALID, если он не разобрался) для callback_data"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, data
+
+        node = self._prefixes
+        found, length = None, 0
+        for position, char in enumerate(data, 1):
+            node = node.get(char)
+            if node is None:
+                break
+            if _END in node:
+                found, length = node[_END], position
+
+        if found is None:
+            return None
+
+        try:
+            return found, found.parse(data[length:])
+        except ValueError:
+            return found, INVALID
+
+    async def _dispatch(self, callback: types.CallbackQuery, **kwargs):
+        resolved = self.resolve(callback.data or "")
+        if resolved is None:
+            # Пусть обработают другие роутеры
+            raise SkipHandler()
+
+        route, payload = resolved
+        if payload is INVALID:
+            # Подделанная или устаревшая callback_data
+            await callback.answer(BAD_REQUEST_TEXT)
+            return None
+        return await route.call(callback, payload=payload, **kwargs)
@@ -0,0 +1,36 @@
+from typing import Dict, List, Optional
+
+class CourseCatalog:
+    """Кэш активных курсов в памяти.
+
+    Загружается один раз при старте и перечитывается только по явному
+    invalidate() после изменения курсов администратором; другие процессы
+    подхватывают изменение по версии кэша "catalog".
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._courses: Dict[int, tuple] = {}
+        self._ordered: List[tuple] = []
+        # Растёт при каждой перезагрузке - по нему сбрасываются зависимые кэши
+        self.version = 0
+
+    async def load(self):
+        """Загрузка курсов из базы данных"""
+        courses = await self.db.get_courses()
+        self._courses = {course[0]: course for course in courses}
+        self._ordered = list(courses)
+        self.version += 1
+
+    async def invalidate(self):
+        """Перечитать каталог после изменения курсов - здесь и в других процессах"""
+        await self.db.bump_cache("catalog")
+        await self.load()
+
+    def get_course(self, course_id: int) -> Optional[tuple]:
+        """Курс по id: (id, title, description, price) или None"""
+        return self._courses.get(course_id)
+
+    def list_courses(self) -> List[tuple]:
+        """Все активные курсы в порядке добавления"""
+        return self._ordered
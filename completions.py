@@ -0,0 +1,46 @@
+from collections import OrderedDict
+from typing import Set
+
+class CompletionIndex:
+    """Что пользователь уже прошёл: уроки, задания, вопросы, бонусы.
+
+    Ключи выполнений пользователя подгружаются из user_progress одним
+    запросом при первом обращении и дальше проверяются в памяти, так что
+    повторное нажатие кнопки отсекается без записи в базу. В памяти держится
+    не больше max_users пользователей; за кэшем стоит уникальный индекс
+    (user_id, completion_key), который не даст записать дубль в любом случае.
+    """
+
+    def __init__(self, db, max_users: int = 10000):
+        self.db = db
+        self.max_users = max_users
+        self._users: "OrderedDict[int, Set[str]]" = OrderedDict()
+
+    async def _keys(self, user_id: int) -> Set[str]:
+        keys = self._users.get(user_id)
+        if keys is not None:
+            self._users.move_to_end(user_id)
+            return keys
+
+        rows = await self.db.fetchall(
+            'SELECT completion_key FROM user_progress WHERE user_id = ? AND completion_key IS NOT NULL',
+            (user_id,)
+        )
+        # Пока шёл запрос, другое обновление могло уже загрузить этого пользователя
+        keys = self._users.get(user_id)
+        if keys is not None:
+            return keys
+
+        keys = {key for (key,) in rows} | self.db.ledger.pending_keys(user_id)
+        self._users[user_id] = keys
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return keys
+
+    async def claim(self, user_id: int, key: str) -> bool:
+        """Отметить выполнение; False, если оно уже было"""
+        keys = await self._keys(user_id)
+        if key in keys:
+            return False
+        keys.add(key)
+        return True
@@ -7,11 +7,74 @@ load_dotenv()
 # Токен бота
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Адрес Bot API; пусто - api.telegram.org. Для замеров - локальный fake_api.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
 # ID администраторов (замените на ваш ID)
 ADMIN_IDS = [1029372329]  # Здесь укажите ваш Telegram ID
 
 # Настройки базы данных
 DB_PATH = "football_bot.db"
+DB_READERS = 4  # Количество соединений-читателей в пуле
+LEDGER_FLUSH_INTERVAL_MS = 500  # Как часто сбрасывать начисленные очки в базу
+LEDGER_FLUSH_EVENTS = 200  # ...или после стольких начислений
+
+# Настройки хранилища состояний FSM
+FSM_CACHE_SIZE = 10000  # Сколько активных сессий держать в памяти
+FSM_TTL_HOURS = 7 * 24  # Через сколько часов простоя состояние удаляется
+FSM_FLUSH_INTERVAL_MS = 1000  # Как часто сохранять изменения в базу
+
+# Карточки-превью курсов и уроков
+PREVIEWS_DIR = "previews"  # Куда сохраняются сгенерированные картинки
+PREVIEW_WORKERS = 2  # Процессов для обработки изображений
+PREVIEW_FONT = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"  # Шрифт с кириллицей
+
+# Режим получения обновлений: "polling" или "webhook"
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+
+# Настройки webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Внешний адрес, например https://bot.example.com
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = 16  # Сколько обновлений обрабатывается одновременно
+WEBHOOK_QUEUE_SIZE = 1000  # Сколько обновлений может ждать обработки
+
+# Количество процессов-обработчиков (больше 1 - режим супервизора с шардированием по пользователям)
+WORKERS = int(os.getenv("WORKERS", "1"))
+SHARD_LANES = 16  # Сколько пользователей каждый процесс обслуживает параллельно
+LEADERBOARD_REFRESH_SEC = 60  # Как часто процессы перечитывают общий рейтинг из базы
+CACHE_CHECK_SEC = 5  # Как часто процессы проверяют, не изменил ли другой процесс уроки, курсы и т.п.
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics (0 - выключены)
+# Процессы-обработчики слушают METRICS_PORT + 1 + номер процесса
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Профилирование работающего бота: /profile [секунды] или kill -USR1 <pid>
+PROFILE_DIR = "profiles"  # Куда пишутся collapsed stacks и сводки
+PROFILE_SECONDS = 30  # Длительность по умолчанию
+PROFILE_MAX_SECONDS = 300
+PROFILE_STALL_MS = 100  # Зависание event loop дольше этого попадает в отчёт
+
+# Ограничение входящих запросов одного пользователя
+THROTTLE_RATE = 2  # Обновлений в секунду
+THROTTLE_BURST = 8  # Сколько обновлений можно прислать подряд
+CALLBACK_DEDUP_MS = 1000  # Повтор той же кнопки в этом окне не обрабатывается
+THROTTLE_MAX_USERS = 50000  # Сколько пользователей держать в памяти
+
+EDIT_CACHE_SIZE = 50000  # Сколько сообщений помнить, чтобы не повторять одинаковые правки
+
+# Лимиты Telegram на исходящие сообщения
+TG_GLOBAL_RATE = 30  # Сообщений в секунду на весь бот
+TG_CHAT_RATE = 1  # Сообщений в секунду в один чат
+TG_CHAT_BURST = 3  # Сколько сообщений в чат можно отправить подряд без ожидания
+# При WORKERS > 1 рассылки отправляет только процесс-обработчик 0, и эта доля
+# TG_GLOBAL_RATE отдана ему под рассылки; остаток поровну делят все процессы
+# на ответы пользователям. В одном процессе рассылки просто уступают ответам
+TG_BROADCAST_SHARE = 0.5
+BROADCAST_POLL_SEC = 5  # Как часто процесс 0 ищет рассылки, запущенные в других процессах
 
 # Настройки платежей
 PAYMENT_PROVIDER_TOKEN = ""  # Заполните позже
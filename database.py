@@ -1,191 +1,441 @@
-import sqlite3
 import asyncio
+import logging
+import sqlite3
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Optional, Dict
+from typing import Awaitable, Callable, List, Optional, Dict, TypeVar
+
+import aiosqlite
+
+from catalog import CourseCatalog
+from completions import CompletionIndex
+from entitlements import EntitlementCache
+from leaderboard import Leaderboard
+from lessons import LessonIndex
+from media import MediaRegistry
+from ledger import PointsLedger
+from migrations import apply_migrations, rebuild_user_stats
+from stats import StatsService
+
+T = TypeVar("T")
+
+def _in_transaction(conn: sqlite3.Connection, work: Callable[[sqlite3.Connection], T]) -> T:
+    try:
+        result = work(conn)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    return result
+
+def _fetch(conn: sqlite3.Connection, query: str, params: tuple, many: bool):
+    cursor = conn.execute(query, params)
+    try:
+        return cursor.fetchall() if many else cursor.fetchone()
+    finally:
+        cursor.close()
 
 class Database:
-    def __init__(self, db_path: str):
+    """Асинхронный доступ к SQLite через пул постоянных соединений.
+
+    Одно соединение-писатель (запись сериализуется блокировкой) и несколько
+    соединений-читателей. База работает в режиме WAL, поэтому чтение не
+    блокируется записью, а сам диск не блокирует event loop.
+
+    Кэши справочников (уроки, медиа и т.д.) в каждом процессе свои. После
+    изменения данных кэш вызывает bump_cache, и версия в cache_versions
+    растёт; остальные процессы раз в cache_check секунд сверяют версии и
+    перечитывают устаревшие кэши (см. watch_cache).
+    """
+
+    def __init__(self, db_path: str, readers: int = 4,
+                 flush_interval: float = 0.5, flush_events: int = 200,
+                 leaderboard_refresh: float = 0, cache_check: float = 0):
         self.db_path = db_path
-        self.init_db()
-    
-    def init_db(self):
-        """Создание таблиц в базе данных"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Таблица пользователей
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                full_name TEXT,
-                registration_date TIMESTAMP,
-                total_points INTEGER DEFAULT 0,
-                current_course_id INTEGER,
-                subscription_active BOOLEAN DEFAULT 0
-            )
-        ''')
-        
-        # Таблица курсов
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS courses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT NOT NULL,
-                description TEXT,
-                price INTEGER,
-                duration_days INTEGER,
-                is_active BOOLEAN DEFAULT 1
-            )
-        ''')
-        
-        # Таблица уроков
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS lessons (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                course_id INTEGER,
-                title TEXT NOT NULL,
-                description TEXT,
-                video_file_id TEXT,
-                lesson_order INTEGER,
-                points_reward INTEGER DEFAULT 10,
-                FOREIGN KEY (course_id) REFERENCES courses (id)
-            )
-        ''')
-        
-        # Таблица заданий
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                lesson_id INTEGER,
-                title TEXT NOT NULL,
-                description TEXT,
-                task_type TEXT,
-                points_reward INTEGER DEFAULT 20,
-                correct_answers TEXT,
-                FOREIGN KEY (lesson_id) REFERENCES lessons (id)
-            )
-        ''')
-        
-        # Таблица прогресса
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_progress (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                lesson_id INTEGER,
-                task_id INTEGER,
-                completed_at TIMESTAMP,
-                points_earned INTEGER,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Добавим несколько тестовых курсов
-        cursor.execute('SELECT COUNT(*) FROM courses')
-        if cursor.fetchone()[0] == 0:
-            test_courses = [
-                ("Основы футбола", "Базовый курс для начинающих", 1990, 30),
-                ("Продвинутая техника", "Курс для опытных игроков", 2990, 45),
-                ("Мастер-класс", "Профессиональный уровень", 4990, 60)
-            ]
-            cursor.executemany('''
-                INSERT INTO courses (title, description, price, duration_days)
-                VALUES (?, ?, ?, ?)
-            ''', test_courses)
-        
-        conn.commit()
-        conn.close()
-    
-    def add_user(self, user_id: int, username: str, full_name: str):
+        self.readers = readers
+        # В режиме нескольких процессов рейтинг периодически перечитывается
+        self.leaderboard_refresh = leaderboard_refresh
+        self._refresh_task: Optional[asyncio.Task] = None
+        # ...а версии кэшей сверяются с cache_versions
+        self.cache_check = cache_check
+        self._check_task: Optional[asyncio.Task] = None
+        # Имя кэша -> версия, с которой он загружен в этом процессе
+        self._cache_versions: Dict[str, int] = {}
+        # Имя кэша -> перезагрузка; проверяются в порядке регистрации
+        self._cache_reloaders: Dict[str, Callable[[], Awaitable[None]]] = {}
+        self.ledger = PointsLedger(self, flush_interval, flush_events)
+        self.catalog = CourseCatalog(self)
+        self.media = MediaRegistry(self)
+        self.lessons = LessonIndex(self)
+        self.entitlements = EntitlementCache(self)
+        self.leaderboard = Leaderboard()
+        self.completions = CompletionIndex(self)
+        self.stats = StatsService(self)
+        self.watch_cache("catalog", self.catalog.load)
+        # Медиа раньше уроков: уроки берут из реестра file_id видео
+        self.watch_cache("media", self.media.load)
+        self.watch_cache("lessons", self.lessons.load)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._reader_pool: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._reader_conns: List[aiosqlite.Connection] = []
+        # Вызывается с текстом каждого SQL-запроса (для замеров, см. benchmarks)
+        self.trace: Optional[Callable[[str], None]] = None
+
+    async def _open(self) -> aiosqlite.Connection:
+        # sqlite3 сам кэширует подготовленные выражения по тексту запроса
+        conn = await aiosqlite.connect(self.db_path, cached_statements=256)
+        await conn.execute('PRAGMA busy_timeout = 5000')
+        if self.trace is not None:
+            await conn.set_trace_callback(self.trace)
+        return conn
+
+    async def connect(self):
+        """Открытие пула соединений и создание таблиц"""
+        if self._writer is not None:
+            return
+
+        self._writer = await self._open()
+        await self._writer.execute('PRAGMA journal_mode = WAL')
+        await self._writer.execute('PRAGMA synchronous = NORMAL')
+        await self.init_db()
+
+        for _ in range(self.readers):
+            conn = await self._open()
+            await conn.execute('PRAGMA query_only = 1')
+            self._reader_conns.append(conn)
+            self._reader_pool.put_nowait(conn)
+
+        # Версии - до загрузки кэшей: изменение во время загрузки перечитается
+        self._cache_versions = dict(await self.fetchall(
+            'SELECT name, version FROM cache_versions'
+        ))
+        await self.catalog.load()
+        await self.media.load()
+        await self.lessons.load()
+        await self.leaderboard.load(self)
+        await self.stats.load()
+        self.ledger.start()
+        if self.leaderboard_refresh:
+            self._refresh_task = asyncio.create_task(self._refresh_leaderboard_loop())
+        if self.cache_check:
+            self._check_task = asyncio.create_task(self._check_caches_loop())
+
+    async def close(self):
+        """Сброс журнала очков и закрытие всех соединений пула"""
+        for task in (self._refresh_task, self._check_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._refresh_task = self._check_task = None
+
+        if self._writer is not None:
+            await self.ledger.stop()
+
+        for conn in self._reader_conns:
+            await conn.close()
+        self._reader_conns.clear()
+        self._reader_pool = asyncio.Queue()
+
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Соединение-писатель в рамках одной транзакции"""
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    async def write_batch(self, work: Callable[[sqlite3.Connection], T]) -> T:
+        """work(conn) одной транзакцией в потоке соединения-писателя.
+
+        Запросы work идут подряд без перехода в поток на каждый из них,
+        поэтому блокировка записи держится ровно столько, сколько работает
+        SQLite. work получает синхронное sqlite3.Connection.
+        """
+        async with self._write_lock:
+            # aiosqlite выполняет функции по очереди в потоке соединения
+            return await self._writer._execute(_in_transaction, self._writer._conn, work)
+
+    @asynccontextmanager
+    async def reader(self):
+        """Свободное соединение-читатель из пула"""
+        conn = await self._reader_pool.get()
+        try:
+            yield conn
+        finally:
+            self._reader_pool.put_nowait(conn)
+
+    async def execute(self, query: str, params: tuple = ()):
+        """Выполнение одного изменяющего запроса"""
+        async with self.transaction() as conn:
+            await conn.execute(query, params)
+
+    async def fetchone(self, query: str, params: tuple = ()) -> Optional[tuple]:
+        async with self.reader() as conn:
+            # Запрос и выборка за один переход в поток соединения
+            return await conn._execute(_fetch, conn._conn, query, params, False)
+
+    async def fetchall(self, query: str, params: tuple = ()) -> List[tuple]:
+        async with self.reader() as conn:
+            return await conn._execute(_fetch, conn._conn, query, params, True)
+
+    async def init_db(self):
+        """Создание и обновление схемы базы миграциями"""
+        async with self._write_lock:
+            await apply_migrations(self._writer)
+
+    async def add_user(self, user_id: int, username: str, full_name: str):
         """Добавление нового пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR IGNORE INTO users (user_id, username, full_name, registration_date)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, username, full_name, datetime.now()))
-        conn.commit()
-        conn.close()
-    
-    def get_user_points(self, user_id: int) -> int:
+        stats = self.stats.registration()
+
+        def work(conn: sqlite3.Connection) -> bool:
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO users (user_id, username, full_name, registration_date)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, username, full_name, datetime.now()))
+            created = bool(cursor.rowcount)
+            if created:
+                conn.execute(*StatsService.upsert(stats))
+            conn.execute('INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)', (user_id,))
+            return created
+
+        # /start приходит от каждого нового пользователя: одна транзакция за один переход в поток
+        if await self.write_batch(work):
+            self.stats.apply(stats)
+        self.leaderboard.add_user(user_id, full_name)
+
+    async def get_user_points(self, user_id: int) -> int:
         """Получение очков пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT total_points FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else 0
-    
-    def add_points(self, user_id: int, points: int):
-        """Добавление очков пользователю"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE users SET total_points = total_points + ? WHERE user_id = ?
-        ''', (points, user_id))
-        conn.commit()
-        conn.close()
-    
-    def get_courses(self) -> List[tuple]:
+        result = await self.fetchone(
+            'SELECT total_points FROM users WHERE user_id = ?', (user_id,)
+        )
+        return (result[0] if result else 0) + self.ledger.pending_points(user_id)
+
+    async def add_points(self, user_id: int, points: int):
+        """Добавление очков пользователю (запись в базу - пакетом через журнал)"""
+        self.ledger.add_points(user_id, points)
+        self.leaderboard.add_points(user_id, points)
+
+    async def get_courses(self) -> List[tuple]:
         """Получение всех активных курсов"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT id, title, description, price FROM courses WHERE is_active = 1')
-        courses = cursor.fetchall()
-        conn.close()
-        return courses
-    
-    def get_user_progress(self, user_id: int) -> Dict:
-        """Получение прогресса пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Общие очки
-        cursor.execute('SELECT total_points FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        total_points = result[0] if result else 0
-        
-        # Количество пройденных уроков
-        cursor.execute('''
-            SELECT COUNT(DISTINCT lesson_id) FROM user_progress 
-            WHERE user_id = ? AND lesson_id IS NOT NULL
-        ''', (user_id,))
-        completed_lessons = cursor.fetchone()[0]
-        
-        # Количество выполненных заданий
-        cursor.execute('''
-            SELECT COUNT(*) FROM user_progress 
-            WHERE user_id = ? AND task_id IS NOT NULL
+        return await self.fetchall(
+            'SELECT id, title, description, price FROM courses WHERE is_active = 1'
+        )
+
+    def get_course(self, course_id: int) -> Optional[tuple]:
+        """Активный курс по id из кэша каталога"""
+        return self.catalog.get_course(course_id)
+
+    def list_courses(self) -> List[tuple]:
+        """Все активные курсы из кэша каталога"""
+        return self.catalog.list_courses()
+
+    async def add_course(self, title: str, description: str, price: int, duration_days: int):
+        """Добавление курса (для администраторов)"""
+        await self.execute('''
+            INSERT INTO courses (title, description, price, duration_days)
+            VALUES (?, ?, ?, ?)
+        ''', (title, description, price, duration_days))
+        await self.catalog.invalidate()
+
+    async def set_course_active(self, course_id: int, is_active: bool):
+        """Включение или скрытие курса (для администраторов)"""
+        await self.execute(
+            'UPDATE courses SET is_active = ? WHERE id = ?', (int(is_active), course_id)
+        )
+        await self.catalog.invalidate()
+
+    async def get_user_progress(self, user_id: int) -> Dict:
+        """Получение прогресса пользователя из счётчиков user_stats"""
+        row = await self.fetchone('''
+            SELECT completed_lessons, completed_tasks, total_points, last_activity
+            FROM user_stats WHERE user_id = ?
         ''', (user_id,))
-        completed_tasks = cursor.fetchone()[0]
-        
-        conn.close()
-        
+        completed_lessons, completed_tasks, total_points, last_activity = row or (0, 0, 0, None)
+        # Несброшенные выполнения добавляем к счётчикам без сброса журнала
+        pending_lessons, pending_tasks = self.ledger.pending_counts(user_id)
+
         return {
-            'total_points': total_points,
-            'completed_lessons': completed_lessons,
-            'completed_tasks': completed_tasks
+            'total_points': total_points + self.ledger.pending_points(user_id),
+            'completed_lessons': completed_lessons + pending_lessons,
+            'completed_tasks': completed_tasks + pending_tasks,
+            'last_activity': last_activity
         }
-    
-    def record_lesson_completion(self, user_id: int, lesson_id: int, points: int):
+
+    async def rebuild_user_stats(self):
+        """Пересчёт всех счётчиков прогресса по истории user_progress"""
+        await self.ledger.flush()
+        async with self.transaction() as conn:
+            await rebuild_user_stats(conn)
+
+    async def verify_user_stats(self) -> List[int]:
+        """Пользователи, у которых счётчики расходятся с историей"""
+        await self.ledger.flush()
+        rows = await self.fetchall('''
+            SELECT u.user_id
+            FROM users u
+            LEFT JOIN user_stats s ON s.user_id = u.user_id
+            LEFT JOIN (
+                SELECT user_id,
+                       COUNT(DISTINCT lesson_id) AS lessons,
+                       COUNT(task_id) AS tasks
+                FROM user_progress GROUP BY user_id
+            ) p ON p.user_id = u.user_id
+            WHERE s.user_id IS NULL
+               OR s.completed_lessons != IFNULL(p.lessons, 0)
+               OR s.completed_tasks != IFNULL(p.tasks, 0)
+               OR s.total_points != IFNULL(u.total_points, 0)
+        ''')
+        return [user_id for (user_id,) in rows]
+
+    async def complete(self, user_id: int, completion_key: str, points: int,
+                       lesson_id: Optional[int] = None, task_id: Optional[int] = None) -> bool:
+        """Однократное выполнение с начислением очков.
+
+        Возвращает False (ничего не записывая), если это выполнение уже было.
+        """
+        if not await self.completions.claim(user_id, completion_key):
+            return False
+        self.ledger.add_progress(user_id, completion_key, lesson_id, task_id, points)
+        self.leaderboard.add_points(user_id, points)
+        return True
+
+    async def record_lesson_completion(self, user_id: int, lesson_id: int, points: int) -> bool:
         """Записать завершение урока"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO user_progress (user_id, lesson_id, completed_at, points_earned)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, lesson_id, datetime.now(), points))
-        conn.commit()
-        conn.close()
-        self.add_points(user_id, points)
-    
-    def record_task_completion(self, user_id: int, task_id: int, points: int):
+        return await self.complete(user_id, f"lesson:{lesson_id}", points, lesson_id=lesson_id)
+
+    async def record_task_completion(self, user_id: int, task_id: int, points: int) -> bool:
         """Записать выполнение задания"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO user_progress (user_id, task_id, completed_at, points_earned)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, task_id, datetime.now(), points))
-        conn.commit()
-        conn.close()
-        self.add_points(user_id, points)
\ No newline at end of file
+        return await self.complete(user_id, f"task:{task_id}", points, task_id=task_id)
+
+    async def activate_subscription(self, user_id: int, course_id: int) -> bool:
+        """Активация курса для пользователя.
+
+        Возвращает False, если этот курс у пользователя уже активен: повтор
+        оплаты (или её подтверждения) не считается новой покупкой.
+        """
+        stats = self.stats.purchase(course_id)
+
+        def work(conn: sqlite3.Connection) -> bool:
+            cursor = conn.execute('''
+                UPDATE users SET subscription_active = 1, current_course_id = ?
+                WHERE user_id = ?
+                  AND NOT (subscription_active = 1 AND current_course_id IS ?)
+            ''', (course_id, user_id, course_id))
+            activated = bool(cursor.rowcount)
+            if activated:
+                conn.execute(*StatsService.upsert(stats))
+            return activated
+
+        activated = await self.write_batch(work)
+        if activated:
+            self.stats.apply(stats)
+        self.entitlements.set(user_id, course_id)
+        return activated
+
+    async def attach_lesson_media(self, lesson_id: int, media_id: int) -> bool:
+        """Привязать видео из реестра к уроку (для администраторов)"""
+        if self.lessons.get(lesson_id) is None or self.media.get(media_id) is None:
+            return False
+        await self.execute('UPDATE lessons SET media_id = ? WHERE id = ?', (media_id, lesson_id))
+        await self.lessons.invalidate()
+        return True
+
+    async def has_course_access(self, user_id: int, course_id: int) -> bool:
+        """Оплачен ли курс пользователем (из кэша доступа)"""
+        return await self.entitlements.has_access(user_id, course_id)
+
+    def get_rating(self, user_id: int, top: int = 10, radius: int = 2) -> Dict:
+        """Рейтинг: первые места, место пользователя и его соседи"""
+        return {
+            'top': self.leaderboard.top(top),
+            'rank': self.leaderboard.rank(user_id),
+            'around': self.leaderboard.around(user_id, radius),
+            'total_users': len(self.leaderboard)
+        }
+
+    async def refresh_leaderboard(self):
+        """Перечитать рейтинг и статистику из базы (изменения других процессов)"""
+        await self.ledger.flush()
+        await self.stats.load()
+        await self.leaderboard.load(self)
+        # Начисления, пришедшие пока читали таблицу
+        for user_id, points in self.ledger.pending().items():
+            self.leaderboard.add_points(user_id, points)
+
+    def watch_cache(self, name: str, reload: Callable[[], Awaitable[None]]):
+        """Перечитывать кэш name, когда его данные изменит другой процесс"""
+        self._cache_reloaders[name] = reload
+
+    async def bump_cache(self, name: str):
+        """Отметить изменение данных кэша name - для других процессов.
+
+        Вызывается до перезагрузки своего кэша: изменение, сделанное другим
+        процессом после этого, даст более новую версию.
+        """
+        async with self.transaction() as conn:
+            await conn.execute('''
+                INSERT INTO cache_versions (name, version) VALUES (?, 1)
+                ON CONFLICT (name) DO UPDATE SET version = version + 1
+            ''', (name,))
+            async with conn.execute(
+                'SELECT version FROM cache_versions WHERE name = ?', (name,)
+            ) as cursor:
+                (version,) = await cursor.fetchone()
+        self._cache_versions[name] = version
+
+    async def check_caches(self):
+        """Перечитать кэши, версия которых в базе новее загруженной"""
+        versions = dict(await self.fetchall('SELECT name, version FROM cache_versions'))
+        for name, reload in list(self._cache_reloaders.items()):
+            version = versions.get(name, 0)
+            if self._cache_versions.get(name, 0) != version:
+                logging.info("Кэш %s изменён другим процессом, перечитываем", name)
+                await reload()
+                # Версия, прочитанная до загрузки: более позднее изменение
+                # перечитается при следующей проверке
+                self._cache_versions[name] = version
+
+    async def _check_caches_loop(self):
+        while True:
+            await asyncio.sleep(self.cache_check)
+            try:
+                await self.check_caches()
+            except Exception:
+                logging.exception("Не удалось проверить версии кэшей")
+
+    async def _refresh_leaderboard_loop(self):
+        while True:
+            await asyncio.sleep(self.leaderboard_refresh)
+            try:
+                await self.refresh_leaderboard()
+            except Exception:
+                logging.exception("Не удалось обновить рейтинг")
+
+    def get_admin_stats(self) -> Dict:
+        """Сводная статистика для админ-панели (из памяти, без запросов)"""
+        # Топ пользователь по очкам - из рейтинга в памяти
+        top = self.leaderboard.top(1)
+        top_user = (top[0][2], top[0][3]) if top else None
+
+        return {
+            'total_users': self.stats.total('users'),
+            # Очки из журнала, ещё не сброшенные в базу, тоже учитываем
+            'total_points': self.stats.total('points') + sum(self.ledger.pending().values()),
+            'active_courses': len(self.list_courses()),
+            'top_user': top_user,
+            'purchases': self.stats.total('purchases'),
+            'today': self.stats.day(),
+            'recent': self.stats.recent(7),
+            'funnels': {
+                course[0]: self.stats.funnel(course[0]) for course in self.list_courses()
+            }
+        }
@@ -0,0 +1,149 @@
+import itertools
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import (
+    AnswerCallbackQuery, DeleteMessage, EditMessageCaption, EditMessageMedia,
+    EditMessageReplyMarkup, EditMessageText, SendMessage, SendPhoto, SendVideo
+)
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message, TelegramObject
+
+from metrics import metrics
+
+# Поля, от которых зависит вид сообщения: текстового и с подписью
+TEXT_FIELDS = ("text", "parse_mode", "entities", "link_preview_options",
+               "disable_web_page_preview", "reply_markup")
+CAPTION_FIELDS = ("caption", "parse_mode", "caption_entities", "reply_markup")
+
+FINGERPRINTED = {
+    SendMessage: TEXT_FIELDS,
+    EditMessageText: TEXT_FIELDS,
+    SendPhoto: CAPTION_FIELDS,
+    SendVideo: CAPTION_FIELDS,
+    EditMessageCaption: CAPTION_FIELDS,
+}
+# После этих вызовов прежний вид сообщения неизвестен
+FORGETTING = (EditMessageMedia, EditMessageReplyMarkup, DeleteMessage)
+
+# Нажатие кнопки, которое сейчас обрабатывается: [id, уже отвечено]
+_callback: ContextVar[Optional[list]] = ContextVar("edit_callback", default=None)
+
+def fingerprint(method) -> int:
+    fields = FINGERPRINTED[type(method)]
+    values = []
+    for field in fields:
+        value = getattr(method, field, None)
+        values.append(value.model_dump() if hasattr(value, "model_dump") else value)
+    return hash(repr((fields, values)))
+
+class EditCache(BaseRequestMiddleware):
+    """Middleware сессии бота: не отправлять правки, которые ничего не меняют.
+
+    Для каждого (chat_id, message_id) помнится отпечаток последнего
+    показанного текста или подписи вместе с клавиатурой. Если правка
+    совпадает с ним, запрос в Telegram не уходит (он всё равно вернул бы
+    "message is not modified"), а нажатая кнопка, если на неё ещё не
+    ответили, получает пустой answerCallbackQuery. Подключается к сессии
+    раньше OutboundScheduler, чтобы пропущенные правки не тратили лимиты.
+    В памяти держится не больше max_messages сообщений.
+
+    Планировщик может не отправить правку, если за ней в очереди встала
+    более свежая правка того же сообщения: тогда её вызов получит результат
+    свежей. Поэтому отпечаток запоминается, только если после правки не
+    начиналась другая правка этого сообщения - иначе в кэше оказался бы
+    текст, которого пользователь не видит.
+    """
+
+    def __init__(self, max_messages: int = 50000):
+        self.max_messages = max_messages
+        self._messages: "OrderedDict[Tuple[Any, int], int]" = OrderedDict()
+        # (chat_id, message_id) -> номер последней начатой правки
+        self._latest: Dict[Tuple[Any, int], int] = {}
+        self._tickets = itertools.count()
+
+    def _remember(self, key: Tuple[Any, int], value: int):
+        self._messages[key] = value
+        self._messages.move_to_end(key)
+        while len(self._messages) > self.max_messages:
+            self._messages.popitem(last=False)
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, AnswerCallbackQuery):
+            current = _callback.get()
+            if current is not None and current[0] == method.callback_query_id:
+                current[1] = True
+            return await make_request(bot, method)
+
+        if isinstance(method, FORGETTING):
+            if method.message_id is not None:
+                self._messages.pop((method.chat_id, method.message_id), None)
+            return await make_request(bot, method)
+
+        if type(method) not in FINGERPRINTED:
+            return await make_request(bot, method)
+
+        editing = isinstance(method, (EditMessageText, EditMessageCaption))
+        if editing and method.message_id is None:
+            # Inline-сообщения не запоминаем
+            return await make_request(bot, method)
+        if not editing and not isinstance(method.reply_markup, InlineKeyboardMarkup):
+            # Править будут только сообщения с inline-кнопками
+            return await make_request(bot, method)
+
+        value = fingerprint(method)
+        if not editing:
+            result = await make_request(bot, method)
+            if isinstance(result, Message):
+                self._remember((result.chat.id, result.message_id), value)
+            return result
+
+        key = (method.chat_id, method.message_id)
+        if self._messages.get(key) == value:
+            self._messages.move_to_end(key)
+            await self._skip(make_request, bot)
+            return True
+
+        ticket = self._latest[key] = next(self._tickets)
+        try:
+            result = await make_request(bot, method)
+        except TelegramBadRequest as e:
+            if "message is not modified" in e.message:
+                # Вид уже такой - например, правку отправил другой процесс
+                if self._latest.get(key) == ticket:
+                    self._remember(key, value)
+                await self._skip(make_request, bot)
+                return True
+            self._messages.pop(key, None)
+            raise
+        except BaseException:
+            self._messages.pop(key, None)
+            raise
+        else:
+            if self._latest.get(key) == ticket:
+                self._remember(key, value)
+            return result
+        finally:
+            if self._latest.get(key) == ticket:
+                del self._latest[key]
+
+    async def _skip(self, make_request, bot):
+        metrics.edits_skipped.inc()
+        current = _callback.get()
+        if current is not None and not current[1]:
+            current[1] = True
+            await make_request(bot, AnswerCallbackQuery(callback_query_id=current[0]))
+
+class CallbackScopeMiddleware(BaseMiddleware):
+    """Внешний middleware dp.callback_query: какая кнопка сейчас обрабатывается"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: CallbackQuery, data: Dict[str, Any]) -> Any:
+        token = _callback.set([event.id, False])
+        try:
+            return await handler(event, data)
+        finally:
+            _callback.reset(token)
@@ -0,0 +1,49 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Доступ пользователя: (подписка активна, id оплаченного курса)
+Entitlement = Tuple[bool, Optional[int]]
+
+class EntitlementCache:
+    """Доступ пользователей к курсам из users.subscription_active/current_course_id.
+
+    Читается из базы при первой проверке и дальше берётся из памяти;
+    активация курса обновляет кэш сразу после записи. Обновления одного
+    пользователя всегда обрабатывает один и тот же процесс (см. sharding),
+    поэтому кэш не устаревает. В памяти держится не больше max_users.
+    """
+
+    def __init__(self, db, max_users: int = 10000):
+        self.db = db
+        self.max_users = max_users
+        self._users: "OrderedDict[int, Entitlement]" = OrderedDict()
+
+    def _remember(self, user_id: int, entitlement: Entitlement):
+        self._users[user_id] = entitlement
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    async def get(self, user_id: int) -> Entitlement:
+        entitlement = self._users.get(user_id)
+        if entitlement is not None:
+            self._users.move_to_end(user_id)
+            return entitlement
+
+        row = await self.db.fetchone(
+            'SELECT subscription_active, current_course_id FROM users WHERE user_id = ?',
+            (user_id,)
+        )
+        entitlement = (bool(row[0]), row[1]) if row else (False, None)
+        # Пока шёл запрос, курс мог быть активирован - свежая запись важнее
+        if user_id not in self._users:
+            self._remember(user_id, entitlement)
+        return self._users.get(user_id, entitlement)
+
+    def set(self, user_id: int, course_id: int):
+        """Курс активирован для пользователя"""
+        self._remember(user_id, (True, course_id))
+
+    async def has_access(self, user_id: int, course_id: int) -> bool:
+        active, current_course_id = await self.get(user_id)
+        return active and current_course_id == course_id
@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientSession, web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+class FakeBotAPI:
+    """Локальная замена Bot API для нагрузочных и интеграционных прогонов.
+
+    Отвечает на методы, которыми пользуется бот, с заданной задержкой,
+    иногда - ошибкой 429 (flood control), и записывает каждый вызов.
+    Обновления отдаются боту через getUpdates или доставляются POST-запросом
+    на webhook, если бот его зарегистрировал. Бот направляется сюда через
+    TELEGRAM_API_URL в config.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0,
+                 flood_rate: float = 0.0, retry_after: int = 1, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        # retry_after = 0 aiogram не считает flood control - Telegram так и не отвечает
+        self.retry_after = max(1, retry_after)
+        self.calls: List[Dict[str, Any]] = []
+        self.webhook_url = ""
+        self.webhook_secret = ""
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._updates: List[dict] = []
+        self._new_updates = asyncio.Event()
+        self._client: Optional[ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._methods = {
+            "getme": self._get_me,
+            "getupdates": self._get_updates,
+            "setwebhook": self._set_webhook,
+            "deletewebhook": self._delete_webhook,
+            "sendmessage": self._send_message,
+            "sendvideo": self._send_message,
+            "sendphoto": self._send_message,
+            "sendinvoice": self._send_message,
+            "editmessagetext": self._edit_message,
+            "editmessagecaption": self._edit_message,
+            "editmessagemedia": self._edit_message,
+        }
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        # Служебные ручки для скриптов замеров
+        app.router.add_get("/_fake/calls", self._calls_view)
+        app.router.add_post("/_fake/updates", self._updates_view)
+        app.router.add_post("/_fake/reset", self._reset_view)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        self._client = ClientSession()
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def reset(self):
+        """Забыть записанные вызовы и недоставленные обновления"""
+        self.calls.clear()
+        self._updates.clear()
+
+    async def push_update(self, update: dict) -> dict:
+        """Новое обновление для бота: на webhook или в очередь getUpdates"""
+        update.setdefault("update_id", next(self._update_ids))
+        if self.webhook_url:
+            headers = {}
+            if self.webhook_secret:
+                headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook_secret
+            async with self._client.post(self.webhook_url, json=update, headers=headers) as response:
+                if response.status != 200:
+                    # Как и Telegram, оставляем обновление до следующей попытки
+                    self._updates.append(update)
+        else:
+            self._updates.append(update)
+            self._new_updates.set()
+        return update
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        started = time.monotonic()
+
+        delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+
+        # getUpdates и служебные вызовы не ограничиваются, как и у Telegram
+        limited = method.lower() not in ("getupdates", "getme", "setwebhook", "deletewebhook")
+        if limited and self.flood_rate and self._random.random() < self.flood_rate:
+            self._record(method, params, started, 429)
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        handler = self._methods.get(method.lower())
+        result = await handler(params) if handler else True
+        self._record(method, params, started, 200)
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            # Загружаемые файлы записываем только по имени
+            params[key] = value if isinstance(value, str) else f"<file {value.filename}>"
+        return params
+
+    def _record(self, method: str, params: Dict[str, Any], started: float, status: int):
+        self.calls.append({
+            "method": method,
+            "params": params,
+            "status": status,
+            "at": time.time(),
+            "duration": time.monotonic() - started,
+        })
+
+    def _message(self, params: Dict[str, Any], message_id: Optional[int] = None) -> dict:
+        chat_id = params.get("chat_id")
+        message = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if chat_id is not None else 0, "type": "private"},
+            "from": BOT_USER,
+        }
+        for field in ("text", "caption"):
+            if field in params:
+                message[field] = params[field]
+        return message
+
+    async def _get_me(self, params):
+        return BOT_USER
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+    async def _set_webhook(self, params):
+        self.webhook_url = params.get("url", "")
+        self.webhook_secret = params.get("secret_token", "")
+        return True
+
+    async def _delete_webhook(self, params):
+        self.webhook_url = ""
+        self.webhook_secret = ""
+        if str(params.get("drop_pending_updates")).lower() == "true":
+            self._updates.clear()
+        return True
+
+    async def _send_message(self, params):
+        return self._message(params)
+
+    async def _edit_message(self, params):
+        if params.get("inline_message_id"):
+            return True
+        return self._message(params, int(params.get("message_id") or 0) or None)
+
+    async def _calls_view(self, request: web.Request) -> web.Response:
+        return web.json_response(self.calls)
+
+    async def _updates_view(self, request: web.Request) -> web.Response:
+        update = await self.push_update(await request.json())
+        return web.json_response({"update_id": update["update_id"]})
+
+    async def _reset_view(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Локальный Bot API для замеров")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, сек")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--calls-log", help="куда записать вызовы (JSON) при остановке")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    api = FakeBotAPI(args.latency, args.jitter, args.flood_rate, args.retry_after)
+    await api.start(args.host, args.port)
+    logging.info("Fake Bot API: http://%s:%s (TELEGRAM_API_URL)", args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+        if args.calls_log:
+            with open(args.calls_log, "w") as file:
+                json.dump(api.calls, file, ensure_ascii=False)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+# (state, data, время последнего обращения)
+Record = Tuple[Optional[str], Dict[str, Any], float]
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в базе бота с LRU-кэшем горячих сессий.
+
+    - в памяти держится не больше cache_size сессий, остальные
+      подгружаются из таблицы fsm_states по запросу;
+    - изменения копятся и записываются пачкой раз в flush_interval секунд;
+    - состояния, к которым не обращались дольше ttl секунд, удаляются
+      и из памяти, и из базы. Чтение тоже считается обращением: прочитанная
+      сессия попадает в очередную пачку записи, и её updated_at обновляется.
+    """
+
+    def __init__(self, db, cache_size: int = 10000, ttl: float = 7 * 24 * 3600,
+                 flush_interval: float = 1.0):
+        self.db = db
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._cache: "OrderedDict[str, Record]" = OrderedDict()
+        # Изменённые, но ещё не записанные сессии
+        self._dirty: Dict[str, Record] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return (
+            f"{key.bot_id}:{key.chat_id}:{key.user_id}:"
+            f"{key.thread_id or ''}:{key.destiny}"
+        )
+
+    def start(self):
+        """Запуск фоновой записи изменений"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                self._evict_expired()
+            except Exception:
+                logging.exception("Не удалось сохранить состояния FSM")
+
+    def _expired(self, record: Record, now: float) -> bool:
+        return now - record[2] > self.ttl
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        # Самые старые записи находятся в начале OrderedDict
+        while self._cache:
+            key, record = next(iter(self._cache.items()))
+            if not self._expired(record, now):
+                break
+            del self._cache[key]
+
+    def _remember(self, key: str, record: Record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            # Несохранённые записи остаются в _dirty, так что их можно вытеснять
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> Record:
+        now = time.monotonic()
+        record = self._cache.get(key) or self._dirty.get(key)
+        if record is not None and not self._expired(record, now):
+            record = (record[0], record[1], now)
+            self._remember(key, record)
+            self._touch(key, record)
+            return record
+
+        row = await self.db.fetchone(
+            'SELECT state, data, updated_at FROM fsm_states WHERE key = ? AND updated_at >= ?',
+            (key, time.time() - self.ttl)
+        )
+        record = (row[0], json.loads(row[1]), now) if row else (None, {}, now)
+        self._remember(key, record)
+        self._touch(key, record)
+        return record
+
+    def _touch(self, key: str, record: Record):
+        # Пустую сессию продлевать незачем: flush удалил бы её строку
+        if record[0] is not None or record[1]:
+            self._dirty[key] = record
+
+    def _store(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        record = (state, data, time.monotonic())
+        self._remember(key, record)
+        self._dirty[key] = record
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        key = self._key(key)
+        _, data, _ = await self._load(key)
+        self._store(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        key = self._key(key)
+        state, _, _ = await self._load(key)
+        self._store(key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data, _ = await self._load(self._key(key))
+        return data.copy()
+
+    async def flush(self):
+        """Запись изменённых сессий одной транзакцией"""
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, {}
+            now = time.time()
+
+            to_save = [
+                (key, state, json.dumps(data, ensure_ascii=False), now)
+                for key, (state, data, _) in dirty.items()
+                if state is not None or data
+            ]
+            to_delete = [
+                (key,) for key, (state, data, _) in dirty.items()
+                if state is None and not data
+            ]
+
+            try:
+                async with self.db.transaction() as conn:
+                    if to_save:
+                        await conn.executemany('''
+                            INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at)
+                            VALUES (?, ?, ?, ?)
+                        ''', to_save)
+                    if to_delete:
+                        await conn.executemany('DELETE FROM fsm_states WHERE key = ?', to_delete)
+                    await conn.execute(
+                        'DELETE FROM fsm_states WHERE updated_at < ?', (now - self.ttl,)
+                    )
+            except Exception:
+                # Не теряем изменения: более свежие записи имеют приоритет
+                for key, record in dirty.items():
+                    self._dirty.setdefault(key, record)
+                raise
@@ -0,0 +1,173 @@
+import random
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Ключ в рейтинге: больше очков - выше, при равенстве - кто раньше пришёл
+Key = Tuple[float, int]
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * levels
+        self.width: List[int] = [0] * levels
+
+class RankedSkipList:
+    """Список с пропусками, хранящий ширину каждой ссылки.
+
+    Вставка, удаление, позиция ключа и ключ по позиции - за O(log n).
+    """
+
+    MAX_LEVELS = 24
+
+    def __init__(self):
+        self.size = 0
+        self._tail = _Node((float("inf"),), 0)
+        self._head = _Node(None, self.MAX_LEVELS)
+        for level in range(self.MAX_LEVELS):
+            self._head.next[level] = self._tail
+            self._head.width[level] = 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _path(self, key) -> Tuple[List[_Node], List[int]]:
+        chain = [self._head] * self.MAX_LEVELS
+        steps = [0] * self.MAX_LEVELS
+        node = self._head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key):
+        chain, steps_at_level = self._path(key)
+        levels = 1
+        while levels < self.MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+
+        node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            previous = chain[level]
+            node.next[level] = previous.next[level]
+            previous.next[level] = node
+            node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._path(key)
+        node = chain[0].next[0]
+        if node.key != key:
+            raise KeyError(key)
+
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, key) -> int:
+        """Позиция ключа, считая с 0"""
+        _, steps = self._path(key)
+        return sum(steps)
+
+    def iter_from(self, index: int) -> Iterator:
+        """Ключи начиная с позиции index"""
+        if index >= self.size:
+            return
+        node = self._head
+        index += 1
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.width[level] <= index:
+                index -= node.width[level]
+                node = node.next[level]
+        while node is not self._tail:
+            yield node.key
+            node = node.next[0]
+
+# Строка рейтинга: (место, user_id, имя, очки)
+Entry = Tuple[int, int, str, int]
+
+class Leaderboard:
+    """Рейтинг пользователей по очкам в памяти.
+
+    Загружается из users при старте (по индексу total_points) и дальше
+    обновляется при каждом начислении очков, поэтому топ, место
+    пользователя и соседи по рейтингу считаются без запросов к базе.
+    """
+
+    def __init__(self):
+        self._index = RankedSkipList()
+        self._scores: Dict[int, int] = {}
+        self._names: Dict[int, str] = {}
+
+    async def load(self, db):
+        """Полная загрузка рейтинга из базы"""
+        rows = await db.fetchall(
+            'SELECT user_id, full_name, total_points FROM users ORDER BY total_points DESC'
+        )
+        self._index = RankedSkipList()
+        self._scores = {}
+        self._names = {}
+        for user_id, full_name, total_points in rows:
+            self.add_user(user_id, full_name, total_points or 0)
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    @staticmethod
+    def _key(user_id: int, points: int) -> Key:
+        return (-points, user_id)
+
+    def add_user(self, user_id: int, full_name: str, points: int = 0):
+        """Новый пользователь (уже известные не меняются)"""
+        if user_id in self._scores:
+            return
+        self._scores[user_id] = points
+        self._names[user_id] = full_name
+        self._index.insert(self._key(user_id, points))
+
+    def add_points(self, user_id: int, points: int):
+        """Начисление очков пользователю из рейтинга"""
+        old = self._scores.get(user_id)
+        if old is None or not points:
+            return
+        self._index.remove(self._key(user_id, old))
+        self._scores[user_id] = old + points
+        self._index.insert(self._key(user_id, old + points))
+
+    def _entries(self, start: int, count: int) -> List[Entry]:
+        entries = []
+        for position, (_, user_id) in enumerate(self._index.iter_from(start), start + 1):
+            if len(entries) >= count:
+                break
+            entries.append((position, user_id, self._names[user_id], self._scores[user_id]))
+        return entries
+
+    def top(self, count: int = 10) -> List[Entry]:
+        """Первые count мест"""
+        return self._entries(0, count)
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Место пользователя, считая с 1"""
+        points = self._scores.get(user_id)
+        if points is None:
+            return None
+        return self._index.index(self._key(user_id, points)) + 1
+
+    def around(self, user_id: int, radius: int = 2) -> List[Entry]:
+        """Пользователь и по radius соседей сверху и снизу"""
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        return self._entries(start, rank - start + radius)
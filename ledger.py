@@ -0,0 +1,226 @@
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from stats import Deltas, StatsService
+
+ProgressRow = Tuple[int, Optional[int], Optional[int], str, datetime, int]
+
+class PointsLedger:
+    """Отложенная запись очков и прогресса.
+
+    Начисления копятся в памяти по пользователям и сбрасываются в SQLite
+    одной транзакцией каждые flush_interval секунд или после max_events
+    событий - что наступит раньше. Несброшенные очки учитываются при чтении
+    через pending_points(). Пока идёт сброс, записываемые изменения тоже
+    считаются несброшенными: до коммита их ещё не видно в базе.
+
+    В той же транзакции обновляются счётчики user_stats (уроки, задания,
+    очки, последняя активность), чтобы прогресс читался одной строкой,
+    и сводные счётчики статистики (см. stats). Весь сброс - несколько
+    запросов на пакет за один переход в поток писателя (Database.write_batch),
+    так что блокировка записи держится недолго при любом размере пакета.
+    """
+
+    def __init__(self, db, flush_interval: float = 0.5, max_events: int = 200):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self._points: Dict[int, int] = {}
+        # user_id -> [(user_id, lesson_id, task_id, completion_key, completed_at, points_earned)]
+        self._progress: Dict[int, List[ProgressRow]] = {}
+        self._activity: Dict[int, datetime] = {}
+        # Изменения, которые сейчас записывает flush
+        self._inflight_points: Dict[int, int] = {}
+        self._inflight_progress: Dict[int, List[ProgressRow]] = {}
+        self._events = 0
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self):
+        """Запуск фоновой задачи сброса"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка фоновой задачи и финальный сброс"""
+        if self._task is not None:
+            # Не cancel(): wait_for в Python 3.11 может проглотить отмену,
+            # если событие сработало одновременно с ней
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+            # Событие привязано к циклу событий, а следующий start() может
+            # быть уже в другом
+            self._wakeup = asyncio.Event()
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Не удалось сбросить журнал очков")
+
+    def _touch(self):
+        self._events += 1
+        if self._events >= self.max_events:
+            self._wakeup.set()
+
+    def add_points(self, user_id: int, points: int):
+        """Начисление очков пользователю"""
+        self._points[user_id] = self._points.get(user_id, 0) + points
+        self._activity[user_id] = datetime.now()
+        self._touch()
+
+    def add_progress(self, user_id: int, completion_key: str, lesson_id: Optional[int],
+                     task_id: Optional[int], points: int):
+        """Запись о прохождении урока, задания или вопроса вместе с очками"""
+        now = datetime.now()
+        self._progress.setdefault(user_id, []).append(
+            (user_id, lesson_id, task_id, completion_key, now, points)
+        )
+        self._points[user_id] = self._points.get(user_id, 0) + points
+        self._activity[user_id] = now
+        self._touch()
+
+    def pending_points(self, user_id: int) -> int:
+        """Ещё не записанные в базу очки пользователя"""
+        return self._points.get(user_id, 0) + self._inflight_points.get(user_id, 0)
+
+    def pending(self) -> Dict[int, int]:
+        """Все ещё не записанные очки по пользователям"""
+        pending = dict(self._inflight_points)
+        for user_id, points in self._points.items():
+            pending[user_id] = pending.get(user_id, 0) + points
+        return pending
+
+    def _pending_rows(self, user_id: int) -> List[ProgressRow]:
+        return self._inflight_progress.get(user_id, []) + self._progress.get(user_id, [])
+
+    def has_pending_progress(self, user_id: int) -> bool:
+        return user_id in self._progress or user_id in self._inflight_progress
+
+    def pending_keys(self, user_id: int) -> Set[str]:
+        """Ключи ещё не записанных выполнений пользователя"""
+        return {row[3] for row in self._pending_rows(user_id)}
+
+    def pending_counts(self, user_id: int) -> Tuple[int, int]:
+        """Ещё не записанные уроки и задания пользователя: (уроки, задания)"""
+        rows = self._pending_rows(user_id)
+        return (sum(row[1] is not None for row in rows),
+                sum(row[2] is not None for row in rows))
+
+    @staticmethod
+    def _write(rows: List[ProgressRow], points: Dict[int, int], activity: Dict[int, datetime],
+               unseen: List[int], conn: sqlite3.Connection
+               ) -> Tuple[Dict[int, int], Deltas, List[Tuple[str, int]]]:
+        # Выполняется в потоке писателя: несколько запросов на весь пакет
+        totals = dict(points)
+        lessons: Dict[int, int] = {}
+        tasks: Dict[int, int] = {}
+        lesson_ids: List[int] = []
+        if rows:
+            # Все выполнения - одним параметром: текст запроса не зависит от их числа
+            batch = json.dumps([(*row[:4], str(row[4]), row[5]) for row in rows])
+            conn.execute('''
+                INSERT OR IGNORE INTO user_progress
+                    (user_id, lesson_id, task_id, completion_key, completed_at, points_earned)
+                SELECT value ->> 0, value ->> 1, value ->> 2, value ->> 3, value ->> 4, value ->> 5
+                FROM json_each(?)
+            ''', (batch,))
+            # Повторы уже записанных выполнений отсёк уникальный индекс:
+            # строки с их временем в базе нет, и очки за них не начисляются
+            ignored = {index for (index,) in conn.execute('''
+                SELECT batch.key FROM json_each(?) AS batch
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM user_progress
+                    WHERE user_id = batch.value ->> 0 AND completion_key = batch.value ->> 3
+                      AND completed_at = batch.value ->> 4
+                )
+            ''', (batch,))}
+            for index, (user_id, lesson_id, task_id, _, _, earned) in enumerate(rows):
+                if index in ignored:
+                    totals[user_id] = totals.get(user_id, 0) - earned
+                    continue
+                if lesson_id is not None:
+                    lessons[user_id] = lessons.get(user_id, 0) + 1
+                    lesson_ids.append(lesson_id)
+                if task_id is not None:
+                    tasks[user_id] = tasks.get(user_id, 0) + 1
+
+        conn.executemany('''
+            UPDATE users SET total_points = total_points + ? WHERE user_id = ?
+        ''', [(delta, user_id) for user_id, delta in totals.items() if delta])
+
+        # До обновления last_activity - по нему считаются активные за день
+        stats, active = StatsService.progress(
+            activity, totals, lessons, tasks, lesson_ids,
+            StatsService.last_activity(conn, unseen)
+        )
+        if stats:
+            conn.execute(*StatsService.upsert(stats))
+
+        conn.executemany('''
+            UPDATE user_stats SET
+                completed_lessons = completed_lessons + ?,
+                completed_tasks = completed_tasks + ?,
+                total_points = total_points + ?,
+                last_activity = ?
+            WHERE user_id = ?
+        ''', [
+            (lessons.get(user_id, 0), tasks.get(user_id, 0),
+             totals.get(user_id, 0), last_activity, user_id)
+            for user_id, last_activity in activity.items()
+        ])
+        return totals, stats, active
+
+    async def flush(self):
+        """Запись всех накопленных изменений одной транзакцией"""
+        async with self._flush_lock:
+            if not self._activity:
+                return
+
+            points, self._points = self._points, {}
+            progress, self._progress = self._progress, {}
+            activity, self._activity = self._activity, {}
+            self._events = 0
+            self._inflight_points, self._inflight_progress = points, progress
+
+            rows = list(itertools.chain.from_iterable(progress.values()))
+            try:
+                totals, stats, active = await self.db.write_batch(functools.partial(
+                    self._write, rows, points, activity, self.db.stats.unseen(activity)
+                ))
+            except Exception:
+                # Возвращаем изменения обратно, чтобы не потерять их
+                for user_id, delta in points.items():
+                    self._points[user_id] = self._points.get(user_id, 0) + delta
+                for user_id, user_rows in progress.items():
+                    self._progress[user_id] = user_rows + self._progress.get(user_id, [])
+                for user_id, last_activity in activity.items():
+                    self._activity.setdefault(user_id, last_activity)
+                raise
+            else:
+                self.db.stats.apply(stats, active)
+                # Рейтинг получил очки ещё при начислении: за отсечённые
+                # повторы их нужно забрать обратно
+                for user_id, total in totals.items():
+                    self.db.leaderboard.add_points(user_id, total - points.get(user_id, 0))
+            finally:
+                # Записанное теперь видно в базе, а возвращённое - снова в журнале
+                self._inflight_points, self._inflight_progress = {}, {}
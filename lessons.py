@@ -0,0 +1,175 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from render import build_keyboard
+
+# Готовая страница урока: подпись к видео (или текст) и клавиатура
+LessonPage = Tuple[str, InlineKeyboardMarkup]
+
+class Lesson:
+    """Урок в индексе курса: место в курсе и ссылки на соседние уроки"""
+
+    __slots__ = (
+        "id", "course_id", "title", "media_id", "video_file_id", "points",
+        "number", "total", "prev_id", "next_id"
+    )
+
+    def __init__(self, lesson_id: int, course_id: int, title: str, media_id: Optional[int],
+                 video_file_id: Optional[str], points: int):
+        self.id = lesson_id
+        self.course_id = course_id
+        self.title = title
+        self.media_id = media_id
+        self.video_file_id = video_file_id
+        self.points = points
+        self.number = 0
+        self.total = 0
+        self.prev_id: Optional[int] = None
+        self.next_id: Optional[int] = None
+
+class LessonIndex:
+    """Упорядоченные уроки всех курсов в памяти.
+
+    Короткие данные уроков (название, видео, награда, порядок) загружаются
+    одним запросом при старте. Описание читается из базы при первом
+    открытии урока, и сразу же в фоне подгружается страница следующего
+    урока - переход «дальше» по курсу обходится без запроса к базе.
+    Изменение уроков в одном процессе другие процессы подхватывают по
+    версии кэша "lessons" (см. Database.check_caches).
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lessons: Dict[int, Lesson] = {}
+        self._courses: Dict[int, List[Lesson]] = {}
+        self._course_pages: Dict[int, LessonPage] = {}
+        self._pages: Dict[int, LessonPage] = {}
+        self._loading: Dict[int, asyncio.Task] = {}
+        # Растёт при каждой перезагрузке - устаревшие загрузки не попадают в кэш
+        self.version = 0
+
+    async def load(self):
+        """Загрузка индекса уроков из базы"""
+        rows = await self.db.fetchall('''
+            SELECT id, course_id, title, video_file_id, media_id, points_reward
+            FROM lessons ORDER BY course_id, lesson_order
+        ''')
+
+        lessons: Dict[int, Lesson] = {}
+        courses: Dict[int, List[Lesson]] = {}
+        for lesson_id, course_id, title, video_file_id, media_id, points in rows:
+            # Видео из реестра медиа; video_file_id - у уроков, созданных до реестра
+            video_file_id = self.db.media.file_id(media_id) or video_file_id
+            lesson = Lesson(lesson_id, course_id, title, media_id, video_file_id, points or 0)
+            lessons[lesson_id] = lesson
+            courses.setdefault(course_id, []).append(lesson)
+
+        for course_lessons in courses.values():
+            for number, lesson in enumerate(course_lessons, 1):
+                lesson.number = number
+                lesson.total = len(course_lessons)
+                if number > 1:
+                    lesson.prev_id = course_lessons[number - 2].id
+                if number < len(course_lessons):
+                    lesson.next_id = course_lessons[number].id
+
+        self._lessons = lessons
+        self._courses = courses
+        self._course_pages = {
+            course_id: self._render_course(course_lessons)
+            for course_id, course_lessons in courses.items()
+        }
+        self._pages = {}
+        self.version += 1
+        logging.info("Загружено уроков: %s", len(lessons))
+
+    async def invalidate(self):
+        """Перечитать уроки после их изменения - здесь и в других процессах"""
+        await self.db.bump_cache("lessons")
+        await self.load()
+
+    def get(self, lesson_id: int) -> Optional[Lesson]:
+        return self._lessons.get(lesson_id)
+
+    def course_lessons(self, course_id: int) -> List[Lesson]:
+        """Уроки курса по порядку"""
+        return self._courses.get(course_id, [])
+
+    def course_page(self, course_id: int) -> Optional[LessonPage]:
+        """Список уроков курса или None, если уроков нет"""
+        return self._course_pages.get(course_id)
+
+    @staticmethod
+    def _render_course(course_lessons: List[Lesson]) -> LessonPage:
+        course_id = course_lessons[0].course_id
+        text = f"📚 <b>Уроки курса</b> ({len(course_lessons)})\n\n"
+        rows = []
+        for lesson in course_lessons:
+            text += f"{lesson.number}. {lesson.title} - ⭐ {lesson.points}\n"
+            rows.append([(f"{lesson.number}. {lesson.title}", f"lesson_{lesson.id}")])
+        text += "\n💡 <i>Выбери урок:</i>"
+        rows.append([("🔙 К курсу", f"course_{course_id}")])
+        return text, build_keyboard(*rows)
+
+    @staticmethod
+    def _render_lesson(lesson: Lesson, description: str) -> LessonPage:
+        header = f"<b>Урок {lesson.number}/{lesson.total}. {lesson.title}</b>"
+        if lesson.video_file_id:
+            text = (
+                f"🎥 {header}\n\n"
+                f"{description}\n\n"
+                f"⭐ <b>За просмотр:</b> +{lesson.points} очков"
+            )
+        else:
+            text = f"📚 {header}\n\n{description}\n\n❌ Видео пока недоступно"
+
+        rows = [[("✅ Урок пройден", f"complete_lesson_{lesson.id}")]]
+        if lesson.next_id is not None:
+            rows.append([("⏭ Следующий урок", f"lesson_{lesson.next_id}")])
+        rows.append([("📚 К урокам", f"lessons_{lesson.course_id}")])
+        return text, build_keyboard(*rows)
+
+    async def _load_page(self, lesson: Lesson) -> Optional[LessonPage]:
+        version = self.version
+        row = await self.db.fetchone(
+            'SELECT description FROM lessons WHERE id = ?', (lesson.id,)
+        )
+        if row is None:
+            return None
+        page = self._render_lesson(lesson, row[0] or "")
+        if version == self.version:
+            self._pages[lesson.id] = page
+        return page
+
+    def _start_loading(self, lesson: Lesson) -> asyncio.Task:
+        task = self._loading.get(lesson.id)
+        if task is None:
+            task = asyncio.create_task(self._load_page(lesson))
+            self._loading[lesson.id] = task
+            task.add_done_callback(lambda _: self._loading.pop(lesson.id, None))
+        return task
+
+    async def page(self, lesson_id: int) -> Optional[LessonPage]:
+        """Страница урока; при первом обращении читается из базы"""
+        page = self._pages.get(lesson_id)
+        if page is not None:
+            return page
+        lesson = self._lessons.get(lesson_id)
+        if lesson is None:
+            return None
+        # shield: отмена одного ожидающего не прерывает общую загрузку
+        return await asyncio.shield(self._start_loading(lesson))
+
+    def prefetch(self, lesson_id: Optional[int]):
+        """Подгрузить страницу урока в фоне, не дожидаясь результата"""
+        lesson = self._lessons.get(lesson_id) if lesson_id is not None else None
+        if lesson is None or lesson_id in self._pages:
+            return
+        self._start_loading(lesson).add_done_callback(_log_prefetch_error)
+
+def _log_prefetch_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning("Не удалось подгрузить урок: %s", task.exception())
@@ -1,27 +1,100 @@
 import asyncio
 import logging
-import sqlite3
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from html import escape
+from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-
-from config import BOT_TOKEN, ADMIN_IDS, DB_PATH
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, FSInputFile
+
+from config import (
+    BOT_TOKEN, TELEGRAM_API_URL, ADMIN_IDS, DB_PATH, DB_READERS,
+    LEDGER_FLUSH_INTERVAL_MS, LEDGER_FLUSH_EVENTS,
+    FSM_CACHE_SIZE, FSM_TTL_HOURS, FSM_FLUSH_INTERVAL_MS,
+    RUN_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE,
+    WORKERS, SHARD_LANES, LEADERBOARD_REFRESH_SEC, TG_GLOBAL_RATE, TG_CHAT_RATE, TG_CHAT_BURST,
+    TG_BROADCAST_SHARE, BROADCAST_POLL_SEC, CACHE_CHECK_SEC,
+    METRICS_HOST, METRICS_PORT, PROFILE_DIR, PROFILE_SECONDS, PROFILE_MAX_SECONDS, PROFILE_STALL_MS,
+    THROTTLE_RATE, THROTTLE_BURST, CALLBACK_DEDUP_MS, THROTTLE_MAX_USERS, EDIT_CACHE_SIZE
+)
+from broadcast import BroadcastEngine, broadcast_router
+from callbacks import CallbackRouter
 from database import Database
+from fsm_storage import SQLiteStorage
+from metrics import instrument, start_metrics_server
 from payments import payments_router
+from previews import edit_page, previews
+from profiler import SamplingProfiler, install_signal_handler
+from throttling import ThrottlingMiddleware
+from edits import CallbackScopeMiddleware, EditCache
+from quiz import quiz_router
+from render import (
+    ALREADY_AWARDED_TEXT, CatalogRenderer, main_menu_keyboard, admin_keyboard, back_button,
+    demo_lesson_keyboard, demo_complete_keyboard, render_progress, render_rating
+)
+from sender import OutboundScheduler
+from sharding import run_supervisor
 from video_handler import video_router
+from webhook import run_webhook
 
 # Инициализация
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-db = Database(DB_PATH)
+bot = Bot(
+    token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    if TELEGRAM_API_URL else None
+)
+# Одинаковые правки отсекаются до планировщика и не тратят лимиты
+edit_cache = EditCache(EDIT_CACHE_SIZE)
+bot.session.middleware(edit_cache)
+# Глобальный лимит: при нескольких процессах доля TG_BROADCAST_SHARE уходит
+# рассылкам (их отправляет процесс 0), остаток делится между процессами
+bot.session.middleware(OutboundScheduler(
+    global_rate=TG_GLOBAL_RATE * (1 - TG_BROADCAST_SHARE) / WORKERS if WORKERS > 1 else TG_GLOBAL_RATE,
+    low_rate=TG_GLOBAL_RATE * TG_BROADCAST_SHARE if WORKERS > 1 else 0,
+    chat_rate=TG_CHAT_RATE,
+    chat_burst=TG_CHAT_BURST
+))
+db = Database(
+    DB_PATH,
+    readers=DB_READERS,
+    flush_interval=LEDGER_FLUSH_INTERVAL_MS / 1000,
+    flush_events=LEDGER_FLUSH_EVENTS,
+    leaderboard_refresh=LEADERBOARD_REFRESH_SEC if WORKERS > 1 else 0,
+    cache_check=CACHE_CHECK_SEC if WORKERS > 1 else 0
+)
+storage = SQLiteStorage(
+    db,
+    cache_size=FSM_CACHE_SIZE,
+    ttl=FSM_TTL_HOURS * 3600,
+    flush_interval=FSM_FLUSH_INTERVAL_MS / 1000
+)
+broadcaster = BroadcastEngine(db, bot)
+dp = Dispatcher(storage=storage, db=db, broadcaster=broadcaster)
+dp.callback_query.outer_middleware(CallbackScopeMiddleware())
+renderer = CatalogRenderer(db.catalog)
+callbacks = CallbackRouter(name="callbacks")
 
 # Подключаем роутеры
+dp.include_router(callbacks)
 dp.include_router(payments_router)
+dp.include_router(quiz_router)
 dp.include_router(video_router)
+dp.include_router(broadcast_router)
+
+# Метрики подключаются после всех роутеров
+instrument(dp, db, bot)
+# Внутри метрик, чтобы отброшенные обновления тоже попадали в счётчики
+dp.update.outer_middleware(ThrottlingMiddleware(
+    rate=THROTTLE_RATE,
+    burst=THROTTLE_BURST,
+    dedup_window=CALLBACK_DEDUP_MS / 1000,
+    max_users=THROTTLE_MAX_USERS,
+    exempt=ADMIN_IDS
+))
+profiler = SamplingProfiler(dp, PROFILE_DIR, stall_threshold=PROFILE_STALL_MS / 1000)
 
 # Состояния для FSM
 class UserStates(StatesGroup):
@@ -29,31 +102,6 @@ class UserStates(StatesGroup):
     watching_lesson = State()
     taking_test = State()
 
-# Клавиатуры
-def main_menu_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⚽ Мои курсы", callback_data="my_courses")],
-        [InlineKeyboardButton(text="📊 Мой прогресс", callback_data="my_progress")],
-        [InlineKeyboardButton(text="🎯 Тестирование", callback_data="testing")],
-        [InlineKeyboardButton(text="💰 Купить курс", callback_data="buy_course")],
-        [InlineKeyboardButton(text="ℹ️ Помощь", callback_data="help")]
-    ])
-    return keyboard
-
-def admin_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="👥 Статистика пользователей", callback_data="admin_stats")],
-        [InlineKeyboardButton(text="➕ Добавить урок", callback_data="admin_add_lesson")],
-        [InlineKeyboardButton(text="📝 Управление заданиями", callback_data="admin_tasks")],
-        [InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")]
-    ])
-    return keyboard
-
-def back_button():
-    return InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")
-    ]])
-
 # Команда /start
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
@@ -62,7 +110,7 @@ async def cmd_start(message: types.Message):
     full_name = message.from_user.full_name or "Неизвестно"
     
     # Регистрируем пользователя
-    db.add_user(user_id, username, full_name)
+    await db.add_user(user_id, username, full_name)
     
     welcome_text = (
         f"⚽ Привет, {full_name}!\n\n"
@@ -87,29 +135,30 @@ async def cmd_start(message: types.Message):
         await message.answer(welcome_text, reply_markup=main_menu_keyboard())
 
 # Возврат в главное меню
-@dp.callback_query(F.data == "main_menu")
+@callbacks.exact("main_menu")
 async def back_to_main(callback: CallbackQuery):
     user_id = callback.from_user.id
     
+    # Меню могли открыть из списка курсов с обложкой - edit_page вернёт текст
     if user_id in ADMIN_IDS:
-        await callback.message.edit_text(
+        await edit_page(
+            callback,
             "🏠 <b>Главное меню</b>\n🔧 Админ-панель доступна!",
-            reply_markup=admin_keyboard(),
-            parse_mode="HTML"
+            admin_keyboard()
         )
     else:
-        await callback.message.edit_text(
+        await edit_page(
+            callback,
             "🏠 <b>Главное меню</b>\nВыбери действие:",
-            reply_markup=main_menu_keyboard(),
-            parse_mode="HTML"
+            main_menu_keyboard()
         )
 
 # Показать курсы
-@dp.callback_query(F.data == "my_courses")
+@callbacks.exact("my_courses")
 async def show_courses(callback: CallbackQuery):
-    courses = db.get_courses()
+    page = renderer.courses_page()
     
-    if not courses:
+    if not page:
         await callback.message.edit_text(
             "📚 Курсы пока недоступны.\n\n"
             "🔔 Курсы добавляются администраторами.\n"
@@ -118,69 +167,31 @@ async def show_courses(callback: CallbackQuery):
         )
         return
     
-    text = "⚽ <b>Доступные курсы:</b>\n\n"
-    keyboard_buttons = []
-    
-    for course_id, title, description, price in courses:
-        text += (
-            f"📖 <b>{title}</b>\n"
-            f"{description}\n"
-            f"💰 <b>Цена:</b> {price} руб.\n\n"
-        )
-        keyboard_buttons.append([
-            InlineKeyboardButton(
-                text=f"📖 {title}", 
-                callback_data=f"course_{course_id}"
-            )
-        ])
-    
-    keyboard_buttons.append([
-        InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")
-    ])
-    
-    await callback.message.edit_text(
-        text, 
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons),
-        parse_mode="HTML"
-    )
+    text, keyboard = page
+    # Обложка - карточка первого курса, для которого она уже нарисована
+    cover = next((f"course:{course[0]}" for course in db.list_courses()
+                  if previews.has(f"course:{course[0]}")), None)
+    await edit_page(callback, text, keyboard, cover)
 
 # Обработка выбора конкретного курса
-@dp.callback_query(F.data.startswith("course_"))
-async def show_specific_course(callback: CallbackQuery):
-    course_id = callback.data.replace("course_", "")
-    courses = db.get_courses()
-    
-    selected_course = None
-    for course in courses:
-        if str(course[0]) == course_id:
-            selected_course = course
-            break
-    
-    if not selected_course:
+@callbacks.prefix("course_", int)
+async def show_specific_course(callback: CallbackQuery, payload: int):
+    page = renderer.course_page(payload)
+    
+    if not page:
         await callback.answer("❌ Курс не найден!")
         return
     
-    course_id_int, title, description, price = selected_course
-    
-    course_text = (
-        f"📖 <b>{title}</b>\n\n"
-        f"📝 <b>Описание:</b>\n{description}\n\n"
-        f"💰 <b>Цена:</b> {price} руб.\n\n"
-        f"📚 В этом курсе вы изучите основы футбола и получите практические навыки."
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💳 Купить курс", callback_data=f"purchase_{course_id}")],
-        [InlineKeyboardButton(text="🎥 Посмотреть урок (демо)", callback_data=f"demo_lesson_{course_id}")],
-        [InlineKeyboardButton(text="🔙 К курсам", callback_data="my_courses")]
-    ])
-    
-    await callback.message.edit_text(course_text, reply_markup=keyboard, parse_mode="HTML")
+    course_text, keyboard = page
+    await edit_page(callback, course_text, keyboard)
 
 # Демо урок
-@dp.callback_query(F.data.startswith("demo_lesson_"))
-async def show_demo_lesson(callback: CallbackQuery):
-    course_id = callback.data.replace("demo_lesson_", "")
+@callbacks.prefix("demo_lesson_", int)
+async def show_demo_lesson(callback: CallbackQuery, payload: int):
+    course_id = payload
+    if db.get_course(course_id) is None:
+        await callback.answer("❌ Курс не найден!")
+        return
     
     demo_text = (
         f"🎥 <b>Демо урок - Основы дриблинга</b>\n\n"
@@ -193,77 +204,41 @@ async def show_demo_lesson(callback: CallbackQuery):
         f"💡 Это демонстрационный урок. Полные уроки доступны после покупки курса."
     )
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Урок просмотрен", callback_data=f"complete_demo_{course_id}")],
-        [InlineKeyboardButton(text="💳 Купить полный курс", callback_data=f"purchase_{course_id}")],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data=f"course_{course_id}")]
-    ])
+    keyboard = demo_lesson_keyboard(course_id)
     
     await callback.message.edit_text(demo_text, reply_markup=keyboard, parse_mode="HTML")
 
 # Завершение демо урока
-@dp.callback_query(F.data.startswith("complete_demo_"))
-async def complete_demo_lesson(callback: CallbackQuery):
+@callbacks.prefix("complete_demo_", int)
+async def complete_demo_lesson(callback: CallbackQuery, payload: int):
     user_id = callback.from_user.id
-    course_id = callback.data.replace("complete_demo_", "")
+    course_id = payload
+    if db.get_course(course_id) is None:
+        await callback.answer("❌ Курс не найден!")
+        return
     
-    # Добавляем очки за демо урок
-    db.add_points(user_id, 10)
+    # Очки за демо урок начисляются один раз на курс
+    awarded = await db.complete(user_id, f"demo:{course_id}", 10)
     
     completion_text = (
         f"🎉 <b>Демо урок пройден!</b>\n\n"
-        f"✅ Вы получили +10 очков\n"
-        f"📊 Ваш текущий прогресс обновлен\n\n"
-        f"💡 Хотите изучить больше? Приобретите полный курс!"
+        + (f"✅ Вы получили +10 очков\n"
+           f"📊 Ваш текущий прогресс обновлен\n\n"
+           if awarded else ALREADY_AWARDED_TEXT)
+        + f"💡 Хотите изучить больше? Приобретите полный курс!"
     )
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💳 Купить полный курс", callback_data=f"purchase_{course_id}")],
-        [InlineKeyboardButton(text="📊 Мой прогресс", callback_data="my_progress")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-    ])
+    keyboard = demo_complete_keyboard(course_id)
     
     await callback.message.edit_text(completion_text, reply_markup=keyboard, parse_mode="HTML")
 
 # Показать прогресс
-@dp.callback_query(F.data == "my_progress")
+@callbacks.exact("my_progress")
 async def show_progress(callback: CallbackQuery):
     user_id = callback.from_user.id
-    progress = db.get_user_progress(user_id)
-    
-    # Определяем уровень на основе очков
-    points = progress['total_points']
-    if points < 100:
-        level = "🥉 Новичок"
-        level_emoji = "🌱"
-        next_level_points = 100
-    elif points < 500:
-        level = "🥈 Любитель"
-        level_emoji = "⚡"
-        next_level_points = 500
-    elif points < 1000:
-        level = "🥇 Эксперт"
-        level_emoji = "🔥"
-        next_level_points = 1000
-    else:
-        level = "🏆 Мастер"
-        level_emoji = "⭐"
-        next_level_points = points  # Уже максимальный уровень
-    
-    progress_text = (
-        f"📊 <b>Твой прогресс:</b>\n\n"
-        f"{level_emoji} <b>Уровень:</b> {level}\n"
-        f"⭐ <b>Всего очков:</b> {points}\n"
-        f"📚 <b>Пройдено уроков:</b> {progress['completed_lessons']}\n"
-        f"✅ <b>Выполнено заданий:</b> {progress['completed_tasks']}\n\n"
-    )
-    
-    if next_level_points > points:
-        progress_text += f"🎯 До следующего уровня: {next_level_points - points} очков\n"
-    else:
-        progress_text += "🏆 Максимальный уровень достигнут!\n"
+    progress = await db.get_user_progress(user_id)
     
-    progress_text += "\n💪 Продолжай тренироваться!"
+    progress_text = render_progress(progress)
     
     await callback.message.edit_text(
         progress_text,
@@ -271,44 +246,19 @@ async def show_progress(callback: CallbackQuery):
         parse_mode="HTML"
     )
 
-# Показать тестирование
-@dp.callback_query(F.data == "testing")
-async def show_testing(callback: CallbackQuery):
+# Рейтинг пользователей
+@callbacks.exact("rating")
+async def show_rating(callback: CallbackQuery):
+    rating = db.get_rating(callback.from_user.id)
+    
     await callback.message.edit_text(
-        "🎯 <b>Раздел тестирования</b>\n\n"
-        "Здесь ты можешь пройти различные тесты "
-        "и проверить свои знания в футболе!\n\n"
-        "Выбери тип теста:",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📝 Теоретический тест", callback_data="theory_test")],
-            [InlineKeyboardButton(text="⚽ Практическое задание", callback_data="practical_test")],
-            [InlineKeyboardButton(text="🧠 Тест на правила", callback_data="rules_test")],
-            [InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")]
-        ]),
+        render_rating(rating, callback.from_user.id),
+        reply_markup=back_button(),
         parse_mode="HTML"
     )
 
-# Теоретический тест (пример)
-@dp.callback_query(F.data == "theory_test")
-async def theory_test(callback: CallbackQuery):
-    test_question = (
-        "📝 <b>Теоретический тест - Вопрос 1/5</b>\n\n"
-        "❓ <b>Сколько игроков находится на поле "
-        "от одной команды во время матча?</b>\n\n"
-        "Выбери правильный ответ:"
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="A) 10 игроков", callback_data="answer_a_1")],
-        [InlineKeyboardButton(text="B) 11 игроков", callback_data="answer_b_1")],
-        [InlineKeyboardButton(text="C) 12 игроков", callback_data="answer_c_1")],
-        [InlineKeyboardButton(text="🔙 Назад к тестам", callback_data="testing")]
-    ])
-    
-    await callback.message.edit_text(test_question, reply_markup=keyboard, parse_mode="HTML")
-
 # Практическое задание
-@dp.callback_query(F.data == "practical_test")
+@callbacks.exact("practical_test")
 async def practical_test(callback: CallbackQuery):
     await callback.message.edit_text(
         "⚽ <b>Практическое задание</b>\n\n"
@@ -327,101 +277,17 @@ async def practical_test(callback: CallbackQuery):
         parse_mode="HTML"
     )
 
-# Тест на правила
-@dp.callback_query(F.data == "rules_test")
-async def rules_test(callback: CallbackQuery):
-    test_question = (
-        "🧠 <b>Тест на правила - Вопрос 1/3</b>\n\n"
-        "❓ <b>Что происходит, если мяч полностью пересек "
-        "боковую линию?</b>\n\n"
-        "Выберите правильный ответ:"
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="A) Угловой удар", callback_data="rules_a_1")],
-        [InlineKeyboardButton(text="B) Вбрасывание", callback_data="rules_b_1")],
-        [InlineKeyboardButton(text="C) Штрафной удар", callback_data="rules_c_1")],
-        [InlineKeyboardButton(text="🔙 К тестам", callback_data="testing")]
-    ])
-    
-    await callback.message.edit_text(test_question, reply_markup=keyboard, parse_mode="HTML")
-
-# Обработка ответов теоретического теста
-@dp.callback_query(F.data.in_(["answer_a_1", "answer_b_1", "answer_c_1"]))
-async def handle_theory_answer(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    
-    if callback.data == "answer_b_1":  # Правильный ответ
-        points_earned = 20
-        db.add_points(user_id, points_earned)
-        
-        result_text = (
-            "✅ <b>Правильно!</b>\n\n"
-            f"🎉 Ты заработал {points_earned} очков!\n\n"
-            "В футболе на поле от одной команды "
-            "находится 11 игроков (включая вратаря).\n\n"
-            "Продолжай изучать футбол! 💪"
-        )
-    else:
-        result_text = (
-            "❌ <b>Неправильно</b>\n\n"
-            "Правильный ответ: <b>11 игроков</b>\n\n"
-            "В футболе на поле от одной команды "
-            "находится 11 игроков (включая вратаря).\n\n"
-            "Не расстраивайся, продолжай учиться! 📚"
-        )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📝 Следующий вопрос", callback_data="theory_question_2")],
-        [InlineKeyboardButton(text="📊 Мой прогресс", callback_data="my_progress")],
-        [InlineKeyboardButton(text="🔙 К тестам", callback_data="testing")]
-    ])
-    
-    await callback.message.edit_text(result_text, reply_markup=keyboard, parse_mode="HTML")
-
-# Обработка ответов теста на правила
-@dp.callback_query(F.data.in_(["rules_a_1", "rules_b_1", "rules_c_1"]))
-async def handle_rules_answer(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    
-    if callback.data == "rules_b_1":  # Правильный ответ
-        points_earned = 25
-        db.add_points(user_id, points_earned)
-        
-        result_text = (
-            "✅ <b>Отлично!</b>\n\n"
-            f"🎉 Ты заработал {points_earned} очков!\n\n"
-            "Когда мяч полностью пересекает боковую линию, "
-            "назначается вбрасывание руками.\n\n"
-            "Ты хорошо знаешь правила! ⚽"
-        )
-    else:
-        result_text = (
-            "❌ <b>Неправильно</b>\n\n"
-            "Правильный ответ: <b>Вбрасывание</b>\n\n"
-            "Когда мяч полностью пересекает боковую линию, "
-            "игра возобновляется вбрасыванием руками.\n\n"
-            "Изучай правила дальше! 📖"
-        )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📝 Следующий вопрос", callback_data="rules_question_2")],
-        [InlineKeyboardButton(text="📊 Мой прогресс", callback_data="my_progress")],
-        [InlineKeyboardButton(text="🔙 К тестам", callback_data="testing")]
-    ])
-    
-    await callback.message.edit_text(result_text, reply_markup=keyboard, parse_mode="HTML")
-
 # Завершение практического задания
-@dp.callback_query(F.data == "complete_practical")
+@callbacks.exact("complete_practical")
 async def complete_practical_task(callback: CallbackQuery):
     user_id = callback.from_user.id
     points_earned = 30
-    db.add_points(user_id, points_earned)
+    awarded = await db.complete(user_id, "practical:juggling", points_earned)
     
     result_text = (
         "🏆 <b>Практическое задание выполнено!</b>\n\n"
-        f"🎉 Отличная работа! Ты заработал {points_earned} очков!\n\n"
+        + (f"🎉 Отличная работа! Ты заработал {points_earned} очков!\n\n"
+           if awarded else ALREADY_AWARDED_TEXT) +
         "💪 Жонглирование - отличное упражнение для развития "
         "техники и чувства мяча.\n\n"
         "Продолжай тренироваться каждый день!"
@@ -436,42 +302,22 @@ async def complete_practical_task(callback: CallbackQuery):
     await callback.message.edit_text(result_text, reply_markup=keyboard, parse_mode="HTML")
 
 # Покупка курса
-@dp.callback_query(F.data == "buy_course")
+@callbacks.exact("buy_course")
 async def buy_course(callback: CallbackQuery):
-    courses = db.get_courses()
+    page = renderer.buy_page()
     
-    if not courses:
+    if not page:
         await callback.message.edit_text(
             "📚 Курсы пока недоступны для покупки.",
             reply_markup=back_button()
         )
         return
     
-    text = "💰 <b>Покупка курсов</b>\n\n"
-    keyboard_buttons = []
-    
-    for course_id, title, description, price in courses:
-        text += f"📖 <b>{title}</b> - {price} руб.\n"
-        keyboard_buttons.append([
-            InlineKeyboardButton(
-                text=f"💳 Купить {title}", 
-                callback_data=f"purchase_{course_id}"
-            )
-        ])
-    
-    text += "\n💡 <i>Выберите курс для покупки:</i>"
-    keyboard_buttons.append([
-        InlineKeyboardButton(text="🔙 Главное меню", callback_data="main_menu")
-    ])
-    
-    await callback.message.edit_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons),
-        parse_mode="HTML"
-    )
+    text, keyboard = page
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
 
 # Помощь
-@dp.callback_query(F.data == "help")
+@callbacks.exact("help")
 async def show_help(callback: CallbackQuery):
     help_text = (
         "ℹ️ <b>Справка по боту</b>\n\n"
@@ -505,49 +351,46 @@ async def show_help(callback: CallbackQuery):
     )
 
 # Админ статистика
-@dp.callback_query(F.data == "admin_stats")
+@callbacks.exact("admin_stats")
 async def admin_stats(callback: CallbackQuery):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ У вас нет прав доступа!")
         return
     
-    # Получаем статистику из базы данных
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Общее количество пользователей
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
-        
-        # Общие очки всех пользователей
-        cursor.execute("SELECT SUM(total_points) FROM users")
-        total_points = cursor.fetchone()[0] or 0
-        
-        # Количество активных курсов
-        cursor.execute("SELECT COUNT(*) FROM courses WHERE is_active = 1")
-        active_courses = cursor.fetchone()[0]
-        
-        # Топ пользователь по очкам
-        cursor.execute("SELECT full_name, total_points FROM users ORDER BY total_points DESC LIMIT 1")
-        top_user = cursor.fetchone()
-        
-        conn.close()
-        
-        stats_text = (
-            f"📊 <b>Статистика бота</b>\n\n"
-            f"👥 <b>Всего пользователей:</b> {total_users}\n"
-            f"📚 <b>Активных курсов:</b> {active_courses}\n"
-            f"⭐ <b>Общие очки:</b> {total_points}\n"
-        )
-        
-        if top_user:
-            stats_text += f"🏆 <b>Лидер:</b> {top_user[0]} ({top_user[1]} очков)\n"
-        
-        stats_text += f"\n📈 <i>Статистика обновляется в реальном времени</i>"
-        
-    except Exception as e:
-        stats_text = f"❌ Ошибка получения статистики: {str(e)}"
+    # Сводные счётчики из памяти - без запросов к базе
+    stats = db.get_admin_stats()
+    top_user = stats['top_user']
+    today = stats['today']
+    
+    stats_text = (
+        f"📊 <b>Статистика бота</b>\n\n"
+        f"👥 <b>Всего пользователей:</b> {stats['total_users']}\n"
+        f"📚 <b>Активных курсов:</b> {stats['active_courses']}\n"
+        f"💰 <b>Покупок:</b> {stats['purchases']}\n"
+        f"⭐ <b>Общие очки:</b> {stats['total_points']}\n"
+    )
+    
+    if top_user:
+        stats_text += f"🏆 <b>Лидер:</b> {escape(top_user[0])} ({top_user[1]} очков)\n"
+    
+    stats_text += (
+        f"\n📅 <b>Сегодня:</b>\n"
+        f"🆕 Новых: {today.get('new_users', 0)} · 🔥 Активных: {today.get('active_users', 0)}\n"
+        f"📚 Уроков: {today.get('lessons', 0)} · 🎯 Заданий: {today.get('tasks', 0)} · "
+        f"💰 Покупок: {today.get('purchases', 0)}\n"
+    )
+    
+    stats_text += "\n📈 <b>За 7 дней</b> (новые / активные):\n"
+    for day, counters in stats['recent']:
+        stats_text += f"{day[5:]}: {counters.get('new_users', 0)} / {counters.get('active_users', 0)}\n"
+    
+    for course_id, title, *_ in db.list_courses():
+        funnel = stats['funnels'].get(course_id, [])
+        # Воронка имеет смысл, только если у курса есть уроки
+        if len(funnel) < 2:
+            continue
+        stats_text += f"\n🎓 <b>{escape(title)}</b>:\n"
+        stats_text += "\n".join(f"{escape(stage)}: {count}" for stage, count in funnel) + "\n"
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_stats")],
@@ -560,8 +403,59 @@ async def admin_stats(callback: CallbackQuery):
         parse_mode="HTML"
     )
 
+# Профилирование работающего бота (для администраторов)
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    try:
+        seconds = min(float(command.args or PROFILE_SECONDS), PROFILE_MAX_SECONDS)
+    except ValueError:
+        await message.answer("Использование: /profile [секунды]")
+        return
+
+    if profiler.running:
+        await message.answer("⏳ Профилирование уже идёт")
+        return
+
+    async def send_report(path: str, summary: str):
+        # Сводка без разметки: в ней имена файлов и функций
+        await message.answer(summary[:4000])
+        await message.answer_document(FSInputFile(path), caption="🔥 Collapsed stacks для flamegraph")
+
+    profiler.start(seconds, send_report)
+    await message.answer(f"🔬 Профилирование запущено на {seconds:g} с")
+
+# Проверка счётчиков прогресса (для администраторов)
+@dp.message(Command("verify_stats"))
+async def cmd_verify_stats(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    broken = await db.verify_user_stats()
+    if not broken:
+        await message.answer("✅ Счётчики прогресса совпадают с историей")
+        return
+
+    await message.answer(
+        f"⚠️ <b>Расхождения у {len(broken)} пользователей</b>\n"
+        f"{', '.join(map(str, broken[:20]))}{' …' if len(broken) > 20 else ''}\n\n"
+        "🔧 Пересчитать: /rebuild_stats",
+        parse_mode="HTML"
+    )
+
+# Пересчёт счётчиков прогресса по истории (для администраторов)
+@dp.message(Command("rebuild_stats"))
+async def cmd_rebuild_stats(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+
+    await db.rebuild_user_stats()
+    await message.answer("✅ Счётчики прогресса пересчитаны")
+
 # Добавить заглушки для админских функций
-@dp.callback_query(F.data == "admin_add_lesson")
+@callbacks.exact("admin_add_lesson")
 async def admin_add_lesson(callback: CallbackQuery):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ У вас нет прав доступа!")
@@ -581,7 +475,7 @@ async def admin_add_lesson(callback: CallbackQuery):
         parse_mode="HTML"
     )
 
-@dp.callback_query(F.data == "admin_tasks")
+@callbacks.exact("admin_tasks")
 async def admin_tasks(callback: CallbackQuery):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ У вас нет прав доступа!")
@@ -601,149 +495,8 @@ async def admin_tasks(callback: CallbackQuery):
         parse_mode="HTML"
     )
 
-# Заглушки для следующих вопросов тестов
-@dp.callback_query(F.data == "theory_question_2")
-async def theory_question_2(callback: CallbackQuery):
-    test_question = (
-        "📝 <b>Теоретический тест - Вопрос 2/5</b>\n\n"
-        "❓ <b>Какая часть тела НЕ может касаться мяча во время игры "
-        "(кроме вратаря в штрафной площади)?</b>\n\n"
-        "Выбери правильный ответ:"
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="A) Голова", callback_data="answer2_a")],
-        [InlineKeyboardButton(text="B) Руки", callback_data="answer2_b")],
-        [InlineKeyboardButton(text="C) Грудь", callback_data="answer2_c")],
-        [InlineKeyboardButton(text="🔙 К тестам", callback_data="testing")]
-    ])
-    
-    await callback.message.edit_text(test_question, reply_markup=keyboard, parse_mode="HTML")
-
-@dp.callback_query(F.data.in_(["answer2_a", "answer2_b", "answer2_c"]))
-async def handle_theory_answer_2(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    
-    if callback.data == "answer2_b":  # Правильный ответ
-        points_earned = 20
-        db.add_points(user_id, points_earned)
-        
-        result_text = (
-            "✅ <b>Верно!</b>\n\n"
-            f"🎉 Ты заработал {points_earned} очков!\n\n"
-            "Руками мяч может касаться только вратарь "
-            "в своей штрафной площади.\n\n"
-            "Отличное знание правил! ⚽"
-        )
-    else:
-        result_text = (
-            "❌ <b>Неправильно</b>\n\n"
-            "Правильный ответ: <b>Руки</b>\n\n"
-            "Руками мяч может касаться только вратарь "
-            "в своей штрафной площади.\n\n"
-            "Изучай правила футбола! 📚"
-        )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏁 Завершить тест", callback_data="finish_theory_test")],
-        [InlineKeyboardButton(text="📊 Мой прогресс", callback_data="my_progress")],
-        [InlineKeyboardButton(text="🔙 К тестам", callback_data="testing")]
-    ])
-    
-    await callback.message.edit_text(result_text, reply_markup=keyboard, parse_mode="HTML")
-
-@dp.callback_query(F.data == "rules_question_2")
-async def rules_question_2(callback: CallbackQuery):
-    test_question = (
-        "🧠 <b>Тест на правила - Вопрос 2/3</b>\n\n"
-        "❓ <b>Сколько времени длится стандартный футбольный матч?</b>\n\n"
-        "Выберите правильный ответ:"
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="A) 80 минут", callback_data="rules2_a")],
-        [InlineKeyboardButton(text="B) 90 минут", callback_data="rules2_b")],
-        [InlineKeyboardButton(text="C) 100 минут", callback_data="rules2_c")],
-        [InlineKeyboardButton(text="🔙 К тестам", callback_data="testing")]
-    ])
-    
-    await callback.message.edit_text(test_question, reply_markup=keyboard, parse_mode="HTML")
-
-@dp.callback_query(F.data.in_(["rules2_a", "rules2_b", "rules2_c"]))
-async def handle_rules_answer_2(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    
-    if callback.data == "rules2_b":  # Правильный ответ
-        points_earned = 25
-        db.add_points(user_id, points_earned)
-        
-        result_text = (
-            "✅ <b>Правильно!</b>\n\n"
-            f"🎉 Ты заработал {points_earned} очков!\n\n"
-            "Футбольный матч длится 90 минут: "
-            "два тайма по 45 минут + компенсированное время.\n\n"
-            "Ты отлично знаешь футбол! 🏆"
-        )
-    else:
-        result_text = (
-            "❌ <b>Неправильно</b>\n\n"
-            "Правильный ответ: <b>90 минут</b>\n\n"
-            "Футбольный матч длится 90 минут: "
-            "два тайма по 45 минут + компенсированное время.\n\n"
-            "Продолжай изучать правила! 📖"
-        )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🏁 Завершить тест", callback_data="finish_rules_test")],
-        [InlineKeyboardButton(text="📊 Мой прогресс", callback_data="my_progress")],
-        [InlineKeyboardButton(text="🔙 К тестам", callback_data="testing")]
-    ])
-    
-    await callback.message.edit_text(result_text, reply_markup=keyboard, parse_mode="HTML")
-
-# Завершение тестов
-@dp.callback_query(F.data == "finish_theory_test")
-async def finish_theory_test(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    user_points = db.get_user_points(user_id)
-    
-    final_text = (
-        "🏁 <b>Теоретический тест завершен!</b>\n\n"
-        f"📊 <b>Твои текущие очки:</b> {user_points}\n"
-        f"🎯 Отличная работа! Ты проверил свои теоретические знания.\n\n"
-        f"💡 Совет: проходи тесты регулярно, чтобы улучшать результаты!"
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔄 Пройти снова", callback_data="theory_test")],
-        [InlineKeyboardButton(text="⚽ Практические задания", callback_data="practical_test")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-    ])
-    
-    await callback.message.edit_text(final_text, reply_markup=keyboard, parse_mode="HTML")
-
-@dp.callback_query(F.data == "finish_rules_test")
-async def finish_rules_test(callback: CallbackQuery):
-    user_id = callback.from_user.id
-    user_points = db.get_user_points(user_id)
-    
-    final_text = (
-        "🏁 <b>Тест на правила завершен!</b>\n\n"
-        f"📊 <b>Твои текущие очки:</b> {user_points}\n"
-        f"🧠 Превосходно! Ты хорошо знаешь правила футбола.\n\n"
-        f"⚽ Теперь можешь применить знания на практике!"
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔄 Пройти снова", callback_data="rules_test")],
-        [InlineKeyboardButton(text="📝 Теоретический тест", callback_data="theory_test")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-    ])
-    
-    await callback.message.edit_text(final_text, reply_markup=keyboard, parse_mode="HTML")
-
 # Показать пример видео
-@dp.callback_query(F.data == "show_example")
+@callbacks.exact("show_example")
 async def show_video_example(callback: CallbackQuery):
     await callback.message.edit_text(
         "📹 <b>Видео-пример жонглирования</b>\n\n"
@@ -772,13 +525,64 @@ async def main():
     print(f"📋 База данных: {DB_PATH}")
     print(f"🔑 Токен бота: {BOT_TOKEN[:10]}...")
     print(f"👑 Админы: {ADMIN_IDS}")
+    if TELEGRAM_API_URL:
+        print(f"🧪 Bot API: {TELEGRAM_API_URL}")
+    
+    if WORKERS > 1:
+        # Обновления разбирают процессы-обработчики, здесь только маршрутизация
+        print(f"🧩 Процессов-обработчиков: {WORKERS}")
+        await run_supervisor(
+            bot,
+            workers=WORKERS,
+            db_path=DB_PATH,
+            mode=RUN_MODE,
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            url=WEBHOOK_URL,
+            secret=WEBHOOK_SECRET,
+            queue_size=WEBHOOK_QUEUE_SIZE,
+            lanes=SHARD_LANES
+        )
+        return
     
-    # Удаляем webhook и запускаем polling
-    await bot.delete_webhook(drop_pending_updates=True)
-    print("✅ Бот успешно запущен!")
-    print("📱 Отправьте /start для начала работы")
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+        print(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
     
-    await dp.start_polling(bot)
+    # Открываем пул соединений с базой данных
+    await db.connect()
+    install_signal_handler(profiler, PROFILE_SECONDS)
+    storage.start()
+    await broadcaster.resume_unfinished()
+    
+    try:
+        if RUN_MODE == "webhook":
+            print(f"🌐 Режим webhook: {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+            await run_webhook(
+                dp, bot,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                url=WEBHOOK_URL,
+                secret=WEBHOOK_SECRET,
+                workers=WEBHOOK_WORKERS,
+                queue_size=WEBHOOK_QUEUE_SIZE
+            )
+        else:
+            # Удаляем webhook и запускаем polling
+            await bot.delete_webhook(drop_pending_updates=True)
+            print("✅ Бот успешно запущен!")
+            print("📱 Отправьте /start для начала работы")
+            
+            await dp.start_polling(bot)
+    finally:
+        await broadcaster.stop()
+        await storage.close()
+        await db.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,84 @@
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+class MediaItem:
+    """Файл, уже загруженный в Telegram: отправляется повторно по file_id"""
+
+    __slots__ = ("id", "kind", "file_id", "file_unique_id", "duration", "file_size")
+
+    def __init__(self, media_id: int, kind: str, file_id: str, file_unique_id: str,
+                 duration: Optional[int], file_size: Optional[int]):
+        self.id = media_id
+        self.kind = kind
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.duration = duration
+        self.file_size = file_size
+
+class MediaRegistry:
+    """Реестр медиафайлов: короткий id -> file_id Telegram.
+
+    В callback_data и в уроках хранится только короткий id, поэтому payload
+    всегда укладывается в 64 байта. Повторная загрузка того же файла
+    (тот же file_unique_id) возвращает уже существующую запись. Весь реестр
+    держится в памяти, при показе урока база не нужна.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._items: Dict[int, MediaItem] = {}
+        self._by_unique_id: Dict[str, MediaItem] = {}
+
+    def _remember(self, item: MediaItem):
+        self._items[item.id] = item
+        self._by_unique_id[item.file_unique_id] = item
+
+    async def load(self):
+        """Загрузка реестра из базы"""
+        rows = await self.db.fetchall(
+            'SELECT id, kind, file_id, file_unique_id, duration, file_size FROM media'
+        )
+        self._items = {}
+        self._by_unique_id = {}
+        for row in rows:
+            self._remember(MediaItem(*row))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, media_id: Optional[int]) -> Optional[MediaItem]:
+        return self._items.get(media_id) if media_id is not None else None
+
+    def file_id(self, media_id: Optional[int]) -> Optional[str]:
+        item = self.get(media_id)
+        return item.file_id if item else None
+
+    async def register(self, kind: str, file_id: str, file_unique_id: str,
+                       duration: Optional[int] = None, file_size: Optional[int] = None,
+                       uploaded_by: Optional[int] = None) -> Tuple[MediaItem, bool]:
+        """Запись о файле и признак того, что файл новый"""
+        item = self._by_unique_id.get(file_unique_id)
+        if item is not None:
+            return item, False
+
+        async with self.db.transaction() as conn:
+            cursor = await conn.execute('''
+                INSERT OR IGNORE INTO media
+                    (kind, file_id, file_unique_id, duration, file_size, uploaded_by, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (kind, file_id, file_unique_id, duration, file_size, uploaded_by, datetime.now()))
+            created = cursor.rowcount > 0
+            # Запись могла появиться раньше (другой процесс) - берём её
+            async with conn.execute(
+                'SELECT id, kind, file_id, file_unique_id, duration, file_size '
+                'FROM media WHERE file_unique_id = ?', (file_unique_id,)
+            ) as select:
+                row = await select.fetchone()
+
+        item = MediaItem(*row)
+        self._remember(item)
+        if created:
+            # Другие процессы перечитают реестр - иначе урок с этим видео
+            # покажется у них без видео
+            await self.db.bump_cache("media")
+        return item, created
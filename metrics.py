@@ -0,0 +1,281 @@
+import bisect
+import functools
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+from callbacks import CallbackRouter
+
+# Границы корзин гистограмм
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in pairs
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+        return lines
+
+class Gauge:
+    """Значение, которое задаётся явно или считается функцией при выдаче"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[Labels, float] = {}
+        self.functions: Dict[Labels, Callable[[], float]] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        self.functions[_labels(labels)] = function
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        values = dict(self.values)
+        for key, function in self.functions.items():
+            values[key] = function()
+        lines += [f"{self.name}{_format_labels(key)} {value}" for key, value in values.items()]
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(key, (('le', str(bound)),))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Метрики процесса в памяти, отдаются в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self.updates = self._add(Counter(
+            "bot_updates_total", "Обработанные обновления"))
+        self.handler_seconds = self._add(Histogram(
+            "bot_handler_seconds", "Время обработки обновления"))
+        self.in_flight = self._add(Gauge(
+            "bot_updates_in_flight", "Обновления в обработке"))
+        self.queue_depth = self._add(Gauge(
+            "bot_update_queue_depth", "Обновления, ждущие обработки"))
+        self.db_queries = self._add(Counter(
+            "bot_db_queries_total", "Обращения к базе"))
+        self.update_db_queries = self._add(Histogram(
+            "bot_update_db_queries", "Обращений к базе на одно обновление", COUNT_BUCKETS))
+        self.api_calls = self._add(Counter(
+            "bot_api_calls_total", "Запросы к Bot API"))
+        self.api_seconds = self._add(Histogram(
+            "bot_api_seconds", "Время запроса к Bot API"))
+        self.update_api_calls = self._add(Histogram(
+            "bot_update_api_calls", "Запросов к Bot API на одно обновление", COUNT_BUCKETS))
+        self.throttled = self._add(Counter(
+            "bot_throttled_total", "Обновления, отброшенные ограничением частоты"))
+        self.edits_skipped = self._add(Counter(
+            "bot_edits_skipped_total", "Правки сообщений, которые ничего не меняли"))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+class UpdateStats:
+    """Что сделала обработка одного обновления"""
+
+    __slots__ = ("handler", "db_queries", "api_calls")
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.db_queries = 0
+        self.api_calls = 0
+
+_current: ContextVar[Optional[UpdateStats]] = ContextVar("update_stats", default=None)
+
+def name_update(handler: str):
+    """Имя обработчика текущего обновления для меток метрик"""
+    stats = _current.get()
+    if stats is not None:
+        stats.handler = handler
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware dp.update: время, обращения к базе и к API на обновление"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        stats = UpdateStats(event.event_type)
+        token = _current.set(stats)
+        metrics.in_flight.inc()
+        status = "ok"
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+            if result is UNHANDLED:
+                stats.handler = "unhandled"
+            return result
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.in_flight.dec()
+            _current.reset(token)
+            metrics.updates.inc(type=event.event_type, handler=stats.handler, status=status)
+            metrics.handler_seconds.observe(elapsed, handler=stats.handler)
+            metrics.update_db_queries.observe(stats.db_queries, handler=stats.handler)
+            metrics.update_api_calls.observe(stats.api_calls, handler=stats.handler)
+
+class _HandlerNameMiddleware(BaseMiddleware):
+    # Внутренний middleware: имя сработавшего обработчика для меток метрик
+    async def __call__(self, handler, event, data):
+        stats = _current.get()
+        handler_object = data.get("handler")
+        if stats is not None and handler_object is not None:
+            callback = handler_object.callback
+            router = getattr(callback, "__self__", None)
+            if isinstance(router, CallbackRouter):
+                # У CallbackRouter один общий обработчик - берём маршрут
+                resolved = router.resolve(getattr(event, "data", None) or "")
+                if resolved is None:
+                    # Маршрута нет - роутер пропустит обновление дальше
+                    return await handler(event, data)
+                callback = resolved[0].callback
+            stats.handler = getattr(callback, "__name__", stats.handler)
+        return await handler(event, data)
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: число и время запросов к Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        stats = _current.get()
+        if stats is not None:
+            stats.api_calls += 1
+        status = "ok"
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            metrics.api_calls.inc(method=name, status=status)
+            metrics.api_seconds.observe(time.perf_counter() - started, method=name)
+
+def _count_query(method: str):
+    metrics.db_queries.inc(method=method)
+    stats = _current.get()
+    if stats is not None:
+        stats.db_queries += 1
+
+def instrument_database(db):
+    """Обернуть методы доступа к базе подсчётом обращений.
+
+    Запись (execute или transaction) считается одним обращением; фоновые
+    сбросы (журнал очков, FSM) в счётчик обновления не попадают - они идут
+    вне его контекста.
+    """
+    for name in ("fetchone", "fetchall"):
+        original = getattr(db, name)
+
+        @functools.wraps(original)
+        async def wrapper(*args, _original=original, _name=name, **kwargs):
+            _count_query(_name)
+            return await _original(*args, **kwargs)
+
+        setattr(db, name, wrapper)
+
+    # execute сам открывает transaction, поэтому считается только она
+    transaction = db.transaction
+
+    @functools.wraps(transaction)
+    def counted_transaction(*args, **kwargs):
+        _count_query("transaction")
+        return transaction(*args, **kwargs)
+
+    db.transaction = counted_transaction
+
+def instrument(dp: Dispatcher, db, bot):
+    """Подключить метрики к диспетчеру (после include_router), базе и боту"""
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    names = _HandlerNameMiddleware()
+    for router in dp.chain_tail:
+        for observer in (router.message, router.callback_query, router.pre_checkout_query):
+            observer.middleware(names)
+    instrument_database(db)
+    bot.session.middleware(ApiMetricsMiddleware())
+
+async def start_metrics_server(host: str, port: int, path: str = "/metrics") -> web.AppRunner:
+    """HTTP-сервер с метриками процесса"""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get(path, handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,468 @@
+import asyncio
+import json
+import logging
+import re
+from datetime import datetime
+from typing import Awaitable, Callable, List, Tuple
+
+# Миграции схемы: (версия, описание, функция). Версии только растут,
+# применённые миграции никогда не меняются - для изменений пишется новая.
+Migration = Tuple[int, str, Callable[..., Awaitable[None]]]
+MIGRATIONS: List[Migration] = []
+
+def migration(version: int, description: str):
+    """Регистрация миграции схемы"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+async def rebuild_user_stats(conn):
+    """Пересчёт счётчиков user_stats по истории user_progress"""
+    await conn.execute('DELETE FROM user_stats')
+    await conn.execute('''
+        INSERT INTO user_stats
+            (user_id, completed_lessons, completed_tasks, total_points, last_activity)
+        SELECT u.user_id,
+               COUNT(DISTINCT p.lesson_id),
+               COUNT(p.task_id),
+               IFNULL(u.total_points, 0),
+               MAX(p.completed_at)
+        FROM users u LEFT JOIN user_progress p ON p.user_id = u.user_id
+        GROUP BY u.user_id
+    ''')
+
+@migration(1, "Базовая схема")
+async def _base_schema(conn):
+    # IF NOT EXISTS: базы, созданные до появления миграций, уже содержат эти таблицы
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            full_name TEXT,
+            registration_date TIMESTAMP,
+            total_points INTEGER DEFAULT 0,
+            current_course_id INTEGER,
+            subscription_active BOOLEAN DEFAULT 0
+        )
+    ''')
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            price INTEGER,
+            duration_days INTEGER,
+            is_active BOOLEAN DEFAULT 1
+        )
+    ''')
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS lessons (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            video_file_id TEXT,
+            lesson_order INTEGER,
+            points_reward INTEGER DEFAULT 10,
+            FOREIGN KEY (course_id) REFERENCES courses (id)
+        )
+    ''')
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lesson_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            task_type TEXT,
+            points_reward INTEGER DEFAULT 20,
+            correct_answers TEXT,
+            FOREIGN KEY (lesson_id) REFERENCES lessons (id)
+        )
+    ''')
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_progress (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            lesson_id INTEGER,
+            task_id INTEGER,
+            completed_at TIMESTAMP,
+            points_earned INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL
+        )
+    ''')
+
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            admin_id INTEGER,
+            created_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            status TEXT DEFAULT 'running',
+            last_user_id INTEGER DEFAULT 0,
+            delivered INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Добавим несколько тестовых курсов
+    async with conn.execute('SELECT COUNT(*) FROM courses') as cursor:
+        (courses_count,) = await cursor.fetchone()
+    if courses_count == 0:
+        test_courses = [
+            ("Основы футбола", "Базовый курс для начинающих", 1990, 30),
+            ("Продвинутая техника", "Курс для опытных игроков", 2990, 45),
+            ("Мастер-класс", "Профессиональный уровень", 4990, 60)
+        ]
+        await conn.executemany('''
+            INSERT INTO courses (title, description, price, duration_days)
+            VALUES (?, ?, ?, ?)
+        ''', test_courses)
+
+@migration(2, "Счётчики прогресса user_stats")
+async def _user_stats(conn):
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            completed_lessons INTEGER DEFAULT 0,
+            completed_tasks INTEGER DEFAULT 0,
+            total_points INTEGER DEFAULT 0,
+            last_activity TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    await rebuild_user_stats(conn)
+
+@migration(3, "Индексы и уникальность записей прогресса")
+async def _indexes(conn):
+    # Повторные записи об одном и том же уроке/задании: оставляем первую
+    await conn.execute('''
+        DELETE FROM user_progress WHERE lesson_id IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM user_progress WHERE lesson_id IS NOT NULL
+            GROUP BY user_id, lesson_id
+        )
+    ''')
+    await conn.execute('''
+        DELETE FROM user_progress WHERE task_id IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM user_progress WHERE task_id IS NOT NULL
+            GROUP BY user_id, task_id
+        )
+    ''')
+
+    await conn.execute('DROP INDEX IF EXISTS idx_user_progress_user_lesson')
+    await conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_user_progress_user ON user_progress (user_id)'
+    )
+    await conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_user_progress_lesson
+        ON user_progress (user_id, lesson_id) WHERE lesson_id IS NOT NULL
+    ''')
+    await conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_user_progress_task
+        ON user_progress (user_id, task_id) WHERE task_id IS NOT NULL
+    ''')
+    await conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_lessons_course_order ON lessons (course_id, lesson_order)'
+    )
+    await conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_lesson ON tasks (lesson_id)')
+    await conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_users_total_points ON users (total_points DESC)'
+    )
+    await conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)'
+    )
+
+    # Счётчики могли учитывать удалённые дубли
+    await rebuild_user_stats(conn)
+
+@migration(4, "Ключи однократных выполнений")
+async def _completion_keys(conn):
+    # Один ключ на выполнение: lesson:<id>, task:<id>, demo:<курс>, quiz:<тест>:<вопрос>...
+    await conn.execute('ALTER TABLE user_progress ADD COLUMN completion_key TEXT')
+    await conn.execute('''
+        UPDATE user_progress SET completion_key = 'lesson:' || lesson_id
+        WHERE lesson_id IS NOT NULL
+    ''')
+    await conn.execute('''
+        UPDATE user_progress SET completion_key = 'task:' || task_id
+        WHERE task_id IS NOT NULL AND lesson_id IS NULL
+    ''')
+    await conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_user_progress_key
+        ON user_progress (user_id, completion_key) WHERE completion_key IS NOT NULL
+    ''')
+
+@migration(5, "Вопросы тестов в tasks")
+async def _quiz_questions(conn):
+    # Вопрос теста - задание с task_type = 'quiz': title - вопрос, description -
+    # пояснение к ответу, options - JSON-список вариантов, correct_answers -
+    # JSON-список номеров правильных вариантов (с 0)
+    await conn.execute('ALTER TABLE tasks ADD COLUMN quiz TEXT')
+    await conn.execute('ALTER TABLE tasks ADD COLUMN question_order INTEGER')
+    await conn.execute('ALTER TABLE tasks ADD COLUMN options TEXT')
+    await conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_tasks_quiz ON tasks (quiz, question_order)'
+    )
+
+    # Вопросы, которые раньше были зашиты в обработчики
+    questions = [
+        ("theory", 1, "Сколько игроков находится на поле от одной команды во время матча?",
+         ["10 игроков", "11 игроков", "12 игроков"], [1], 20,
+         "В футболе на поле от одной команды находится 11 игроков (включая вратаря)."),
+        ("theory", 2, "Какая часть тела НЕ может касаться мяча во время игры "
+                      "(кроме вратаря в штрафной площади)?",
+         ["Голова", "Руки", "Грудь"], [1], 20,
+         "Руками мяч может касаться только вратарь в своей штрафной площади."),
+        ("rules", 1, "Что происходит, если мяч полностью пересек боковую линию?",
+         ["Угловой удар", "Вбрасывание", "Штрафной удар"], [1], 25,
+         "Когда мяч полностью пересекает боковую линию, игра возобновляется вбрасыванием руками."),
+        ("rules", 2, "Сколько времени длится стандартный футбольный матч?",
+         ["80 минут", "90 минут", "100 минут"], [1], 25,
+         "Футбольный матч длится 90 минут: два тайма по 45 минут + компенсированное время."),
+    ]
+    for quiz, order, title, options, correct, points, explanation in questions:
+        cursor = await conn.execute('''
+            INSERT INTO tasks (title, description, task_type, points_reward, correct_answers,
+                               quiz, question_order, options)
+            VALUES (?, ?, 'quiz', ?, ?, ?, ?, ?)
+        ''', (title, explanation, points, json.dumps(correct), quiz, order,
+              json.dumps(options, ensure_ascii=False)))
+
+        # Ответы, данные до появления движка тестов, становятся выполнением задания
+        await conn.execute('''
+            UPDATE user_progress SET task_id = ?, completion_key = 'task:' || ?
+            WHERE completion_key = ?
+        ''', (cursor.lastrowid, cursor.lastrowid, f"quiz:{quiz}:{order}"))
+
+    await rebuild_user_stats(conn)
+
+@migration(6, "Реестр медиафайлов и ссылка урока на видео")
+async def _media_registry(conn):
+    # Короткий id вместо file_id: file_id не помещается в 64 байта callback_data
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS media (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT NOT NULL UNIQUE,
+            duration INTEGER,
+            file_size INTEGER,
+            uploaded_by INTEGER,
+            created_at TIMESTAMP
+        )
+    ''')
+    # lessons.video_file_id остаётся для старых уроков, у них нет file_unique_id
+    await conn.execute('ALTER TABLE lessons ADD COLUMN media_id INTEGER REFERENCES media (id)')
+
+@migration(7, "Карточки-превью и их file_id")
+async def _previews(conn):
+    # key: "media:<id>", "lesson:<id>", "course:<id>"; file_id появляется после первой отправки
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS previews (
+            key TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            file_id TEXT,
+            updated_at TIMESTAMP
+        )
+    ''')
+
+@migration(8, "Сводные счётчики статистики stats_rollup")
+async def _stats_rollup(conn):
+    # day = '' - счётчик за всё время, иначе 'YYYY-MM-DD'
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_rollup (
+            day TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, metric)
+        )
+    ''')
+
+    # Начальные значения - по уже накопленным данным
+    backfill = [
+        "SELECT '', 'users', COUNT(*) FROM users",
+        "SELECT '', 'points', IFNULL(SUM(total_points), 0) FROM users",
+        '''SELECT '', 'purchases', COUNT(*) FROM users
+           WHERE subscription_active = 1 AND current_course_id IS NOT NULL''',
+        '''SELECT '', 'purchases:' || current_course_id, COUNT(*) FROM users
+           WHERE subscription_active = 1 AND current_course_id IS NOT NULL
+           GROUP BY current_course_id''',
+        '''SELECT '', 'lesson:' || lesson_id, COUNT(*) FROM user_progress
+           WHERE lesson_id IS NOT NULL GROUP BY lesson_id''',
+        '''SELECT date(registration_date), 'new_users', COUNT(*) FROM users
+           WHERE registration_date IS NOT NULL GROUP BY 1''',
+        '''SELECT date(completed_at), 'active_users', COUNT(DISTINCT user_id) FROM user_progress
+           WHERE completed_at IS NOT NULL GROUP BY 1''',
+        '''SELECT date(completed_at), 'points', SUM(points_earned) FROM user_progress
+           WHERE completed_at IS NOT NULL GROUP BY 1''',
+        '''SELECT date(completed_at), 'lessons', COUNT(*) FROM user_progress
+           WHERE completed_at IS NOT NULL AND lesson_id IS NOT NULL GROUP BY 1''',
+        '''SELECT date(completed_at), 'tasks', COUNT(*) FROM user_progress
+           WHERE completed_at IS NOT NULL AND task_id IS NOT NULL GROUP BY 1''',
+    ]
+    for query in backfill:
+        await conn.execute('INSERT OR REPLACE INTO stats_rollup (day, metric, value) ' + query)
+
+@migration(9, "Версии кэшей справочников cache_versions")
+async def _cache_versions(conn):
+    # Версия растёт при каждом изменении данных кэша; процессы сверяют её со
+    # своей и перечитывают устаревшие кэши
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+async def schema_version(conn) -> int:
+    """Текущая версия схемы (0 - миграции ещё не применялись)"""
+    await conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP
+        )
+    ''')
+    return await _applied_version(conn)
+
+async def _applied_version(conn) -> int:
+    async with conn.execute('SELECT MAX(version) FROM schema_version') as cursor:
+        (version,) = await cursor.fetchone()
+    return version or 0
+
+async def apply_migrations(conn) -> int:
+    """Применение новых миграций; каждая - в своей транзакции.
+
+    Повторный запуск ничего не делает, поэтому вызывается при каждом старте.
+    Несколько процессов могут запускать миграции одновременно: каждая
+    миграция применяется под блокировкой записи ровно одним из них.
+    """
+    current = await schema_version(conn)
+    await conn.commit()
+
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+
+        # DDL в sqlite3 не открывает транзакцию сам - открываем явно.
+        # IMMEDIATE сразу берёт блокировку записи, и второй процесс ждёт
+        # её (busy_timeout), а не читает ту же версию параллельно
+        await conn.execute('BEGIN IMMEDIATE')
+        try:
+            current = await _applied_version(conn)
+            if version <= current:
+                # Пока ждали блокировку, миграцию применил другой процесс
+                await conn.rollback()
+                continue
+            await apply(conn)
+            await conn.execute(
+                'INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                (version, description, datetime.now())
+            )
+        except BaseException:
+            await conn.rollback()
+            raise
+        await conn.commit()
+
+        logging.info("Схема базы обновлена до версии %s: %s", version, description)
+        current = version
+
+    return current
+
+# Частые запросы, которые должны идти по индексам: (запрос, параметры).
+# Тексты совпадают с запросами в коде; tests/test_query_plans.py проверяет
+# и этот список, и все запросы, выполненные при прогоне сессий
+HOT_QUERIES = [
+    # На каждое обновление
+    ('SELECT state, data, updated_at FROM fsm_states WHERE key = ? AND updated_at >= ?', ('k', 0)),
+    ('INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)',
+     ('k', None, '{}', 0)),
+    ('DELETE FROM fsm_states WHERE key = ?', ('k',)),
+    ('SELECT total_points FROM users WHERE user_id = ?', (1,)),
+    ('''SELECT completed_lessons, completed_tasks, total_points, last_activity
+        FROM user_stats WHERE user_id = ?''', (1,)),
+    ('SELECT completion_key FROM user_progress WHERE user_id = ? AND completion_key IS NOT NULL',
+     (1,)),
+    ('SELECT subscription_active, current_course_id FROM users WHERE user_id = ?', (1,)),
+    ('SELECT description FROM lessons WHERE id = ?', (1,)),
+    # Сброс журнала очков
+    ('''INSERT OR IGNORE INTO user_progress
+            (user_id, lesson_id, task_id, completion_key, completed_at, points_earned)
+        SELECT value ->> 0, value ->> 1, value ->> 2, value ->> 3, value ->> 4, value ->> 5
+        FROM json_each(?)''', ('[[1, null, 1, "task:1", "2024-01-01 00:00:00", 10]]',)),
+    ('''SELECT batch.key FROM json_each(?) AS batch
+        WHERE NOT EXISTS (
+            SELECT 1 FROM user_progress
+            WHERE user_id = batch.value ->> 0 AND completion_key = batch.value ->> 3
+              AND completed_at = batch.value ->> 4
+        )''', ('[[1, null, 1, "task:1", "2024-01-01 00:00:00", 10]]',)),
+    ('UPDATE users SET total_points = total_points + ? WHERE user_id = ?', (1, 1)),
+    ('''UPDATE user_stats SET
+            completed_lessons = completed_lessons + ?,
+            completed_tasks = completed_tasks + ?,
+            total_points = total_points + ?,
+            last_activity = ?
+        WHERE user_id = ?''', (0, 0, 0, 0, 1)),
+    ('SELECT user_id, last_activity FROM user_stats WHERE user_id IN (?, ?)', (1, 2)),
+    ('''INSERT INTO stats_rollup (day, metric, value) VALUES (?, ?, ?)
+        ON CONFLICT (day, metric) DO UPDATE SET value = value + excluded.value''', ('', 'x', 1)),
+    # Фоновые задачи и загрузка кэшей
+    ('DELETE FROM fsm_states WHERE updated_at < ?', (0,)),
+    ('SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?', (0, 500)),
+    ('SELECT user_id, full_name, total_points FROM users ORDER BY total_points DESC', ()),
+    ('''SELECT id, course_id, title, video_file_id, media_id, points_reward
+        FROM lessons ORDER BY course_id, lesson_order''', ()),
+    ('''SELECT id, quiz, title, description, options, correct_answers, points_reward
+        FROM tasks WHERE quiz IS NOT NULL ORDER BY quiz, question_order''', ()),
+    ('SELECT day, metric, value FROM stats_rollup WHERE day = ? OR day >= ?', ('', '2024-01-01')),
+    ('''SELECT id, kind, file_id, file_unique_id, duration, file_size
+        FROM media WHERE file_unique_id = ?''', ('x',)),
+]
+
+# Полный просмотр таблицы или сортировка во временном B-дереве
+_BAD_PLAN = re.compile(r'^SCAN \w+$|USE TEMP B-TREE')
+
+async def check_query_plans(conn) -> List[Tuple[str, str]]:
+    """Частые запросы, план которых не использует индекс: (запрос, шаг плана)"""
+    problems = []
+    for query, params in HOT_QUERIES:
+        async with conn.execute('EXPLAIN QUERY PLAN ' + query, params) as cursor:
+            for row in await cursor.fetchall():
+                detail = row[-1]
+                if _BAD_PLAN.search(detail):
+                    problems.append((' '.join(query.split()), detail))
+    return problems
+
+async def _main():
+    import aiosqlite
+    from config import DB_PATH
+
+    async with aiosqlite.connect(DB_PATH) as conn:
+        version = await apply_migrations(conn)
+        print(f"Версия схемы: {version}")
+
+        problems = await check_query_plans(conn)
+        for query, detail in problems:
+            print(f"❌ {detail}: {query}")
+        if not problems:
+            print("✅ Все частые запросы используют индексы")
+        return 1 if problems else 0
+
+if __name__ == "__main__":
+    # python migrations.py - применить миграции и проверить планы запросов
+    raise SystemExit(asyncio.run(_main()))
@@ -1,31 +1,23 @@
-from aiogram import types, F, Router, Bot
+from aiogram import types, F
 from aiogram.types import LabeledPrice, PreCheckoutQuery, InlineKeyboardMarkup, InlineKeyboardButton
 import json
-import sqlite3
 
-payments_router = Router()
+from callbacks import CallbackRouter
+from database import Database
+from sender import PRIORITY_HIGH, send_priority
+
+payments_router = CallbackRouter(name="payments")
 
 # Настройки платежей
 PAYMENT_PROVIDER_TOKEN = ""  # Получить у @BotFather командой /mybots -> Bot Settings -> Payments
 
 # Создание инвойса
-@payments_router.callback_query(F.data.startswith("purchase_"))
-async def create_invoice(callback: types.CallbackQuery):
-    course_id = callback.data.replace("purchase_", "")
-    
-    # Получаем информацию о курсе из базы данных
-    from database import Database
-    from config import DB_PATH
+@payments_router.prefix("purchase_", int)
+async def create_invoice(callback: types.CallbackQuery, payload: int, db: Database):
+    course_id = payload
     
-    db = Database(DB_PATH)
-    courses = db.get_courses()
-    
-    # Находим нужный курс
-    selected_course = None
-    for course in courses:
-        if str(course[0]) == course_id:
-            selected_course = course
-            break
+    # Получаем информацию о курсе из каталога
+    selected_course = db.get_course(course_id)
     
     if not selected_course:
         await callback.answer("❌ Курс не найден!")
@@ -89,7 +81,7 @@ async def create_invoice(callback: types.CallbackQuery):
         )
 
 # Связаться с администратором
-@payments_router.callback_query(F.data == "contact_admin")
+@payments_router.exact("contact_admin")
 async def contact_admin(callback: types.CallbackQuery):
     from config import ADMIN_IDS
     
@@ -119,7 +111,7 @@ async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery):
 
 # Successful payment
 @payments_router.message(F.successful_payment)
-async def process_successful_payment(message: types.Message):
+async def process_successful_payment(message: types.Message, db: Database):
     payment = message.successful_payment
     
     # Извлекаем ID курса из payload
@@ -127,41 +119,40 @@ async def process_successful_payment(message: types.Message):
     course_id = payload.replace("course_", "")
     
     # Активируем курс для пользователя
-    from database import Database
-    from config import DB_PATH
-    
-    db = Database(DB_PATH)
     user_id = message.from_user.id
     
     # Обновляем подписку пользователя
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE users SET subscription_active = 1, current_course_id = ?
-            WHERE user_id = ?
-        ''', (course_id, user_id))
-        conn.commit()
-        conn.close()
+        activated = await db.activate_subscription(user_id, int(course_id))
         
-        # Добавляем бонусные очки за покупку
-        db.add_points(user_id, 100)
-        
-        success_text = (
-            f"🎉 <b>Платеж успешно выполнен!</b>\n\n"
-            f"💰 <b>Сумма:</b> {payment.total_amount // 100} {payment.currency}\n"
-            f"🆔 <b>ID транзакции:</b> {payment.telegram_payment_charge_id}\n\n"
-            f"✅ Курс активирован!\n"
-            f"🎁 <b>Бонус:</b> +100 очков\n\n"
-            f"📚 Теперь вы можете приступить к обучению!"
-        )
+        if activated:
+            # Бонусные очки за покупку - один раз на курс
+            await db.complete(user_id, f"purchase:{course_id}", 100)
+            success_text = (
+                f"🎉 <b>Платеж успешно выполнен!</b>\n\n"
+                f"💰 <b>Сумма:</b> {payment.total_amount // 100} {payment.currency}\n"
+                f"🆔 <b>ID транзакции:</b> {payment.telegram_payment_charge_id}\n\n"
+                f"✅ Курс активирован!\n"
+                f"🎁 <b>Бонус:</b> +100 очков\n\n"
+                f"📚 Теперь вы можете приступить к обучению!"
+            )
+        else:
+            # Повтор оплаты уже активного курса: бонус за него уже начислен
+            success_text = (
+                f"ℹ️ <b>Этот курс у вас уже активен</b>\n\n"
+                f"💰 <b>Сумма:</b> {payment.total_amount // 100} {payment.currency}\n"
+                f"🆔 <b>ID транзакции:</b> {payment.telegram_payment_charge_id}\n\n"
+                f"Если оплата прошла повторно по ошибке, обратитесь к администратору.\n\n"
+                f"📚 Продолжайте обучение!"
+            )
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="📖 Мои курсы", callback_data="my_courses")],
             [InlineKeyboardButton(text="📊 Мой прогресс", callback_data="my_progress")]
         ])
         
-        await message.answer(success_text, reply_markup=keyboard, parse_mode="HTML")
+        with send_priority(PRIORITY_HIGH):
+            await message.answer(success_text, reply_markup=keyboard, parse_mode="HTML")
         
     except Exception as e:
         await message.answer(
@@ -170,24 +161,14 @@ async def process_successful_payment(message: types.Message):
         )
 
 # Тестовая покупка (для разработки)
-@payments_router.callback_query(F.data.startswith("test_purchase_"))
-async def test_purchase(callback: types.CallbackQuery):
+@payments_router.prefix("test_purchase_", int)
+async def test_purchase(callback: types.CallbackQuery, payload: int, db: Database):
     """Тестовая покупка для разработки"""
-    course_id = callback.data.replace("test_purchase_", "")
+    course_id = payload
     user_id = callback.from_user.id
     
     # Получаем информацию о курсе
-    from database import Database
-    from config import DB_PATH
-    
-    db = Database(DB_PATH)
-    courses = db.get_courses()
-    
-    selected_course = None
-    for course in courses:
-        if str(course[0]) == course_id:
-            selected_course = course
-            break
+    selected_course = db.get_course(course_id)
     
     if not selected_course:
         await callback.answer("❌ Курс не найден!")
@@ -197,24 +178,20 @@ async def test_purchase(callback: types.CallbackQuery):
     
     # Имитируем успешную покупку
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE users SET subscription_active = 1, current_course_id = ?
-            WHERE user_id = ?
-        ''', (course_id, user_id))
-        conn.commit()
-        conn.close()
+        activated = await db.activate_subscription(user_id, course_id_int)
         
-        # Добавляем бонусные очки
-        db.add_points(user_id, 100)
+        if activated:
+            # Бонусные очки - один раз на курс
+            await db.complete(user_id, f"purchase:{course_id_int}", 100)
+            status = f"✅ <b>Статус:</b> Активирован\n🎁 <b>Бонус:</b> +100 очков\n\n"
+        else:
+            status = f"ℹ️ <b>Статус:</b> Уже был активен\n\n"
         
         await callback.message.edit_text(
             f"🧪 <b>ТЕСТОВАЯ ПОКУПКА ЗАВЕРШЕНА</b>\n\n"
             f"📖 <b>Курс:</b> {title}\n"
             f"💰 <b>Цена:</b> {price} руб. (не списана)\n"
-            f"✅ <b>Статус:</b> Активирован\n"
-            f"🎁 <b>Бонус:</b> +100 очков\n\n"
+            + status +
             f"⚠️ <i>Это демонстрация функционала для разработки</i>\n"
             f"💡 Реальные платежи требуют настройки с провайдером",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
@@ -236,7 +213,7 @@ async def test_purchase(callback: types.CallbackQuery):
         )
 
 # Инструкции по настройке платежей (для администраторов)
-@payments_router.callback_query(F.data == "payment_setup_info")
+@payments_router.exact("payment_setup_info")
 async def payment_setup_info(callback: types.CallbackQuery):
     from config import ADMIN_IDS
     
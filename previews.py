@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, Optional, Set, Union
+
+import aiofiles
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, FSInputFile, InlineKeyboardMarkup, InputMediaPhoto, Message
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from config import PREVIEW_FONT, PREVIEW_WORKERS, PREVIEWS_DIR
+
+# Размеры карточек: имя -> (ширина, высота). "card" отправляется в чат
+SIZES = {
+    "card": (1280, 720),
+    "square": (640, 640),
+    "thumb": (320, 180),
+}
+SOURCE_NAME = "source.jpg"
+# Ограничение Telegram на длину подписи к фото
+CAPTION_LIMIT = 1024
+
+def _load_font(path: Optional[str], size: int):
+    if path:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            pass
+    return ImageFont.load_default()
+
+def _wrap(draw, text: str, font, width: int, max_lines: int = 3):
+    lines, line = [], ""
+    for word in text.split():
+        candidate = f"{line} {word}".strip()
+        if line and draw.textlength(candidate, font=font) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+    if len(lines) > max_lines:
+        lines = lines[:max_lines]
+        lines[-1] = lines[-1].rstrip(".,") + "…"
+    return lines
+
+def render_cards(source: bytes, title: str, font_path: Optional[str] = None) -> Dict[str, bytes]:
+    """Карточки всех размеров из картинки-источника: имя размера -> JPEG.
+
+    Чистая функция без ввода-вывода: выполняется в отдельном процессе,
+    на вход можно подать байты любого локального файла-картинки.
+    """
+    with Image.open(BytesIO(source)) as image:
+        base = image.convert("RGB")
+
+    cards = {}
+    for name, (width, height) in SIZES.items():
+        card = ImageOps.fit(base, (width, height), Image.LANCZOS)
+
+        # Затемнённая полоса внизу, чтобы заголовок читался на любом фоне
+        band = height // 3
+        shade = Image.new("L", (width, band), 150)
+        card.paste((0, 0, 0), (0, height - band, width, height), shade)
+
+        draw = ImageDraw.Draw(card)
+        font = _load_font(font_path, max(12, height // 12))
+        margin = width // 20
+        lines = _wrap(draw, title, font, width - 2 * margin)
+        line_height = font.size * 1.2 if hasattr(font, "size") else 14
+        y = height - band + (band - line_height * len(lines)) / 2
+        for line in lines:
+            draw.text((margin, y), line, font=font, fill=(255, 255, 255))
+            y += line_height
+
+        output = BytesIO()
+        card.save(output, "JPEG", quality=85, optimize=True)
+        cards[name] = output.getvalue()
+    return cards
+
+class PreviewStore:
+    """Карточки-превью курсов и уроков с кэшем file_id отправленных фото.
+
+    Картинки рисуются в пуле процессов (Pillow держит GIL и заблокировал бы
+    event loop), на диск пишутся через aiofiles. После первой отправки
+    Telegram возвращает file_id фото - он сохраняется в previews, и дальше
+    карточка отправляется по file_id без повторной загрузки файла.
+    Новую карточку другие процессы подхватывают по версии кэша "previews".
+    """
+
+    def __init__(self, directory: str, workers: int = 2, font_path: Optional[str] = None):
+        self.directory = directory
+        self.workers = workers
+        self.font_path = font_path
+        self.db = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._paths: Dict[str, str] = {}
+        self._file_ids: Dict[str, str] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def load(self, db):
+        """Загрузка известных карточек из базы"""
+        self.db = db
+        rows = await db.fetchall('SELECT key, path, file_id FROM previews')
+        self._paths = {key: path for key, path, _ in rows if os.path.exists(path)}
+        self._file_ids = {key: file_id for key, _, file_id in rows
+                          if file_id and key in self._paths}
+
+    async def close(self):
+        """Дождаться начатых карточек и остановить пул процессов"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, а не fork: в процессе уже работают потоки aiosqlite и
+            # пула, и копия их блокировок в дочернем процессе может зависнуть
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _dir(self, key: str) -> str:
+        return os.path.join(self.directory, key.replace(":", "_"))
+
+    def source_path(self, key: str) -> str:
+        return os.path.join(self._dir(key), SOURCE_NAME)
+
+    def has(self, key: str) -> bool:
+        return key in self._paths
+
+    def photo(self, key: str) -> Optional[Union[str, FSInputFile]]:
+        """Что передать в send_photo: file_id, файл с диска или None"""
+        file_id = self._file_ids.get(key)
+        if file_id:
+            return file_id
+        path = self._paths.get(key)
+        return FSInputFile(path) if path else None
+
+    async def remember_file_id(self, key: str, message):
+        """Сохранить file_id фото, которое Telegram вернул после отправки"""
+        if key in self._file_ids or not message or not message.photo:
+            return
+        file_id = message.photo[-1].file_id
+        self._file_ids[key] = file_id
+        await self.db.execute(
+            'UPDATE previews SET file_id = ? WHERE key = ?', (file_id, key)
+        )
+
+    async def save_source(self, key: str, source: bytes):
+        """Сохранить картинку-источник, из которой потом рисуются карточки"""
+        os.makedirs(self._dir(key), exist_ok=True)
+        async with aiofiles.open(self.source_path(key), "wb") as file:
+            await file.write(source)
+
+    async def read_source(self, key: str) -> Optional[bytes]:
+        path = self.source_path(key)
+        if not os.path.exists(path):
+            return None
+        async with aiofiles.open(path, "rb") as file:
+            return await file.read()
+
+    async def generate(self, key: str, title: str, source: bytes) -> str:
+        """Нарисовать карточки для key и вернуть путь к основной"""
+        loop = asyncio.get_running_loop()
+        cards = await loop.run_in_executor(
+            self._pool(), render_cards, source, title, self.font_path
+        )
+
+        directory = self._dir(key)
+        os.makedirs(directory, exist_ok=True)
+        for name, data in cards.items():
+            async with aiofiles.open(os.path.join(directory, f"{name}.jpg"), "wb") as file:
+                await file.write(data)
+
+        path = os.path.join(directory, "card.jpg")
+        # Картинка новая - старый file_id больше не подходит
+        await self.db.execute('''
+            INSERT INTO previews (key, path, file_id, updated_at) VALUES (?, ?, NULL, ?)
+            ON CONFLICT (key) DO UPDATE SET path = excluded.path, file_id = NULL,
+                                            updated_at = excluded.updated_at
+        ''', (key, path, datetime.now()))
+        # Иначе другие процессы продолжат слать старую картинку по file_id
+        await self.db.bump_cache("previews")
+        self._paths[key] = path
+        self._file_ids.pop(key, None)
+        return path
+
+    def schedule(self, coro):
+        """Запустить генерацию в фоне; ошибки только пишутся в лог"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning("Не удалось создать превью: %s", task.exception())
+
+previews = PreviewStore(PREVIEWS_DIR, PREVIEW_WORKERS, PREVIEW_FONT)
+
+async def edit_page(callback: CallbackQuery, text: str, keyboard: InlineKeyboardMarkup,
+                    photo_key: Optional[str] = None):
+    """Показать страницу на месте сообщения: с карточкой-фото или текстом.
+
+    Текстовое сообщение нельзя превратить в фото и наоборот, поэтому при
+    смене вида сообщение заменяется новым.
+    """
+    message = callback.message
+    photo = previews.photo(photo_key) if photo_key and len(text) <= CAPTION_LIMIT else None
+
+    if photo is None and not message.photo:
+        await message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        return
+
+    if photo is not None and message.photo:
+        sent = await message.edit_media(
+            InputMediaPhoto(media=photo, caption=text, parse_mode="HTML"), reply_markup=keyboard
+        )
+    else:
+        try:
+            await message.delete()
+        except TelegramBadRequest:
+            # Старые сообщения удалить нельзя - просто отправляем новое
+            pass
+        if photo is None:
+            await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+            return
+        sent = await message.answer_photo(
+            photo, caption=text, reply_markup=keyboard, parse_mode="HTML"
+        )
+
+    if isinstance(sent, Message):
+        await previews.remember_file_id(photo_key, sent)
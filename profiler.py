@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Dispatcher
+
+from callbacks import CallbackRouter
+
+# Верх стека, на котором event loop ждёт событий, - простой, а не работа
+_IDLE_FRAME = "select (selectors.py:"
+
+def handler_codes(dp: Dispatcher) -> Dict[object, str]:
+    """Код всех обработчиков диспетчера -> имя обработчика"""
+    codes = {}
+    for router in dp.chain_tail:
+        callbacks = [
+            handler.callback
+            for observer in router.observers.values()
+            for handler in observer.handlers
+        ]
+        if isinstance(router, CallbackRouter):
+            callbacks += [route.callback for route in router.routes()]
+        for callback in callbacks:
+            code = getattr(callback, "__code__", None)
+            if code is not None and code.co_name != "_dispatch":
+                codes[code] = code.co_name
+    return codes
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class Stall:
+    """Event loop не отвечал дольше порога"""
+
+    __slots__ = ("started", "duration", "handler", "stack")
+
+    def __init__(self, started: float, handler: str, stack: List[str]):
+        self.started = started
+        self.duration = 0.0
+        self.handler = handler
+        self.stack = stack
+
+class SamplingProfiler:
+    """Выборочный профилировщик event loop работающего бота.
+
+    Фоновый поток каждые interval секунд снимает стек потока event loop и
+    относит выборку к обработчику aiogram, если его функция есть в стеке.
+    Параллельно корутина-пульс отмечает, что loop жив; если пульса нет
+    дольше stall_threshold, поток запоминает стек, на котором loop завис, -
+    так видны блокирующие вызовы (например, sqlite3 прямо в обработчике).
+    Результат - файл в формате collapsed stacks для flamegraph.pl/speedscope.
+    """
+
+    def __init__(self, dp: Dispatcher, directory: str = "profiles",
+                 interval: float = 0.005, stall_threshold: float = 0.1):
+        self.dp = dp
+        self.directory = directory
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self._running: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._running is not None and not self._running.done()
+
+    def start(self, seconds: float,
+              on_report: Optional[Callable[[str, str], Awaitable]] = None) -> asyncio.Task:
+        """Запустить профилирование в фоне; on_report(путь, сводка) - по окончании"""
+        if self.running:
+            raise RuntimeError("Профилирование уже идёт")
+        self._running = asyncio.create_task(self._run_and_report(seconds, on_report))
+        return self._running
+
+    async def _run_and_report(self, seconds: float, on_report):
+        try:
+            path, summary = await self.run(seconds)
+            if on_report is not None:
+                await on_report(path, summary)
+        except Exception:
+            logging.exception("Ошибка профилирования")
+
+    async def run(self, seconds: float) -> Tuple[str, str]:
+        """Профилировать seconds секунд: (путь к collapsed-файлу, сводка)"""
+        codes = handler_codes(self.dp)
+        loop_thread = threading.get_ident()
+        samples: Counter = Counter()
+        handlers: Counter = Counter()
+        stalls: List[Stall] = []
+        beat = [time.monotonic()]
+        stop = threading.Event()
+        pending: List[Stall] = []
+
+        def stack_of_loop() -> Tuple[str, List[str]]:
+            frame = sys._current_frames().get(loop_thread)
+            names, handler = [], None
+            while frame is not None:
+                names.append(_frame_name(frame))
+                if handler is None and frame.f_code in codes:
+                    handler = codes[frame.f_code]
+                frame = frame.f_back
+            names.reverse()
+            if handler is None:
+                idle = bool(names) and names[-1].startswith(_IDLE_FRAME)
+                handler = "idle" if idle else "other"
+            return handler, names
+
+        def sample():
+            while not stop.wait(self.interval):
+                handler, names = stack_of_loop()
+                handlers[handler] += 1
+                samples[";".join([f"handler:{handler}"] + names)] += 1
+
+                lag = time.monotonic() - beat[0]
+                if lag > self.stall_threshold and not pending:
+                    stall = Stall(beat[0], handler, names)
+                    pending.append(stall)
+                    stalls.append(stall)
+
+        thread = threading.Thread(target=sample, name="sampling-profiler", daemon=True)
+        thread.start()
+        started = time.monotonic()
+        try:
+            while time.monotonic() - started < seconds:
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                if pending:
+                    # Loop снова ожил - зависание закончилось
+                    pending[0].duration = now - pending[0].started
+                    pending.clear()
+                beat[0] = now
+        finally:
+            stop.set()
+            await asyncio.get_running_loop().run_in_executor(None, thread.join)
+
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"profile-{stamp}.folded")
+        lines = [f"{stack} {count}" for stack, count in samples.most_common()]
+        await asyncio.get_running_loop().run_in_executor(None, _write, path, "\n".join(lines) + "\n")
+
+        summary = self._summary(seconds, handlers, stalls)
+        with_stalls = path[:-len(".folded")] + ".txt"
+        await asyncio.get_running_loop().run_in_executor(None, _write, with_stalls, summary)
+        logging.info("Профиль записан: %s\n%s", path, summary)
+        return path, summary
+
+    def _summary(self, seconds: float, handlers: Counter, stalls: List[Stall]) -> str:
+        total = sum(handlers.values()) or 1
+        busy = total - handlers.get("idle", 0)
+        lines = [f"Профиль за {seconds:g} с, выборок: {total}, loop занят: {busy * 100 // total}%", ""]
+        lines.append("Обработчики (доля выборок):")
+        for handler, count in handlers.most_common(15):
+            lines.append(f"  {handler}: {count * 100 / total:.1f}%")
+
+        lines.append("")
+        lines.append(f"Зависания loop дольше {self.stall_threshold * 1000:g} мс: {len(stalls)}")
+        for stall in sorted(stalls, key=lambda item: item.duration, reverse=True)[:10]:
+            lines.append(f"  {stall.duration * 1000:.0f} мс в {stall.handler}:")
+            lines += [f"    {name}" for name in stall.stack[-6:]]
+        return "\n".join(lines) + "\n"
+
+def _write(path: str, text: str):
+    with open(path, "w") as file:
+        file.write(text)
+
+def install_signal_handler(profiler: SamplingProfiler, seconds: float,
+                           signum: int = getattr(signal, "SIGUSR1", 0)):
+    """Профилирование по сигналу (kill -USR1 <pid>); отчёт пишется в лог"""
+    if not signum:
+        return
+
+    def on_signal():
+        if profiler.running:
+            logging.warning("Профилирование уже идёт")
+            return
+        logging.info("Профилирование на %s с по сигналу", seconds)
+        profiler.start(seconds)
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signum, on_signal)
+    except (NotImplementedError, RuntimeError):  # Windows
+        pass
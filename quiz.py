@@ -0,0 +1,280 @@
+import functools
+import json
+import logging
+from html import escape
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from aiogram import types
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.types import InlineKeyboardMarkup
+
+from callbacks import CallbackRouter
+from config import ADMIN_IDS
+from database import Database
+from render import ALREADY_AWARDED_TEXT, build_keyboard
+
+quiz_router = CallbackRouter(name="quiz")
+
+# Оформление тестов: код -> (эмодзи, название, текст после завершения)
+QUIZZES = {
+    "theory": (
+        "📝", "Теоретический тест",
+        "🎯 Отличная работа! Ты проверил свои теоретические знания.\n\n"
+        "💡 Совет: проходи тесты регулярно, чтобы улучшать результаты!"
+    ),
+    "rules": (
+        "🧠", "Тест на правила",
+        "🧠 Превосходно! Ты хорошо знаешь правила футбола.\n\n"
+        "⚽ Теперь можешь применить знания на практике!"
+    ),
+}
+DEFAULT_QUIZ = ("🎯", "Тест", "💪 Продолжай тренироваться!")
+
+OPTION_LETTERS = "ABCDEFGH"
+
+class Question:
+    """Вопрос теста с заранее собранными текстом и клавиатурами"""
+
+    __slots__ = (
+        "task_id", "quiz", "number", "total", "options", "correct", "points",
+        "text", "keyboard", "result_keyboard", "correct_text", "explanation"
+    )
+
+    def __init__(self, task_id: int, quiz: str, number: int, total: int, title: str,
+                 explanation: str, options: List[str], correct: FrozenSet[int], points: int):
+        emoji, name, _ = QUIZZES.get(quiz, DEFAULT_QUIZ)
+        self.task_id = task_id
+        self.quiz = quiz
+        self.number = number
+        self.total = total
+        self.options = options
+        self.correct = correct
+        self.points = points
+        self.explanation = escape(explanation or "")
+        self.correct_text = ", ".join(escape(options[i]) for i in sorted(correct))
+
+        self.text = (
+            f"{emoji} <b>{name} - Вопрос {number}/{total}</b>\n\n"
+            f"❓ <b>{escape(title)}</b>\n\n"
+            "Выбери правильный ответ:"
+        )
+        # Компактный payload: qa:<id задания>:<номер варианта>
+        self.keyboard = build_keyboard(
+            *[[(f"{OPTION_LETTERS[i]}) {option}", f"qa:{task_id}:{i}")]
+              for i, option in enumerate(options)],
+            [("🔙 К тестам", "testing")]
+        )
+        last = number == total
+        self.result_keyboard = build_keyboard(
+            [("🏁 Завершить тест", "quiz_finish") if last
+             else ("📝 Следующий вопрос", "quiz_next")],
+            [("📊 Мой прогресс", "my_progress")],
+            [("🔙 К тестам", "testing")]
+        )
+
+class QuestionBank:
+    """Вопросы всех тестов из таблицы tasks, собранные в памяти.
+
+    Загружается при старте бота; ответ ищется по id задания в словаре,
+    поэтому число вопросов не влияет ни на число обработчиков, ни на
+    скорость разбора callback. /reload_quizzes в одном процессе другие
+    подхватывают по версии кэша "quizzes".
+    """
+
+    def __init__(self):
+        self._questions: Dict[int, Question] = {}
+        self._quizzes: Dict[str, List[Question]] = {}
+        self.menu_keyboard: Optional[InlineKeyboardMarkup] = None
+
+    async def load(self, db: Database):
+        """Загрузка вопросов из базы"""
+        rows = await db.fetchall('''
+            SELECT id, quiz, title, description, options, correct_answers, points_reward
+            FROM tasks WHERE quiz IS NOT NULL ORDER BY quiz, question_order
+        ''')
+
+        grouped: Dict[str, List[tuple]] = {}
+        for row in rows:
+            try:
+                options = json.loads(row[4])
+                correct = frozenset(json.loads(row[5]))
+            except (TypeError, ValueError):
+                logging.warning("Вопрос %s пропущен: неверные options/correct_answers", row[0])
+                continue
+            if not isinstance(options, list) or not 0 < len(options) <= len(OPTION_LETTERS):
+                logging.warning("Вопрос %s пропущен: неверный список вариантов", row[0])
+                continue
+            grouped.setdefault(row[1], []).append((row, options, correct))
+
+        questions: Dict[int, Question] = {}
+        quizzes: Dict[str, List[Question]] = {}
+        for quiz, items in grouped.items():
+            for number, ((task_id, _, title, explanation, _, _, points), options, correct) \
+                    in enumerate(items, 1):
+                question = Question(task_id, quiz, number, len(items), title, explanation,
+                                    options, correct, points or 0)
+                questions[task_id] = question
+                quizzes.setdefault(quiz, []).append(question)
+
+        # Сначала тесты с оформлением, в порядке QUIZZES, потом остальные
+        order = {code: position for position, code in enumerate(QUIZZES)}
+        codes = sorted(quizzes, key=lambda code: (order.get(code, len(order)), code))
+        self.menu_keyboard = build_keyboard(
+            *[[(f"{QUIZZES.get(code, DEFAULT_QUIZ)[0]} {QUIZZES.get(code, DEFAULT_QUIZ)[1]}",
+                f"qs:{code}")] for code in codes],
+            [("⚽ Практическое задание", "practical_test")],
+            [("🔙 Главное меню", "main_menu")]
+        )
+        self._questions = questions
+        self._quizzes = quizzes
+        logging.info("Загружено вопросов тестов: %s", len(questions))
+
+    def get(self, task_id: int) -> Optional[Question]:
+        return self._questions.get(task_id)
+
+    def question(self, quiz: str, index: int) -> Optional[Question]:
+        """Вопрос теста по порядковому номеру (с 0)"""
+        questions = self._quizzes.get(quiz, ())
+        return questions[index] if 0 <= index < len(questions) else None
+
+question_bank = QuestionBank()
+
+@quiz_router.startup()
+async def load_question_bank(db: Database):
+    await question_bank.load(db)
+    db.watch_cache("quizzes", functools.partial(question_bank.load, db))
+
+def _parse_answer(payload: str) -> Tuple[int, int]:
+    task_id, option = payload.split(":")
+    return int(task_id), int(option)
+
+async def _show_question(callback: types.CallbackQuery, state: FSMContext,
+                         question: Question):
+    # Ход теста хранится в FSM: текущий вопрос и число правильных ответов
+    data = await state.get_data()
+    progress = data.get("quiz") or {}
+    if progress.get("code") != question.quiz or question.number == 1:
+        progress = {"code": question.quiz, "score": 0}
+    progress.update(task_id=question.task_id, answered=False)
+    await state.update_data(quiz=progress)
+
+    await callback.message.edit_text(
+        question.text, reply_markup=question.keyboard, parse_mode="HTML"
+    )
+
+# Раздел тестирования
+@quiz_router.exact("testing")
+async def show_testing(callback: types.CallbackQuery):
+    await callback.message.edit_text(
+        "🎯 <b>Раздел тестирования</b>\n\n"
+        "Здесь ты можешь пройти различные тесты "
+        "и проверить свои знания в футболе!\n\n"
+        "Выбери тип теста:",
+        reply_markup=question_bank.menu_keyboard,
+        parse_mode="HTML"
+    )
+
+# Начало теста (theory_test/rules_test - кнопки из старых сообщений)
+@quiz_router.prefix("qs:")
+@quiz_router.exact("theory_test", "rules_test")
+async def start_quiz(callback: types.CallbackQuery, payload: str, state: FSMContext):
+    code = payload[:-len("_test")] if payload.endswith("_test") else payload
+    question = question_bank.question(code, 0)
+    if question is None:
+        await callback.answer("❌ Тест не найден!")
+        return
+    await _show_question(callback, state, question)
+
+# Следующий вопрос текущего теста
+@quiz_router.exact("quiz_next")
+async def next_question(callback: types.CallbackQuery, state: FSMContext, db: Database):
+    progress = (await state.get_data()).get("quiz")
+    current = question_bank.get(progress["task_id"]) if progress else None
+    if current is None:
+        await callback.answer("❌ Тест не найден, начни заново")
+        return
+
+    question = question_bank.question(current.quiz, current.number)
+    if question is None:
+        await finish_quiz(callback, state, db)
+        return
+    await _show_question(callback, state, question)
+
+# Ответ на вопрос - единый обработчик для всех тестов
+@quiz_router.prefix("qa:", _parse_answer)
+async def grade_answer(callback: types.CallbackQuery, payload: Optional[Tuple[int, int]],
+                       state: FSMContext, db: Database):
+    question = question_bank.get(payload[0]) if payload else None
+    if question is None or not 0 <= payload[1] < len(question.options):
+        await callback.answer("❌ Вопрос не найден!")
+        return
+
+    is_correct = payload[1] in question.correct
+
+    # В счёт теста идёт только первый ответ на текущий вопрос
+    progress = (await state.get_data()).get("quiz")
+    if progress and progress.get("task_id") == question.task_id and not progress.get("answered"):
+        progress.update(answered=True, score=progress["score"] + is_correct)
+        await state.update_data(quiz=progress)
+
+    if is_correct:
+        awarded = await db.record_task_completion(
+            callback.from_user.id, question.task_id, question.points
+        )
+        result_text = (
+            "✅ <b>Правильно!</b>\n\n"
+            + (f"🎉 Ты заработал {question.points} очков!\n\n" if awarded
+               else ALREADY_AWARDED_TEXT)
+            + f"{question.explanation}\n\n"
+            "Продолжай изучать футбол! 💪"
+        )
+    else:
+        result_text = (
+            "❌ <b>Неправильно</b>\n\n"
+            f"Правильный ответ: <b>{question.correct_text}</b>\n\n"
+            f"{question.explanation}\n\n"
+            "Не расстраивайся, продолжай учиться! 📚"
+        )
+
+    await callback.message.edit_text(
+        result_text, reply_markup=question.result_keyboard, parse_mode="HTML"
+    )
+
+# Завершение теста
+@quiz_router.exact("quiz_finish")
+async def finish_quiz(callback: types.CallbackQuery, state: FSMContext, db: Database):
+    progress = (await state.get_data()).get("quiz")
+    current = question_bank.get(progress["task_id"]) if progress else None
+    await state.update_data(quiz=None)
+    if current is None:
+        await callback.answer("❌ Тест не найден, начни заново")
+        return
+
+    _, name, finish_text = QUIZZES.get(current.quiz, DEFAULT_QUIZ)
+    user_points = await db.get_user_points(callback.from_user.id)
+    text = (
+        f"🏁 <b>{name} завершен!</b>\n\n"
+        f"✅ <b>Правильных ответов:</b> {progress['score']} из {current.total}\n"
+        f"📊 <b>Твои текущие очки:</b> {user_points}\n"
+        f"{finish_text}"
+    )
+
+    await callback.message.edit_text(
+        text,
+        reply_markup=build_keyboard(
+            [("🔄 Пройти снова", f"qs:{current.quiz}")],
+            [("🎯 К тестам", "testing")],
+            [("🏠 Главное меню", "main_menu")]
+        ),
+        parse_mode="HTML"
+    )
+
+# Перечитать вопросы после правки таблицы tasks (для администраторов)
+@quiz_router.message(Command("reload_quizzes"))
+async def cmd_reload_quizzes(message: types.Message, db: Database):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await db.bump_cache("quizzes")
+    await question_bank.load(db)
+    await message.answer("✅ Вопросы тестов перезагружены")
@@ -0,0 +1,223 @@
+from functools import lru_cache
+from html import escape
+from typing import Dict, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+# Готовые клавиатуры кэшируются и один и тот же объект отдаётся во все
+# ответы. Модели aiogram 3.4 изменяемы, поэтому вызывающий код не должен
+# менять полученную клавиатуру - нужна другая, строится новая.
+
+def build_keyboard(*rows) -> InlineKeyboardMarkup:
+    """Клавиатура из строк вида [("Текст", "callback_data"), ...]"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=data) for text, data in row]
+        for row in rows
+    ])
+
+# Статические клавиатуры - собираются один раз при импорте
+MAIN_MENU_KEYBOARD = build_keyboard(
+    [("⚽ Мои курсы", "my_courses")],
+    [("📊 Мой прогресс", "my_progress")],
+    [("🏆 Рейтинг", "rating")],
+    [("🎯 Тестирование", "testing")],
+    [("💰 Купить курс", "buy_course")],
+    [("ℹ️ Помощь", "help")]
+)
+
+ADMIN_KEYBOARD = build_keyboard(
+    [("👥 Статистика пользователей", "admin_stats")],
+    [("➕ Добавить урок", "admin_add_lesson")],
+    [("📝 Управление заданиями", "admin_tasks")],
+    [("📢 Рассылка", "admin_broadcast")],
+    [("🔙 Главное меню", "main_menu")]
+)
+
+BACK_KEYBOARD = build_keyboard([("🔙 Назад", "main_menu")])
+
+def main_menu_keyboard():
+    return MAIN_MENU_KEYBOARD
+
+def admin_keyboard():
+    return ADMIN_KEYBOARD
+
+def back_button():
+    return BACK_KEYBOARD
+
+# Клавиатуры демо-урока зависят только от id курса
+@lru_cache(maxsize=256)
+def demo_lesson_keyboard(course_id: int) -> InlineKeyboardMarkup:
+    return build_keyboard(
+        [("✅ Урок просмотрен", f"complete_demo_{course_id}")],
+        [("💳 Купить полный курс", f"purchase_{course_id}")],
+        [("🔙 Назад", f"course_{course_id}")]
+    )
+
+@lru_cache(maxsize=256)
+def demo_complete_keyboard(course_id: int) -> InlineKeyboardMarkup:
+    return build_keyboard(
+        [("💳 Купить полный курс", f"purchase_{course_id}")],
+        [("📊 Мой прогресс", "my_progress")],
+        [("🏠 Главное меню", "main_menu")]
+    )
+
+Page = Tuple[str, InlineKeyboardMarkup]
+
+class CatalogRenderer:
+    """Тексты и клавиатуры, построенные по каталогу курсов.
+
+    Пересобираются только когда меняется версия каталога.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._version: Optional[int] = None
+        self._courses_page: Optional[Page] = None
+        self._buy_page: Optional[Page] = None
+        self._course_pages: Dict[int, Page] = {}
+
+    def _refresh(self):
+        if self._version == self.catalog.version:
+            return
+
+        courses = self.catalog.list_courses()
+        self._courses_page = self._render_courses(courses) if courses else None
+        self._buy_page = self._render_buy(courses) if courses else None
+        self._course_pages = {course[0]: self._render_course(course) for course in courses}
+        self._version = self.catalog.version
+
+    @staticmethod
+    def _render_courses(courses) -> Page:
+        text = "⚽ <b>Доступные курсы:</b>\n\n"
+        rows = []
+
+        for course_id, title, description, price in courses:
+            text += (
+                f"📖 <b>{title}</b>\n"
+                f"{description}\n"
+                f"💰 <b>Цена:</b> {price} руб.\n\n"
+            )
+            rows.append([(f"📖 {title}", f"course_{course_id}")])
+
+        rows.append([("🔙 Главное меню", "main_menu")])
+        return text, build_keyboard(*rows)
+
+    @staticmethod
+    def _render_buy(courses) -> Page:
+        text = "💰 <b>Покупка курсов</b>\n\n"
+        rows = []
+
+        for course_id, title, description, price in courses:
+            text += f"📖 <b>{title}</b> - {price} руб.\n"
+            rows.append([(f"💳 Купить {title}", f"purchase_{course_id}")])
+
+        text += "\n💡 <i>Выберите курс для покупки:</i>"
+        rows.append([("🔙 Главное меню", "main_menu")])
+        return text, build_keyboard(*rows)
+
+    @staticmethod
+    def _render_course(course) -> Page:
+        course_id, title, description, price = course
+        text = (
+            f"📖 <b>{title}</b>\n\n"
+            f"📝 <b>Описание:</b>\n{description}\n\n"
+            f"💰 <b>Цена:</b> {price} руб.\n\n"
+            f"📚 В этом курсе вы изучите основы футбола и получите практические навыки."
+        )
+        keyboard = build_keyboard(
+            [("📚 Уроки курса", f"lessons_{course_id}")],
+            [("💳 Купить курс", f"purchase_{course_id}")],
+            [("🎥 Посмотреть урок (демо)", f"demo_lesson_{course_id}")],
+            [("🔙 К курсам", "my_courses")]
+        )
+        return text, keyboard
+
+    def courses_page(self) -> Optional[Page]:
+        """Список курсов или None, если курсов нет"""
+        self._refresh()
+        return self._courses_page
+
+    def buy_page(self) -> Optional[Page]:
+        """Страница покупки или None, если курсов нет"""
+        self._refresh()
+        return self._buy_page
+
+    def course_page(self, course_id: int) -> Optional[Page]:
+        """Страница конкретного курса"""
+        self._refresh()
+        return self._course_pages.get(course_id)
+
+# Повторное выполнение того же урока или вопроса очков не приносит
+ALREADY_AWARDED_TEXT = "ℹ️ Очки за это уже были начислены раньше\n\n"
+
+# Уровни: (порог следующего уровня, название, эмодзи)
+LEVELS = (
+    (100, "🥉 Новичок", "🌱"),
+    (500, "🥈 Любитель", "⚡"),
+    (1000, "🥇 Эксперт", "🔥"),
+)
+MAX_LEVEL = ("🏆 Мастер", "⭐")
+
+PROGRESS_TEMPLATE = (
+    "📊 <b>Твой прогресс:</b>\n\n"
+    "{level_emoji} <b>Уровень:</b> {level}\n"
+    "⭐ <b>Всего очков:</b> {points}\n"
+    "📚 <b>Пройдено уроков:</b> {completed_lessons}\n"
+    "✅ <b>Выполнено заданий:</b> {completed_tasks}\n\n"
+    "{next_level}"
+    "\n💪 Продолжай тренироваться!"
+)
+NEXT_LEVEL_TEMPLATE = "🎯 До следующего уровня: {} очков\n"
+MAX_LEVEL_TEXT = "🏆 Максимальный уровень достигнут!\n"
+
+def render_progress(progress: Dict) -> str:
+    """Текст прогресса пользователя по шаблону"""
+    points = progress['total_points']
+
+    for threshold, level, level_emoji in LEVELS:
+        if points < threshold:
+            next_level = NEXT_LEVEL_TEMPLATE.format(threshold - points)
+            break
+    else:
+        level, level_emoji = MAX_LEVEL
+        next_level = MAX_LEVEL_TEXT
+
+    return PROGRESS_TEMPLATE.format(
+        level_emoji=level_emoji,
+        level=level,
+        points=points,
+        completed_lessons=progress['completed_lessons'],
+        completed_tasks=progress['completed_tasks'],
+        next_level=next_level
+    )
+
+MEDALS = {1: "🥇", 2: "🥈", 3: "🥉"}
+
+def _rating_line(entry, user_id: int) -> str:
+    rank, entry_user_id, full_name, points = entry
+    place = MEDALS.get(rank, f"{rank}.")
+    line = f"{place} {escape(full_name or 'Неизвестно')} - {points} очков"
+    return f"<b>{line}</b>" if entry_user_id == user_id else line
+
+def render_rating(rating: Dict, user_id: int) -> str:
+    """Текст рейтинга: первые места и соседи пользователя"""
+    text = "🏆 <b>Рейтинг игроков</b>\n\n"
+
+    if not rating['top']:
+        return text + "Пока никто не набрал очков. Стань первым! ⚽"
+
+    text += "\n".join(_rating_line(entry, user_id) for entry in rating['top'])
+
+    rank = rating['rank']
+    if rank is None:
+        return text + "\n\n💡 Нажми /start, чтобы попасть в рейтинг"
+
+    shown = len(rating['top'])
+    if rank > shown:
+        around = [entry for entry in rating['around'] if entry[0] > shown]
+        if around[0][0] > shown + 1:
+            text += "\n…"
+        text += "\n" + "\n".join(_rating_line(entry, user_id) for entry in around)
+
+    text += f"\n\n📍 <b>Твоё место:</b> {rank} из {rating['total_users']}"
+    return text
@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, EditMessageCaption, EditMessageReplyMarkup, EditMessageText,
+    ForwardMessage, SendDocument, SendInvoice, SendMessage, SendPhoto, SendVideo
+)
+
+# Классы приоритета: чем меньше число, тем раньше отправка
+PRIORITY_HIGH = 0  # подтверждения оплаты
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2  # рассылки
+
+# Методы, на которые действуют лимиты Telegram на сообщения
+LIMITED_METHODS = (
+    SendMessage, EditMessageText, EditMessageReplyMarkup, EditMessageCaption,
+    SendVideo, SendPhoto, SendDocument, SendInvoice, CopyMessage, ForwardMessage
+)
+
+DEFAULT_PRIORITIES = {
+    SendInvoice: PRIORITY_HIGH,
+}
+
+_priority: ContextVar[Optional[int]] = ContextVar("send_priority", default=None)
+
+@contextmanager
+def send_priority(priority: int):
+    """Приоритет всех отправок внутри блока with"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def _copy_result(source: asyncio.Future, target: asyncio.Future):
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Взять токен; если его нет - вернуть, сколько ждать (ничего не беря)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def reserve(self, now: float) -> float:
+        """Забронировать токен в долг и вернуть, сколько ждать своей очереди"""
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, now: float, seconds: float):
+        """Не выдавать токены seconds секунд (после flood wait)"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Bot API.
+
+    Подключается к сессии бота (bot.session.middleware) и действует на
+    все отправки сообщений: message.answer, edit_text, send_video,
+    send_invoice и т.д.
+
+    - общая корзина токенов (~30 сообщений/с) раздаётся по приоритетам;
+    - если задан low_rate, запросы с PRIORITY_LOW (рассылки) берут токены
+      не из общей корзины, а из своей с этой скоростью;
+    - у каждого чата своя корзина (~1 сообщение/с);
+    - при TelegramRetryAfter чат ставится на паузу и запрос повторяется;
+    - если несколько edit_text одного сообщения ждут очереди, отправляется
+      только последний, а остальные получают его результат.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 max_retries: int = 3, max_chats: int = 10000, low_rate: float = 0):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.low_bucket = TokenBucket(low_rate, low_rate) if low_rate else None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+        # (chat_id, message_id) -> результат самого свежего ожидающего edit
+        self._edits: Dict[Tuple[Any, int], asyncio.Future] = {}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                self._prune(time.monotonic())
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune(self, now: float):
+        # Полные корзины ничем не отличаются от новых - их можно забыть
+        for chat_id, bucket in list(self._chats.items()):
+            bucket._refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._chats[chat_id]
+
+    async def _pump(self):
+        while self._waiters:
+            delay = self.global_bucket.take(time.monotonic())
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+        self._pump_task = None
+
+    async def _acquire_global(self, priority: int):
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump())
+        await waiter
+
+    async def _acquire(self, priority: int):
+        if priority == PRIORITY_LOW and self.low_bucket is not None:
+            delay = self.low_bucket.reserve(time.monotonic())
+            if delay:
+                await asyncio.sleep(delay)
+        else:
+            await self._acquire_global(priority)
+
+    async def _acquire_chat(self, chat_id):
+        delay = self._chat_bucket(chat_id).reserve(time.monotonic())
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, LIMITED_METHODS):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        priority = _priority.get()
+        if priority is None:
+            priority = DEFAULT_PRIORITIES.get(type(method), PRIORITY_NORMAL)
+
+        edit_key = None
+        result_future = None
+        if isinstance(method, EditMessageText) and method.message_id is not None:
+            edit_key = (chat_id, method.message_id)
+            result_future = asyncio.get_running_loop().create_future()
+            previous = self._edits.get(edit_key)
+            if previous is not None:
+                # Более старая правка получит результат этой, если ещё не отправлена
+                result_future.add_done_callback(lambda done: _copy_result(done, previous))
+            self._edits[edit_key] = result_future
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                if chat_id is not None:
+                    await self._acquire_chat(chat_id)
+
+                if edit_key is not None and self._edits.get(edit_key) is not result_future:
+                    # Пока ждали, пришла более свежая правка того же сообщения
+                    if chat_id is not None:
+                        self._chat_bucket(chat_id).tokens += 1
+                    return await asyncio.shield(result_future)
+
+                await self._acquire(priority)
+
+                try:
+                    result = await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    if chat_id is not None:
+                        self._chat_bucket(chat_id).pause(time.monotonic(), e.retry_after)
+                    else:
+                        await asyncio.sleep(e.retry_after)
+                    continue
+
+                if result_future is not None and not result_future.done():
+                    result_future.set_result(result)
+                return result
+        except Exception as e:
+            if result_future is not None and not result_future.done():
+                result_future.set_exception(e)
+                # Помечаем исключение полученным: его пробрасываем мы сами
+                result_future.exception()
+            raise
+        finally:
+            if edit_key is not None and self._edits.get(edit_key) is result_future:
+                del self._edits[edit_key]
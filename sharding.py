@@ -0,0 +1,298 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import sys
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+import aiosqlite
+from aiogram import Bot
+
+from metrics import metrics, start_metrics_server
+from migrations import apply_migrations
+from profiler import install_signal_handler
+from webhook import WebhookServer, stop_on_signals
+
+def extract_user_id(update: Dict[str, Any]) -> int:
+    """id пользователя, от которого пришло обновление (0, если его нет)"""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user") or event.get("chat")
+        return user.get("id", 0) if user else 0
+    return 0
+
+def shard_for(update: Dict[str, Any], shards: int) -> int:
+    """Номер шарда: все обновления одного пользователя попадают в один шард"""
+    return extract_user_id(update) % shards
+
+def lane_for(update: Dict[str, Any], workers: int, lanes: int) -> int:
+    """Полоса внутри процесса-обработчика для обновления.
+
+    У всех пользователей одного процесса одинаковый остаток от деления на
+    workers, поэтому id сначала делится на workers: иначе при общем
+    делителе workers и lanes процесс занимал бы лишь часть своих полос.
+    """
+    return (extract_user_id(update) // workers) % lanes
+
+async def _consume(dp, bot: Bot, lane: asyncio.Queue):
+    # Обновления одной полосы обрабатываются строго по очереди
+    while True:
+        update = await lane.get()
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            logging.exception("Ошибка обработки обновления %s", update.get("update_id"))
+        finally:
+            lane.task_done()
+
+def _bot_module():
+    # При запуске через "python main.py" spawn уже выполнил main.py в дочернем
+    # процессе под именем __mp_main__; повторный импорт подключил бы роутеры
+    # к диспетчеру второй раз
+    module = sys.modules.get("__mp_main__")
+    if module is not None and hasattr(module, "dp"):
+        return module
+    import main
+    return main
+
+async def _worker_main(index: int, updates: multiprocessing.Queue, lanes: int, workers: int):
+    # В дочернем процессе создаются свои бот, диспетчер и пул соединений
+    main = _bot_module()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    await main.db.connect()
+    main.storage.start()
+    if index == 0:
+        # Рассылки отправляет только этот процесс, со своей долей лимита:
+        # прерванные и запущенные админом в других процессах
+        main.broadcaster.watch(main.BROADCAST_POLL_SEC)
+    else:
+        main.broadcaster.sending = False
+    await main.dp.emit_startup(bot=main.bot, **main.dp.workflow_data)
+    # kill -USR1 <pid процесса-обработчика> профилирует именно его
+    install_signal_handler(main.profiler, main.PROFILE_SECONDS)
+
+    lane_queues = [asyncio.Queue(maxsize=100) for _ in range(lanes)]
+    consumers = [asyncio.create_task(_consume(main.dp, main.bot, lane)) for lane in lane_queues]
+    metrics.queue_depth.set_function(lambda: sum(lane.qsize() for lane in lane_queues))
+    metrics_runner = None
+    if main.METRICS_PORT:
+        metrics_runner = await start_metrics_server(main.METRICS_HOST, main.METRICS_PORT + 1 + index)
+    loop = asyncio.get_running_loop()
+
+    try:
+        while True:
+            update = await loop.run_in_executor(None, updates.get)
+            if update is None:
+                break
+            await lane_queues[lane_for(update, workers, lanes)].put(update)
+
+        for lane in lane_queues:
+            await lane.join()
+    finally:
+        for task in consumers:
+            task.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        await main.dp.emit_shutdown(bot=main.bot, **main.dp.workflow_data)
+        await main.broadcaster.stop()
+        await main.storage.close()
+        await main.db.close()
+        await main.bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+def worker_process(index: int, updates: multiprocessing.Queue, lanes: int, workers: int):
+    """Точка входа процесса-обработчика"""
+    # Останавливается супервизор, а worker дорабатывает очередь до конца
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_main(index, updates, lanes, workers))
+
+class Supervisor:
+    """Процессы-обработчики и маршрутизация обновлений между ними.
+
+    Обновление уходит в процесс по id пользователя, поэтому порядок
+    обработки, FSM-сессия и кэши одного пользователя всегда живут в одном
+    процессе. Общие данные (очки, прогресс, FSM) хранятся в SQLite, а
+    начисления записываются приращениями, так что процессы не мешают
+    друг другу.
+
+    Упавший процесс перезапускается при следующем обновлении его шарда.
+    Очередь пересоздаётся: умерший процесс мог оставить заблокированной
+    старую, и обновления, которые в ней оставались, теряются - их число
+    пишется в лог.
+    """
+
+    def __init__(self, workers: int, queue_size: int = 1000, lanes: int = 16,
+                 target=worker_process):
+        self._context = multiprocessing.get_context("spawn")
+        self.queue_size = queue_size
+        self.lanes = lanes
+        self.target = target
+        self.restarts = 0
+        self._stopping = False
+        self.queues: List[multiprocessing.Queue] = [
+            self._context.Queue(maxsize=queue_size) for _ in range(workers)
+        ]
+        self.processes = [self._process(index) for index in range(workers)]
+
+    def _process(self, index: int):
+        return self._context.Process(
+            target=self.target,
+            args=(index, self.queues[index], self.lanes, len(self.queues)),
+            name=f"bot-worker-{index}"
+        )
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def _queue_for(self, update: Dict[str, Any]) -> multiprocessing.Queue:
+        index = shard_for(update, len(self.queues))
+        process = self.processes[index]
+        if not self._stopping and process.exitcode is not None:
+            self._restart(index)
+        return self.queues[index]
+
+    def _restart(self, index: int):
+        process = self.processes[index]
+        try:
+            lost = self.queues[index].qsize()
+        except NotImplementedError:
+            lost = -1
+        logging.error(
+            "%s завершился с кодом %s, перезапуск; потеряно обновлений в очереди: %s",
+            process.name, process.exitcode, lost if lost >= 0 else "неизвестно"
+        )
+        # Читать старую очередь больше некому: не ждём её фоновый поток
+        self.queues[index].cancel_join_thread()
+        self.queues[index].close()
+        self.queues[index] = self._context.Queue(maxsize=self.queue_size)
+        self.processes[index] = self._process(index)
+        self.processes[index].start()
+        self.restarts += 1
+
+    def route(self, update: Dict[str, Any]) -> bool:
+        """Передать обновление без ожидания; False, если очередь полна"""
+        try:
+            self._queue_for(update).put_nowait(update)
+        except queue.Full:
+            return False
+        return True
+
+    async def route_wait(self, update: Dict[str, Any]):
+        """Передать обновление, дождавшись места в очереди"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # Полную очередь процесс мог уже не разбирать: пока ждём места,
+            # периодически проверяем, что он жив
+            updates = self._queue_for(update)
+            try:
+                await loop.run_in_executor(None, updates.put, update, True, 1.0)
+            except queue.Full:
+                continue
+            return
+
+    async def stop(self, timeout: float = 30.0):
+        """Попросить процессы доработать очереди и дождаться их"""
+        self._stopping = True
+        for updates, process in zip(self.queues, self.processes):
+            # Полную очередь умершего процесса никто не освободит
+            if process.is_alive():
+                updates.put(None)
+
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logging.warning("%s не завершился вовремя", process.name)
+                process.terminate()
+            elif process.exitcode:
+                logging.error("%s завершился с кодом %s", process.name, process.exitcode)
+
+class ShardedWebhookServer(WebhookServer):
+    """Webhook, который отдаёт обновления процессам супервизора"""
+
+    def __init__(self, supervisor: Supervisor, path: str = "/webhook",
+                 secret: Optional[str] = None):
+        super().__init__(None, None, path, secret, workers=0)
+        self.supervisor = supervisor
+
+    def enqueue(self, update: dict) -> bool:
+        return self.supervisor.route(update)
+
+    async def drain(self):
+        pass
+
+async def _poll_updates(bot: Bot, supervisor: Supervisor):
+    # Сырой getUpdates: супервизор не тратит CPU на разбор обновлений
+    url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+    offset = None
+
+    async with aiohttp.ClientSession() as http:
+        while True:
+            params = {"timeout": 30}
+            if offset is not None:
+                params["offset"] = offset
+
+            try:
+                async with http.post(url, json=params,
+                                     timeout=aiohttp.ClientTimeout(total=40)) as response:
+                    result = await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logging.warning("Ошибка getUpdates: %s", e)
+                await asyncio.sleep(1)
+                continue
+
+            if not result.get("ok"):
+                logging.warning("getUpdates вернул ошибку: %s", result.get("description"))
+                await asyncio.sleep(1)
+                continue
+
+            for update in result["result"]:
+                await supervisor.route_wait(update)
+                offset = update["update_id"] + 1
+
+async def _migrate(db_path: str):
+    # Миграции до запуска процессов: иначе их одновременно начнут все
+    async with aiosqlite.connect(db_path) as conn:
+        await conn.execute('PRAGMA busy_timeout = 5000')
+        await apply_migrations(conn)
+
+async def run_supervisor(bot: Bot, workers: int, db_path: str, mode: str = "polling",
+                         host: str = "0.0.0.0", port: int = 8080, path: str = "/webhook",
+                         url: str = "", secret: Optional[str] = None,
+                         queue_size: int = 1000, lanes: int = 16):
+    """Запуск процессов-обработчиков и приём обновлений до SIGINT/SIGTERM"""
+    await _migrate(db_path)
+    supervisor = Supervisor(workers, queue_size, lanes)
+    supervisor.start()
+    stop_event = stop_on_signals()
+
+    server = None
+    poller = None
+    try:
+        if mode == "webhook":
+            server = ShardedWebhookServer(supervisor, path, secret)
+            await server.start(host, port)
+            if url:
+                await bot.set_webhook(url + path, secret_token=secret or None)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            poller = asyncio.create_task(_poll_updates(bot, supervisor))
+
+        await stop_event.wait()
+    finally:
+        if server is not None:
+            await server.stop()
+        if poller is not None:
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+        await supervisor.stop()
+        await bot.session.close()
@@ -0,0 +1,174 @@
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Строка stats_rollup с этим днём хранит счётчик за всё время
+ALL_TIME = ""
+
+# Изменения счётчиков: (день или ALL_TIME, метрика) -> прирост
+Deltas = Dict[Tuple[str, str], int]
+
+def _day(moment: Optional[datetime] = None) -> str:
+    return (moment or datetime.now()).date().isoformat()
+
+def _add(deltas: Deltas, day: str, metric: str, value: int = 1):
+    if value:
+        deltas[(day, metric)] = deltas.get((day, metric), 0) + value
+
+class StatsService:
+    """Сводная статистика для админ-панели без запросов к users и user_progress.
+
+    Счётчики хранятся в stats_rollup: за всё время (день ALL_TIME) и по
+    дням, и обновляются приращениями в тех же транзакциях, что и сами
+    данные: регистрация - в add_user, покупка - в activate_subscription,
+    очки, выполнения и активные за день - при сбросе журнала очков.
+    В памяти лежат итоги и последние days дней; админ-панель читает только
+    их, поэтому её стоимость не зависит от размера таблиц.
+
+    Активный за день - пользователь, у которого в этот день были
+    выполнения или начисления. Уже учтённые за сегодня пользователи
+    помнятся в памяти; остальных проверяет user_stats.last_activity, так
+    что после перезапуска никто не учитывается дважды.
+    """
+
+    def __init__(self, db, days: int = 30):
+        self.db = db
+        self.days = days
+        self._totals: Dict[str, int] = {}
+        self._daily: Dict[str, Dict[str, int]] = {}
+        # День -> пользователи, уже учтённые в active_users за этот день
+        self._active: Dict[str, Set[int]] = {}
+
+    def _first_day(self) -> str:
+        return (date.today() - timedelta(days=self.days - 1)).isoformat()
+
+    async def load(self):
+        """Загрузка итогов и последних дней из stats_rollup"""
+        rows = await self.db.fetchall(
+            'SELECT day, metric, value FROM stats_rollup WHERE day = ? OR day >= ?',
+            (ALL_TIME, self._first_day())
+        )
+        totals: Dict[str, int] = {}
+        daily: Dict[str, Dict[str, int]] = {}
+        for day, metric, value in rows:
+            if day == ALL_TIME:
+                totals[metric] = value
+            else:
+                daily.setdefault(day, {})[metric] = value
+        self._totals, self._daily = totals, daily
+
+    @staticmethod
+    def upsert(deltas: Deltas) -> Tuple[str, list]:
+        """Запрос и параметры, прибавляющие приращения к stats_rollup"""
+        # Одна вставка на все строки: сброс журнала идёт часто
+        params = [item for (day, metric), value in deltas.items() for item in (day, metric, value)]
+        return '''
+            INSERT INTO stats_rollup (day, metric, value) VALUES %s
+            ON CONFLICT (day, metric) DO UPDATE SET value = value + excluded.value
+        ''' % ", ".join(["(?, ?, ?)"] * len(deltas)), params
+
+    def apply(self, deltas: Deltas, active: Iterable[Tuple[str, int]] = ()):
+        """Учесть в памяти приращения, записанные в базу"""
+        for day, user_id in active:
+            self._active.setdefault(day, set()).add(user_id)
+        today = _day()
+        for day in [day for day in self._active if day < today]:
+            del self._active[day]
+
+        first_day = self._first_day()
+        for (day, metric), value in deltas.items():
+            if day == ALL_TIME:
+                self._totals[metric] = self._totals.get(metric, 0) + value
+            elif day >= first_day:
+                counters = self._daily.setdefault(day, {})
+                counters[metric] = counters.get(metric, 0) + value
+
+        # Дни, вышедшие из окна, больше не нужны
+        for day in [day for day in self._daily if day < first_day]:
+            del self._daily[day]
+
+    @staticmethod
+    def registration() -> Deltas:
+        deltas: Deltas = {}
+        _add(deltas, ALL_TIME, "users")
+        _add(deltas, _day(), "new_users")
+        return deltas
+
+    @staticmethod
+    def purchase(course_id: int) -> Deltas:
+        deltas: Deltas = {}
+        _add(deltas, ALL_TIME, "purchases")
+        _add(deltas, ALL_TIME, f"purchases:{course_id}")
+        _add(deltas, _day(), "purchases")
+        return deltas
+
+    def unseen(self, activity: Dict[int, datetime]) -> List[int]:
+        """Пользователи, ещё не учтённые в active_users за день своей активности"""
+        return [
+            user_id for user_id, moment in activity.items()
+            if user_id not in self._active.get(_day(moment), ())
+        ]
+
+    @staticmethod
+    def last_activity(conn: sqlite3.Connection, users: List[int]) -> Dict[int, Optional[str]]:
+        """user_stats.last_activity пользователей (синхронно, в потоке писателя)"""
+        previous: Dict[int, Optional[str]] = {}
+        for start in range(0, len(users), 500):
+            chunk = users[start:start + 500]
+            previous.update(conn.execute(
+                'SELECT user_id, last_activity FROM user_stats WHERE user_id IN (%s)'
+                % ",".join("?" * len(chunk)), chunk
+            ).fetchall())
+        return previous
+
+    @staticmethod
+    def progress(activity: Dict[int, datetime], points: Dict[int, int],
+                 lessons: Dict[int, int], tasks: Dict[int, int], lesson_ids: List[int],
+                 previous: Dict[int, Optional[str]]) -> Tuple[Deltas, List[Tuple[str, int]]]:
+        """Приращения от сброса журнала очков и новые активные (день, пользователь).
+
+        previous - last_activity из user_stats до этого сброса для
+        пользователей из unseen(): по нему видно, был ли пользователь уже
+        активен в этот день.
+        """
+        deltas: Deltas = {}
+        for lesson_id in lesson_ids:
+            _add(deltas, ALL_TIME, f"lesson:{lesson_id}")
+
+        active = []
+        for user_id, moment in activity.items():
+            day = _day(moment)
+            _add(deltas, ALL_TIME, "points", points.get(user_id, 0))
+            _add(deltas, day, "points", points.get(user_id, 0))
+            _add(deltas, day, "lessons", lessons.get(user_id, 0))
+            _add(deltas, day, "tasks", tasks.get(user_id, 0))
+            if user_id in previous:
+                last_activity = previous[user_id]
+                # last_activity хранится как 'YYYY-MM-DD HH:MM:SS...'
+                if last_activity is None or str(last_activity)[:10] < day:
+                    _add(deltas, day, "active_users")
+                active.append((day, user_id))
+        return deltas, active
+
+    def total(self, metric: str) -> int:
+        return self._totals.get(metric, 0)
+
+    def day(self, day: Optional[str] = None) -> Dict[str, int]:
+        """Счётчики за день (по умолчанию - за сегодня)"""
+        return dict(self._daily.get(day or _day(), {}))
+
+    def recent(self, days: int = 7) -> List[Tuple[str, Dict[str, int]]]:
+        """Счётчики за последние days дней, начиная с сегодняшнего"""
+        today = date.today()
+        result = []
+        for offset in range(min(days, self.days)):
+            day = (today - timedelta(days=offset)).isoformat()
+            result.append((day, self.day(day)))
+        return result
+
+    def funnel(self, course_id: int) -> List[Tuple[str, int]]:
+        """Воронка курса: покупки и число завершивших каждый урок по порядку"""
+        stages = [("Покупки", self.total(f"purchases:{course_id}"))]
+        for lesson in self.db.lessons.course_lessons(course_id):
+            stages.append((lesson.title, self.total(f"lesson:{lesson.id}")))
+        return stages
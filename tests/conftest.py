@@ -0,0 +1,31 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# main.py создаёт Bot при импорте - нужен токен правильного вида
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+import pytest
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """Модуль main с базой и превью во временном каталоге (один на все тесты)"""
+    import config
+    workdir = tmp_path_factory.mktemp("bot")
+    config.DB_PATH = str(workdir / "bot.db")
+    config.PREVIEWS_DIR = str(workdir / "previews")
+    # Тесты шлют обновления без пауз
+    config.THROTTLE_RATE = config.THROTTLE_BURST = 10 ** 6
+
+    import main
+    from benchmarks.fake_session import FakeSession
+    main.bot.session = FakeSession(0.0)
+    return main
+
+@pytest.fixture
+def database(tmp_path):
+    """Database на пустой временной базе; connect/close - внутри теста"""
+    from database import Database
+    # Журнал сбрасывается только явно
+    return Database(str(tmp_path / "test.db"), readers=2, flush_interval=3600)
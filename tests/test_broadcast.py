@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from aiogram import Bot
+
+from benchmarks.fake_session import FakeSession
+from broadcast import BroadcastEngine
+from sender import PRIORITY_LOW, OutboundScheduler, send_priority
+
+def _bot(**scheduler) -> Bot:
+    bot = Bot(token="123456:test", session=FakeSession())
+    bot.session.middleware(OutboundScheduler(chat_rate=1000, chat_burst=1000, **scheduler))
+    return bot
+
+def test_broadcasts_use_their_own_share():
+    async def run():
+        bot = _bot(global_rate=1000, low_rate=20)
+
+        async def broadcast():
+            with send_priority(PRIORITY_LOW):
+                await asyncio.gather(*(bot.send_message(chat_id, "news") for chat_id in range(40)))
+
+        started = time.monotonic()
+        sending = asyncio.create_task(broadcast())
+        await asyncio.sleep(0.1)
+        # Ответы пользователям не ждут рассылку: у них своя корзина
+        await asyncio.gather(*(bot.send_message(chat_id, "reply") for chat_id in range(100, 150)))
+        assert time.monotonic() - started < 0.5
+        await sending
+        # 20 сразу, ещё 20 - со скоростью 20 в секунду
+        assert time.monotonic() - started >= 0.9
+
+    asyncio.run(run())
+
+def test_broadcast_started_elsewhere_is_sent_by_watcher(database):
+    async def run():
+        await database.connect()
+        bot = _bot()
+        elsewhere = BroadcastEngine(database, bot)
+        elsewhere.sending = False
+        sender = BroadcastEngine(database, bot)
+        try:
+            for user_id in range(1, 6):
+                await database.add_user(user_id, f"user{user_id}", f"User {user_id}")
+
+            broadcast_id = await elsewhere.create("news", 0)
+            assert elsewhere.start(broadcast_id) is None
+
+            sender.watch(0.05)
+            for _ in range(100):
+                row = await database.fetchone(
+                    'SELECT status, delivered FROM broadcasts WHERE id = ?', (broadcast_id,)
+                )
+                if row[0] == 'done':
+                    break
+                await asyncio.sleep(0.05)
+            assert row == ('done', 5)
+            assert bot.session.calls["SendMessage"] == 5
+        finally:
+            await sender.stop()
+            await database.close()
+
+    asyncio.run(run())
@@ -0,0 +1,164 @@
+import asyncio
+import functools
+
+from database import Database
+
+def _processes(tmp_path):
+    # Две Database на одном файле - как два процесса-обработчика
+    path = str(tmp_path / "shared.db")
+    return (Database(path, readers=1, flush_interval=3600),
+            Database(path, readers=1, flush_interval=3600))
+
+def test_lesson_media_change_reaches_other_process(tmp_path):
+    first, second = _processes(tmp_path)
+
+    async def run():
+        await first.connect()
+        await second.connect()
+        try:
+            await first.execute('''
+                INSERT INTO lessons (course_id, title, description, lesson_order, points_reward)
+                VALUES (1, 'Урок', 'Описание', 1, 10)
+            ''')
+            await first.lessons.invalidate()
+            media, created = await first.media.register("video", "FILE_ID", "UNIQUE_ID")
+            assert created
+            assert await first.attach_lesson_media(1, media.id)
+
+            assert second.lessons.get(1) is None
+            await second.check_caches()
+            lesson = second.lessons.get(1)
+            assert lesson is not None
+            assert lesson.video_file_id == "FILE_ID"
+            assert second.media.get(media.id).file_id == "FILE_ID"
+
+            # Свои изменения процесс второй раз не перечитывает
+            version = first.lessons.version
+            await first.check_caches()
+            assert first.lessons.version == version
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(run())
+
+def test_check_loop_picks_up_changes(tmp_path):
+    first, second = _processes(tmp_path)
+    second.cache_check = 0.05
+
+    async def run():
+        await first.connect()
+        await second.connect()
+        try:
+            await first.execute('''
+                INSERT INTO lessons (course_id, title, description, lesson_order, points_reward)
+                VALUES (1, 'Урок', 'Описание', 1, 10)
+            ''')
+            await first.lessons.invalidate()
+            for _ in range(100):
+                if second.lessons.get(1) is not None:
+                    break
+                await asyncio.sleep(0.05)
+            assert second.lessons.get(1).title == 'Урок'
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(run())
+
+def test_reloaded_quizzes_reach_other_process(tmp_path):
+    from quiz import QuestionBank
+
+    first, second = _processes(tmp_path)
+    bank = QuestionBank()
+
+    async def run():
+        await first.connect()
+        await second.connect()
+        try:
+            # Так второй процесс подписывается при старте (load_question_bank)
+            await bank.load(second)
+            second.watch_cache("quizzes", functools.partial(bank.load, second))
+
+            await first.execute('''
+                INSERT INTO tasks (id, title, description, task_type, points_reward,
+                                   correct_answers, quiz, question_order, options)
+                VALUES (1000, 'Вопрос?', 'Пояснение', 'quiz', 5, '[0]', 'extra', 1, '["Да", "Нет"]')
+            ''')
+            await first.bump_cache("quizzes")
+
+            assert bank.get(1000) is None
+            await second.check_caches()
+            assert bank.get(1000) is not None
+            assert bank.question("extra", 0).task_id == 1000
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(run())
+
+def test_new_preview_reaches_other_process(tmp_path):
+    from previews import PreviewStore
+
+    first, second = _processes(tmp_path)
+    directory = str(tmp_path / "previews")
+    here, there = PreviewStore(directory), PreviewStore(directory)
+
+    async def run():
+        await first.connect()
+        await second.connect()
+        await here.load(first)
+        await there.load(second)
+        second.watch_cache("previews", functools.partial(there.load, second))
+        try:
+            source = _jpeg()
+            await here.generate("lesson:1", "Урок", source)
+
+            class Sent:
+                photo = [type("Photo", (), {"file_id": "OLD_FILE_ID"})()]
+
+            await second.check_caches()
+            await there.remember_file_id("lesson:1", Sent)
+            assert there.photo("lesson:1") == "OLD_FILE_ID"
+
+            # Карточку перерисовали - старый file_id во втором процессе забыт
+            await here.generate("lesson:1", "Урок 2", source)
+            await second.check_caches()
+            assert there.photo("lesson:1") != "OLD_FILE_ID"
+            assert there.has("lesson:1")
+        finally:
+            await here.close()
+            await first.close()
+            await second.close()
+
+    asyncio.run(run())
+
+def _jpeg() -> bytes:
+    from io import BytesIO
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", (64, 36), (0, 128, 0)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def test_course_change_reaches_other_process(tmp_path):
+    first, second = _processes(tmp_path)
+
+    async def run():
+        await first.connect()
+        await second.connect()
+        try:
+            await first.add_course("Новый курс", "Описание", 990, 30)
+            course_id = first.list_courses()[-1][0]
+            assert second.get_course(course_id) is None
+
+            await second.check_caches()
+            assert second.get_course(course_id)[1] == "Новый курс"
+
+            await first.set_course_active(course_id, False)
+            await second.check_caches()
+            assert second.get_course(course_id) is None
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(run())
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from benchmarks.fake_session import FakeSession
+from callbacks import BAD_REQUEST_TEXT, CallbackRouter
+
+class AnswerSession(FakeSession):
+    """FakeSession, которая запоминает ответы на callback"""
+
+    def __init__(self):
+        super().__init__()
+        self.answers = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if type(method).__name__ == "AnswerCallbackQuery":
+            self.answers.append(method.text)
+        return await super().make_request(bot, method, timeout)
+
+def _callback(update_id: int, user_id: int, data: str) -> Update:
+    user = User(id=user_id, is_bot=False, first_name=f"User{user_id}")
+    message = Message(message_id=update_id, date=int(time.time()),
+                      chat=Chat(id=user_id, type="private"), text="...")
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=user, chat_instance="test", data=data, message=message
+    ))
+
+def test_unparsed_payload_is_answered_without_handler():
+    calls = []
+    router = CallbackRouter()
+
+    @router.prefix("item_", int)
+    async def item(callback: CallbackQuery, payload: int):
+        calls.append(payload)
+
+    dispatcher = Dispatcher()
+    dispatcher.include_router(router)
+    session = AnswerSession()
+    bot = Bot(token="123456:test", session=session)
+
+    async def run():
+        await dispatcher.feed_update(bot, _callback(1, 1, "item_abc"))
+        await dispatcher.feed_update(bot, _callback(2, 1, "item_5"))
+
+    asyncio.run(run())
+    assert calls == [5]
+    assert session.answers == [BAD_REQUEST_TEXT]
+
+def test_demo_points_only_for_existing_course(app):
+    async def run():
+        await app.db.connect()
+        app.storage.start()
+        await app.dp.emit_startup(bot=app.bot, **app.dp.workflow_data)
+        try:
+            await app.db.add_user(500, "demo", "Demo")
+            course_id = app.db.list_courses()[0][0]
+            missing = max(course[0] for course in app.db.list_courses()) + 1000
+
+            await app.dp.feed_update(app.bot, _callback(1, 500, f"complete_demo_{missing}"))
+            assert await app.db.get_user_points(500) == 0
+            await app.dp.feed_update(app.bot, _callback(2, 500, f"complete_demo_{course_id}"))
+            assert await app.db.get_user_points(500) == 10
+
+            await app.db.ledger.flush()
+            assert await app.db.fetchone(
+                "SELECT COUNT(*) FROM user_progress WHERE user_id = 500"
+            ) == (1,)
+            await app.storage.close()
+        finally:
+            await app.dp.emit_shutdown(bot=app.bot, **app.dp.workflow_data)
+            await app.db.close()
+
+    asyncio.run(run())
+
+def test_repeated_purchase_and_admin_stats_texts(app, monkeypatch):
+    sent = []
+    make_request = app.bot.session.make_request
+
+    async def record(bot, method, timeout=None):
+        if type(method).__name__ in ("EditMessageText", "SendMessage"):
+            sent.append(method.text)
+        return await make_request(bot, method, timeout)
+
+    monkeypatch.setattr(app.bot.session, "make_request", record)
+
+    async def run():
+        await app.db.connect()
+        app.storage.start()
+        await app.dp.emit_startup(bot=app.bot, **app.dp.workflow_data)
+        try:
+            await app.db.add_user(600, "buyer", "<b>Buyer</b>")
+            course_id = app.db.list_courses()[0][0]
+
+            # Повторная покупка того же курса: без второго бонуса
+            await app.dp.feed_update(app.bot, _callback(1, 600, f"test_purchase_{course_id}"))
+            await app.dp.feed_update(app.bot, _callback(2, 600, f"test_purchase_{course_id}"))
+            assert "+100 очков" in sent[0]
+            assert "Уже был активен" in sent[1] and "+100" not in sent[1]
+            assert await app.db.get_user_points(600) == 100
+
+            # Имя лидера - пользовательский текст, в HTML оно экранируется
+            await app.dp.feed_update(app.bot, _callback(3, app.ADMIN_IDS[0], "admin_stats"))
+            assert "&lt;b&gt;Buyer&lt;/b&gt;" in sent[2]
+            await app.storage.close()
+        finally:
+            await app.dp.emit_shutdown(bot=app.bot, **app.dp.workflow_data)
+            await app.db.close()
+
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+import asyncio
+
+def test_progress_includes_pending_without_flush(database):
+    async def run():
+        await database.connect()
+        try:
+            await database.add_user(1, "user", "User")
+            assert await database.record_lesson_completion(1, 1, 10)
+            assert await database.record_task_completion(1, 7, 3)
+            await database.ledger.flush()
+            assert await database.record_lesson_completion(1, 2, 10)
+
+            progress = await database.get_user_progress(1)
+            assert progress['completed_lessons'] == 2
+            assert progress['completed_tasks'] == 1
+            assert progress['total_points'] == 23
+            # Чтение прогресса не сбрасывает журнал
+            assert database.ledger.pending_points(1) == 10
+
+            await database.ledger.flush()
+            flushed = await database.get_user_progress(1)
+            for key in ('completed_lessons', 'completed_tasks', 'total_points'):
+                assert flushed[key] == progress[key]
+        finally:
+            await database.close()
+
+    asyncio.run(run())
+
+def test_repeated_activation_is_not_a_new_purchase(database):
+    async def run():
+        await database.connect()
+        try:
+            await database.add_user(1, "user", "User")
+            assert await database.activate_subscription(1, 1)
+            assert not await database.activate_subscription(1, 1)
+            assert database.stats.total('purchases') == 1
+            assert database.stats.total('purchases:1') == 1
+
+            # Другой курс - новая покупка
+            assert await database.activate_subscription(1, 2)
+            assert await database.has_course_access(1, 2)
+
+            # Счётчики в базе совпадают с памятью
+            await database.stats.load()
+            assert database.stats.total('purchases') == 2
+            assert database.stats.day()['purchases'] == 2
+        finally:
+            await database.close()
+
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+import asyncio
+
+from aiogram import Bot
+
+from benchmarks.fake_session import FakeSession
+from edits import EditCache
+from sender import OutboundScheduler
+
+class RecordingSession(FakeSession):
+    """FakeSession, которая запоминает тексты отправленных правок"""
+
+    def __init__(self):
+        super().__init__()
+        self.edits = []
+
+    async def make_request(self, bot, method, timeout=None):
+        if type(method).__name__ == "EditMessageText":
+            self.edits.append(method.text)
+        return await super().make_request(bot, method, timeout)
+
+def _bot():
+    session = RecordingSession()
+    bot = Bot(token="123456:test", session=session)
+    # Порядок как в main.py: кэш снаружи планировщика
+    bot.session.middleware(EditCache())
+    bot.session.middleware(OutboundScheduler(chat_rate=50, chat_burst=1))
+    return bot, session
+
+def test_superseded_edit_is_not_remembered():
+    async def run():
+        bot, session = _bot()
+        await bot.edit_message_text("first", chat_id=1, message_id=10)
+        # Корзина чата пуста: обе правки ждут, и планировщик отправляет только
+        # последнюю, а первая получает её результат
+        await asyncio.gather(
+            bot.edit_message_text("stale", chat_id=1, message_id=10),
+            bot.edit_message_text("fresh", chat_id=1, message_id=10),
+        )
+        assert session.edits == ["first", "fresh"]
+
+        # Сообщение показывает "fresh": правка на "stale" должна уйти
+        await bot.edit_message_text("stale", chat_id=1, message_id=10)
+        # А повтор последнего вида - нет
+        await bot.edit_message_text("stale", chat_id=1, message_id=10)
+        assert session.edits == ["first", "fresh", "stale"]
+
+    asyncio.run(run())
+
+def test_repeated_edit_is_skipped():
+    async def run():
+        bot, session = _bot()
+        await bot.edit_message_text("same", chat_id=1, message_id=10)
+        await bot.edit_message_text("same", chat_id=1, message_id=10)
+        await bot.edit_message_text("same", chat_id=1, message_id=11)
+        assert session.edits == ["same", "same"]
+
+    asyncio.run(run())
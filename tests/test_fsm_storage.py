@@ -0,0 +1,50 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+import fsm_storage
+from fsm_storage import SQLiteStorage
+
+class Clock:
+    """Подменяемое время для fsm_storage: и time(), и monotonic()"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+def test_read_inside_ttl_keeps_session(database, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fsm_storage, "time", clock)
+
+    async def run():
+        await database.connect()
+        try:
+            storage = SQLiteStorage(database, ttl=100)
+            await storage.set_state(_key(1), "quiz:answer")
+            await storage.set_state(_key(2), "quiz:answer")
+            await storage.flush()
+
+            # Сессию 1 читают внутри окна ttl, сессию 2 - нет
+            clock.now += 60
+            assert await storage.get_state(_key(1)) == "quiz:answer"
+            await storage.flush()
+
+            clock.now += 60
+            await storage.flush()
+
+            # Новое хранилище - без кэша, только то, что осталось в базе
+            fresh = SQLiteStorage(database, ttl=100)
+            assert await fresh.get_state(_key(1)) == "quiz:answer"
+            assert await fresh.get_state(_key(2)) is None
+        finally:
+            await database.close()
+
+    asyncio.run(run())
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+def _hook_flush(database, hook):
+    # Вызывается, когда сброс уже забрал изменения из журнала, но ещё не записал
+    write_batch = database.write_batch
+
+    async def during_flush(work):
+        await hook()
+        return await write_batch(work)
+
+    database.write_batch = during_flush
+
+def test_pending_stays_visible_until_commit(database):
+    seen = []
+
+    async def run():
+        await database.connect()
+        try:
+            await database.add_user(1, "user", "User")
+            assert await database.complete(1, "lesson:1", 10, lesson_id=1)
+            await database.add_points(1, 5)
+
+            async def hook():
+                seen.append((
+                    await database.get_user_points(1),
+                    database.ledger.pending_keys(1),
+                    database.ledger.has_pending_progress(1),
+                ))
+
+            _hook_flush(database, hook)
+            await database.ledger.flush()
+
+            assert seen == [(15, {"lesson:1"}, True)]
+            assert database.ledger.pending_points(1) == 0
+            assert not database.ledger.has_pending_progress(1)
+            assert await database.get_user_points(1) == 15
+        finally:
+            await database.close()
+
+    asyncio.run(run())
+
+def test_failed_flush_keeps_changes(database):
+    async def run():
+        await database.connect()
+        try:
+            await database.add_user(1, "user", "User")
+            await database.add_user(2, "other", "Other")
+            assert await database.complete(1, "lesson:1", 10, lesson_id=1)
+
+            async def fail():
+                raise RuntimeError("disk full")
+
+            write_batch = database.write_batch
+            _hook_flush(database, fail)
+            with pytest.raises(RuntimeError):
+                await database.ledger.flush()
+
+            assert database.ledger.pending_points(1) == 10
+            assert database.ledger.pending_keys(1) == {"lesson:1"}
+            assert not database.ledger.has_pending_progress(2)
+
+            database.write_batch = write_batch
+            await database.ledger.flush()
+            assert await database.get_user_points(1) == 10
+            assert database.ledger.pending() == {}
+        finally:
+            await database.close()
+
+    asyncio.run(run())
+
+def test_ignored_duplicate_is_taken_back_from_leaderboard(database):
+    async def run():
+        await database.connect()
+        try:
+            await database.add_user(1, "user", "User")
+            assert await database.record_task_completion(1, 1, 3)
+            await database.ledger.flush()
+
+            # Тот же урок уже записал другой процесс: кэш выполнений об этом не знает
+            await database.execute('''
+                INSERT INTO user_progress (user_id, lesson_id, completion_key, completed_at, points_earned)
+                VALUES (1, 5, 'lesson:5', CURRENT_TIMESTAMP, 10)
+            ''')
+            assert await database.record_lesson_completion(1, 5, 10)
+            await database.add_points(1, 2)
+            await database.ledger.flush()
+
+            assert await database.get_user_points(1) == 5
+            assert database.leaderboard.top(1) == [(1, 1, "User", 5)]
+        finally:
+            await database.close()
+
+    asyncio.run(run())
+
+def test_batch_flush_skips_only_already_written_rows(database):
+    async def run():
+        await database.connect()
+        try:
+            for user_id in (1, 2):
+                await database.add_user(user_id, f"user{user_id}", f"User {user_id}")
+                assert await database.record_task_completion(user_id, 1, 5)
+            # Часть выполнений из пакета уже записал другой процесс
+            await database.execute('''
+                INSERT INTO user_progress (user_id, task_id, completion_key, completed_at, points_earned)
+                VALUES (1, 2, 'task:2', CURRENT_TIMESTAMP, 5), (2, 3, 'task:3', CURRENT_TIMESTAMP, 5)
+            ''')
+            for task_id in (2, 3):
+                assert await database.record_task_completion(1, task_id, 5)
+                assert await database.record_task_completion(2, task_id, 5)
+            assert await database.record_lesson_completion(2, 7, 10)
+            await database.ledger.flush()
+
+            assert await database.get_user_points(1) == 10
+            assert await database.get_user_points(2) == 20
+            progress = await database.get_user_progress(2)
+            assert (progress['completed_lessons'], progress['completed_tasks']) == (1, 2)
+            assert await database.fetchone(
+                'SELECT COUNT(*) FROM user_progress WHERE user_id = 2'
+            ) == (4,)
+        finally:
+            await database.close()
+
+    asyncio.run(run())
+
+def test_close_returns_when_wakeup_and_stop_coincide(tmp_path):
+    from database import Database
+
+    async def close(database):
+        # asyncio.wait, а не wait_for: отмена по таймауту могла бы сама
+        # "разбудить" зависший close()
+        closing = asyncio.create_task(database.close())
+        done, _ = await asyncio.wait({closing}, timeout=5)
+        assert closing in done, "Database.close() завис"
+
+    async def run():
+        # Каждое начисление будит фоновый сброс
+        database = Database(str(tmp_path / "race.db"), readers=1, flush_events=1)
+        await database.connect()
+        await database.add_user(1, "user", "User")
+        for _ in range(20):
+            await database.add_points(1, 1)
+            # Событие уже выставлено, а остановка приходит в том же такте
+            assert database.ledger._wakeup.is_set()
+            await close(database)
+            await database.connect()
+        assert await database.get_user_points(1) == 20
+        await close(database)
+
+    asyncio.run(run())
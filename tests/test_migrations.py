@@ -0,0 +1,30 @@
+import asyncio
+import multiprocessing
+
+import aiosqlite
+
+from migrations import MIGRATIONS, apply_migrations
+
+def _migrate(path: str):
+    async def run():
+        async with aiosqlite.connect(path, timeout=30) as conn:
+            await apply_migrations(conn)
+    asyncio.run(run())
+
+def test_concurrent_processes_apply_each_migration_once(tmp_path):
+    path = str(tmp_path / "bot.db")
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_migrate, args=(path,)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+
+    assert [process.exitcode for process in processes] == [0] * 4
+
+    async def versions():
+        async with aiosqlite.connect(path) as conn:
+            async with conn.execute('SELECT version FROM schema_version ORDER BY version') as cursor:
+                return [version for (version,) in await cursor.fetchall()]
+
+    assert asyncio.run(versions()) == [version for version, _, _ in MIGRATIONS]
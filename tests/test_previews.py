@@ -0,0 +1,51 @@
+import asyncio
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from previews import SIZES, PreviewStore, render_cards
+
+def _source(size=(800, 600), fmt="PNG") -> bytes:
+    # Картинка-источник с деталями, чтобы обрезка была заметна
+    image = Image.new("RGB", size, (30, 120, 60))
+    image.paste((200, 200, 40), (0, 0, size[0] // 2, size[1] // 2))
+    output = BytesIO()
+    image.save(output, fmt)
+    return output.getvalue()
+
+def test_render_cards_sizes_and_format():
+    cards = render_cards(_source(), "Основы дриблинга: ведение мяча на скорости")
+
+    assert set(cards) == set(SIZES)
+    for name, data in cards.items():
+        with Image.open(BytesIO(data)) as card:
+            assert card.format == "JPEG"
+            assert card.mode == "RGB"
+            assert card.size == SIZES[name]
+
+def test_render_cards_accepts_any_source_format():
+    # Узкий PNG и JPEG меньше карточки - размеры всё равно точные
+    for source in (_source((50, 400), "PNG"), _source((120, 90), "JPEG")):
+        cards = render_cards(source, "Заголовок")
+        for name, data in cards.items():
+            with Image.open(BytesIO(data)) as card:
+                assert card.size == SIZES[name]
+
+def test_generate_renders_in_spawned_pool(database, tmp_path):
+    async def run():
+        await database.connect()
+        store = PreviewStore(str(tmp_path / "previews"), workers=1)
+        await store.load(database)
+        try:
+            path = await store.generate("course:1", "Курс", _source())
+            assert store._pool()._mp_context.get_start_method() == "spawn"
+        finally:
+            await store.close()
+            await database.close()
+        return path
+
+    path = asyncio.run(run())
+    for name, size in SIZES.items():
+        with Image.open(os.path.join(os.path.dirname(path), f"{name}.jpg")) as card:
+            assert card.size == size
@@ -0,0 +1,57 @@
+import asyncio
+import re
+
+import aiosqlite
+
+from migrations import _BAD_PLAN, apply_migrations, check_query_plans
+
+# Литералы в тексте запроса: планы не зависят от конкретных значений
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+def test_hot_queries_use_indexes(tmp_path):
+    async def run():
+        async with aiosqlite.connect(str(tmp_path / "plans.db")) as conn:
+            await apply_migrations(conn)
+            return await check_query_plans(conn)
+
+    assert asyncio.run(run()) == []
+
+def test_replayed_session_queries_use_indexes(app):
+    from benchmarks.replay import SessionReplay, _seed_lessons
+
+    statements = {}
+
+    def trace(statement: str):
+        if statement.split(None, 1)[0].upper() in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            statements.setdefault(_LITERALS.sub("?", statement), statement)
+
+    async def run():
+        await app.db.connect()
+        app.storage.start()
+        await app.dp.emit_startup(bot=app.bot, **app.dp.workflow_data)
+        try:
+            await _seed_lessons(app.db)
+            # Запросы загрузки при старте не в счёт - только обработка обновлений
+            for conn in app.db._reader_conns + [app.db._writer]:
+                await conn.set_trace_callback(trace)
+
+            await SessionReplay(app, users=20, concurrency=5, seed=1).run(1000, 20)
+            await app.db.ledger.flush()
+            await app.storage.close()
+
+            problems = []
+            async with app.db.reader() as conn:
+                for statement in statements.values():
+                    async with conn.execute('EXPLAIN QUERY PLAN ' + statement) as cursor:
+                        for row in await cursor.fetchall():
+                            if _BAD_PLAN.search(row[-1]):
+                                problems.append((' '.join(statement.split()), row[-1]))
+            return problems
+        finally:
+            for conn in app.db._reader_conns + [app.db._writer]:
+                await conn.set_trace_callback(None)
+            await app.dp.emit_shutdown(bot=app.bot, **app.dp.workflow_data)
+            await app.db.close()
+
+    assert asyncio.run(run()) == []
+    assert len(statements) > 5
@@ -0,0 +1,91 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+
+from sharding import Supervisor, lane_for, shard_for
+
+def _echo_worker(directory, index, updates, lanes, workers):
+    # Обработчик для теста: отмечает каждое полученное обновление файлом.
+    # Файлы, а не общая очередь: убитый процесс мог бы оставить её
+    # блокировку записи занятой
+    while True:
+        update = updates.get()
+        if update is None:
+            break
+        open(os.path.join(directory, f"{index}-{update['update_id']}"), "w").close()
+
+def _update(update_id: int, user_id: int) -> dict:
+    return {"update_id": update_id, "message": {"from": {"id": user_id}, "text": "/start"}}
+
+def _wait_for(directory, names, timeout: float = 30.0) -> set:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if set(names) <= set(os.listdir(directory)):
+            break
+        time.sleep(0.05)
+    return set(os.listdir(directory))
+
+def test_dead_worker_is_restarted(tmp_path, caplog):
+    async def run():
+        supervisor = Supervisor(2, queue_size=10,
+                                target=functools.partial(_echo_worker, str(tmp_path)))
+        supervisor.start()
+        try:
+            user_id = 1
+            assert shard_for(_update(0, user_id), 2) == 1
+
+            assert supervisor.route(_update(1, user_id))
+            assert "1-1" in _wait_for(tmp_path, ["1-1"])
+
+            dead = supervisor.processes[1]
+            dead.kill()
+            dead.join()
+
+            with caplog.at_level(logging.ERROR):
+                assert supervisor.route(_update(2, user_id))
+                await supervisor.route_wait(_update(3, user_id))
+            assert supervisor.restarts == 1
+            assert supervisor.processes[1] is not dead
+            assert any("bot-worker-1" in record.getMessage() for record in caplog.records)
+            assert {"1-2", "1-3"} <= _wait_for(tmp_path, ["1-2", "1-3"])
+
+            # Второй шард перезапуск не затронул
+            assert supervisor.route(_update(4, 2))
+            assert "0-4" in _wait_for(tmp_path, ["0-4"])
+        finally:
+            await supervisor.stop(timeout=10)
+
+        assert all(process.exitcode == 0 for process in supervisor.processes)
+
+    asyncio.run(run())
+
+def test_route_wait_does_not_block_on_dead_worker(tmp_path):
+    async def run():
+        supervisor = Supervisor(1, queue_size=1,
+                                target=functools.partial(_echo_worker, str(tmp_path)))
+        supervisor.start()
+        try:
+            dead = supervisor.processes[0]
+            dead.kill()
+            dead.join()
+            # Очередь умершего процесса заполнена: без проверки живости
+            # route_wait ждал бы места в ней вечно
+            supervisor.queues[0].put(_update(1, 5))
+            await asyncio.wait_for(supervisor.route_wait(_update(2, 5)), 30)
+            assert "0-2" in _wait_for(tmp_path, ["0-2"])
+        finally:
+            await supervisor.stop(timeout=10)
+
+        assert supervisor.processes[0].exitcode == 0
+
+    asyncio.run(run())
+
+def test_every_worker_uses_every_lane():
+    workers, lanes = 4, 16
+    used = {index: set() for index in range(workers)}
+    for user_id in range(1, 2001):
+        update = _update(user_id, user_id)
+        used[shard_for(update, workers)].add(lane_for(update, workers, lanes))
+    assert used == {index: set(range(lanes)) for index in range(workers)}
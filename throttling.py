@@ -0,0 +1,111 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from metrics import metrics, name_update
+
+class _UserState:
+    """Корзина токенов пользователя и его последнее нажатие кнопки"""
+
+    __slots__ = ("tokens", "updated", "last_data", "last_message_id", "last_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.last_data: Optional[str] = None
+        self.last_message_id: Optional[int] = None
+        self.last_at = 0.0
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware dp.update: ограничение частоты запросов пользователя.
+
+    - у каждого пользователя корзина токенов: rate обновлений в секунду,
+      не больше burst подряд; лишние обновления отбрасываются до
+      обработчиков и базы, на нажатие кнопки отвечается "подождите";
+    - повторное нажатие той же кнопки того же сообщения в течение
+      dedup_window секунд только гасит часики на кнопке.
+
+    Состояния лежат в OrderedDict в порядке последнего обращения. Запись,
+    к которой не обращались дольше expire секунд, ничем не отличается от
+    новой (корзина полна, окно повтора прошло) и удаляется с начала словаря;
+    всего записей не больше max_users. Обновления одного пользователя
+    всегда обрабатывает один процесс (см. sharding), поэтому счёт точный.
+    Оплаты и администраторы не ограничиваются.
+    """
+
+    def __init__(self, rate: float = 2, burst: float = 8, dedup_window: float = 1.0,
+                 max_users: int = 50000, exempt: Iterable[int] = ()):
+        self.rate = rate
+        self.burst = burst
+        self.dedup_window = dedup_window
+        self.max_users = max_users
+        self.exempt = frozenset(exempt)
+        self.expire = max(burst / rate, dedup_window)
+        self._users: "OrderedDict[int, _UserState]" = OrderedDict()
+
+    def _state(self, user_id: int, now: float) -> _UserState:
+        # Сначала убираем устаревшие записи - они в начале словаря
+        while self._users:
+            oldest_id, oldest = next(iter(self._users.items()))
+            if now - oldest.updated < self.expire and len(self._users) < self.max_users:
+                break
+            del self._users[oldest_id]
+
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(self.burst, now)
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def _take(self, state: _UserState, now: float) -> bool:
+        state.tokens = min(self.burst, state.tokens + (now - state.updated) * self.rate)
+        state.updated = now
+        if state.tokens < 1:
+            return False
+        state.tokens -= 1
+        return True
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        # Подтверждение оплаты Telegram ждёт не дольше 10 секунд
+        if event.pre_checkout_query or (event.message and event.message.successful_payment):
+            return await handler(event, data)
+
+        user = data.get("event_from_user")
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        state = self._state(user.id, now)
+        callback = event.callback_query
+
+        if callback is not None and callback.data is not None:
+            message_id = callback.message.message_id if callback.message else None
+            if (callback.data == state.last_data and message_id == state.last_message_id
+                    and now - state.last_at < self.dedup_window):
+                self._drop(event, "duplicate")
+                await callback.answer()
+                return None
+
+        if not self._take(state, now):
+            self._drop(event, "rate")
+            logging.debug("Пользователь %s превысил лимит запросов", user.id)
+            if callback is not None:
+                await callback.answer("⏳ Слишком часто, подождите немного")
+            return None
+
+        if callback is not None:
+            state.last_data = callback.data
+            state.last_message_id = callback.message.message_id if callback.message else None
+            state.last_at = now
+        return await handler(event, data)
+
+    @staticmethod
+    def _drop(event: Update, reason: str):
+        metrics.throttled.inc(type=event.event_type, reason=reason)
+        name_update("throttled")
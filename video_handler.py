@@ -1,99 +1,219 @@
-from aiogram import types, F, Router
+import functools
+from typing import Optional
+
+from aiogram import types, F
+from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from callbacks import CallbackRouter
 from database import Database
 from config import ADMIN_IDS
+from previews import previews
+from render import ALREADY_AWARDED_TEXT, build_keyboard
+
+video_router = CallbackRouter(name="video")
+
+@video_router.startup()
+async def load_previews(db: Database):
+    await previews.load(db)
+    db.watch_cache("previews", functools.partial(previews.load, db))
+
+@video_router.shutdown()
+async def close_previews():
+    await previews.close()
 
-video_router = Router()
+async def _media_preview(bot, media_id: int, thumbnail_file_id: str, title: str):
+    # Миниатюра от Telegram - источник для карточек урока и курса
+    buffer = await bot.download(thumbnail_file_id)
+    source = buffer.getvalue()
+    await previews.save_source(f"media:{media_id}", source)
+    await previews.generate(f"media:{media_id}", title, source)
+
+async def _lesson_previews(db: Database, lesson_id: int, media_id: int):
+    source = await previews.read_source(f"media:{media_id}")
+    lesson = db.lessons.get(lesson_id)
+    if source is None or lesson is None:
+        return
+    await previews.generate(f"lesson:{lesson.id}", lesson.title, source)
+    # Обложка курса - по первому видео, привязанному к его урокам
+    course = db.get_course(lesson.course_id)
+    if course and not previews.has(f"course:{course[0]}"):
+        await previews.generate(f"course:{course[0]}", course[1], source)
 
 # Обработка видео от админа
 @video_router.message(F.video)
-async def handle_video_upload(message: types.Message):
+async def handle_video_upload(message: types.Message, db: Database):
     if message.from_user.id not in ADMIN_IDS:
         await message.reply("❌ Только администраторы могут загружать видео!")
         return
     
-    video_file_id = message.video.file_id
-    video_duration = message.video.duration
-    video_size = message.video.file_size
+    video = message.video
+    
+    # Сохраняем видео в реестр; тот же файл повторно не записывается
+    media, created = await db.media.register(
+        "video", video.file_id, video.file_unique_id,
+        video.duration, video.file_size, message.from_user.id
+    )
+    
+    # Карточки-превью рисуются в фоне, ответ админу их не ждёт
+    if created and video.thumbnail:
+        previews.schedule(_media_preview(
+            message.bot, media.id, video.thumbnail.file_id,
+            message.caption or f"Видео {media.id}"
+        ))
     
-    # Сохраняем информацию о видео
     response_text = (
-        f"📹 <b>Видео получено!</b>\n\n"
-        f"🆔 <b>File ID:</b> <code>{video_file_id}</code>\n"
-        f"⏱ <b>Длительность:</b> {video_duration} сек.\n"
-        f"💾 <b>Размер:</b> {video_size // 1024 // 1024} МБ\n\n"
-        f"💡 <i>Используйте File ID для добавления в урок</i>"
+        f"📹 <b>{'Видео получено!' if created else 'Это видео уже загружено'}</b>\n\n"
+        f"🆔 <b>ID видео:</b> <code>{media.id}</code>\n"
+        f"⏱ <b>Длительность:</b> {media.duration} сек.\n"
+        f"💾 <b>Размер:</b> {(media.file_size or 0) // 1024 // 1024} МБ\n\n"
+        f"💡 <i>Привязать к уроку: /attach_video &lt;id урока&gt; {media.id}</i>"
     )
     
+    # В callback_data только короткий id из реестра - file_id не влезает в 64 байта
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="➕ Создать урок с этим видео", 
-                            callback_data=f"create_lesson_{video_file_id}")]
+                            callback_data=f"create_lesson_{media.id}")]
     ])
     
     await message.reply(response_text, reply_markup=keyboard, parse_mode="HTML")
 
 # Создание урока с видео
-@video_router.callback_query(F.data.startswith("create_lesson_"))
-async def create_lesson_with_video(callback: types.CallbackQuery):
+@video_router.prefix("create_lesson_", int)
+async def create_lesson_with_video(callback: types.CallbackQuery, payload: Optional[int], db: Database):
     if callback.from_user.id not in ADMIN_IDS:
         await callback.answer("❌ Нет доступа!")
         return
     
-    video_file_id = callback.data.replace("create_lesson_", "")
+    media = db.media.get(payload)
+    if media is None:
+        await callback.answer("❌ Видео не найдено!")
+        return
     
     # Здесь можно добавить FSM для создания урока
     await callback.message.edit_text(
         f"📝 <b>Создание урока</b>\n\n"
-        f"Видео: <code>{video_file_id}</code>\n\n"
-        f"💡 <i>Функция создания уроков будет добавлена в следующих версиях</i>",
+        f"Видео: <code>{media.id}</code> ({media.duration} сек.)\n\n"
+        f"💡 <i>Функция создания уроков будет добавлена в следующих версиях.\n"
+        f"Пока видео можно привязать к готовому уроку: /attach_video &lt;id урока&gt; {media.id}</i>",
         parse_mode="HTML"
     )
 
+# Привязка видео из реестра к уроку
+@video_router.message(Command("attach_video"))
+async def cmd_attach_video(message: types.Message, db: Database):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    
+    try:
+        lesson_id, media_id = map(int, message.text.split()[1:3])
+    except ValueError:
+        await message.answer("Использование: /attach_video <id урока> <id видео>")
+        return
+    
+    if not await db.attach_lesson_media(lesson_id, media_id):
+        await message.answer("❌ Урок или видео не найдены")
+        return
+    previews.schedule(_lesson_previews(db, lesson_id, media_id))
+    await message.answer(f"✅ Видео {media_id} привязано к уроку {lesson_id}")
+
 # Показ видео урока пользователю
 async def show_lesson_video(bot, chat_id: int, lesson_id: int, db: Database):
     """Функция для показа видео урока пользователю"""
-    # Получаем информацию об уроке из базы данных
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT title, description, video_file_id, points_reward 
-        FROM lessons WHERE id = ?
-    ''', (lesson_id,))
+    lesson = db.lessons.get(lesson_id)
+    page = await db.lessons.page(lesson_id)
     
-    lesson = cursor.fetchone()
-    conn.close()
-    
-    if not lesson:
+    if not lesson or not page:
         await bot.send_message(chat_id, "❌ Урок не найден!")
         return
     
-    title, description, video_file_id, points = lesson
+    # Пока пользователь смотрит урок, готовим следующий
+    db.lessons.prefetch(lesson.next_id)
     
-    if not video_file_id:
-        await bot.send_message(
-            chat_id, 
-            f"📚 <b>{title}</b>\n\n{description}\n\n❌ Видео пока недоступно",
-            parse_mode="HTML"
-        )
+    text, keyboard = page
+    if not lesson.video_file_id:
+        await bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode="HTML")
         return
     
-    # Отправляем видео
-    caption = (
-        f"🎥 <b>{title}</b>\n\n"
-        f"{description}\n\n"
-        f"⭐ <b>За просмотр:</b> +{points} очков"
-    )
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Урок пройден", 
-                            callback_data=f"complete_lesson_{lesson_id}")],
-        [InlineKeyboardButton(text="🔙 К курсу", callback_data="my_courses")]
-    ])
-    
     await bot.send_video(
         chat_id=chat_id,
-        video=video_file_id,
-        caption=caption,
+        video=lesson.video_file_id,
+        caption=text,
         reply_markup=keyboard,
         parse_mode="HTML"
-    )
\ No newline at end of file
+    )
+
+async def _check_access(callback: types.CallbackQuery, course_id: int, db: Database) -> bool:
+    user_id = callback.from_user.id
+    if user_id in ADMIN_IDS or await db.has_course_access(user_id, course_id):
+        return True
+    await callback.answer("🔒 Уроки доступны после покупки курса", show_alert=True)
+    return False
+
+# Список уроков курса
+@video_router.prefix("lessons_", int)
+async def show_course_lessons(callback: types.CallbackQuery, payload: Optional[int], db: Database):
+    page = db.lessons.course_page(payload) if payload is not None else None
+    
+    if not page:
+        await callback.answer("📚 В этом курсе пока нет уроков")
+        return
+    
+    if not await _check_access(callback, payload, db):
+        return
+    
+    text, keyboard = page
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+
+# Открытие урока (в том числе «Следующий урок»)
+@video_router.prefix("lesson_", int)
+async def open_lesson(callback: types.CallbackQuery, payload: Optional[int], db: Database):
+    lesson = db.lessons.get(payload) if payload is not None else None
+    
+    if not lesson:
+        await callback.answer("❌ Урок не найден!")
+        return
+    
+    if not await _check_access(callback, lesson.course_id, db):
+        return
+    
+    await show_lesson_video(callback.bot, callback.message.chat.id, lesson.id, db)
+    await callback.answer()
+
+# Завершение урока
+@video_router.prefix("complete_lesson_", int)
+async def complete_lesson(callback: types.CallbackQuery, payload: Optional[int], db: Database):
+    lesson = db.lessons.get(payload) if payload is not None else None
+    
+    if not lesson:
+        await callback.answer("❌ Урок не найден!")
+        return
+    
+    if not await _check_access(callback, lesson.course_id, db):
+        return
+    
+    awarded = await db.record_lesson_completion(callback.from_user.id, lesson.id, lesson.points)
+    db.lessons.prefetch(lesson.next_id)
+    
+    text = (
+        f"🎉 <b>Урок {lesson.number}/{lesson.total} пройден!</b>\n\n"
+        + (f"✅ Ты получил +{lesson.points} очков\n\n" if awarded else ALREADY_AWARDED_TEXT)
+    )
+    if lesson.next_id is not None:
+        text += "▶️ Переходи к следующему уроку!"
+        rows = [[("⏭ Следующий урок", f"lesson_{lesson.next_id}")]]
+    else:
+        text += "🏁 Это был последний урок курса!"
+        rows = []
+    rows.append([("📚 К урокам", f"lessons_{lesson.course_id}")])
+    rows.append([("📊 Мой прогресс", "my_progress")])
+    
+    await callback.message.answer(text, reply_markup=build_keyboard(*rows), parse_mode="HTML")
+    await callback.answer()
+
+# Перечитать уроки после правки таблицы lessons (для администраторов)
+@video_router.message(Command("reload_lessons"))
+async def cmd_reload_lessons(message: types.Message, db: Database):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    await db.lessons.invalidate()
+    await message.answer("✅ Уроки перезагружены")
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import signal
+from typing import List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from metrics import metrics
+
+class WebhookServer:
+    """Приём обновлений через webhook с асинхронной обработкой.
+
+    HTTP-обработчик только кладёт JSON обновления в ограниченную очередь и
+    сразу отвечает 200, а разбор и обработку выполняют workers фоновых
+    задач. Если очередь заполнена, сервер отвечает 503 - Telegram повторит
+    доставку позже (обратное давление вместо роста памяти).
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = "/webhook",
+                 secret: Optional[str] = None, workers: int = 16, queue_size: int = 1000,
+                 drain_timeout: float = 30.0):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+        self._runner: Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=401)
+        if not self._accepting:
+            return web.Response(status=503)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        if not self.enqueue(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    def enqueue(self, update: dict) -> bool:
+        """Поставить обновление в очередь; False, если места нет"""
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception:
+                logging.exception("Ошибка обработки обновления %s", update.get("update_id"))
+            finally:
+                self.queue.task_done()
+
+    def start_workers(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def drain(self):
+        """Дождаться обработки очереди и остановить workers"""
+        try:
+            await asyncio.wait_for(self.queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Не дождались обработки %d обновлений", self.queue.qsize())
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def start(self, host: str, port: int):
+        """Запуск workers и HTTP-сервера"""
+        self.start_workers()
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._accepting = True
+
+    async def stop(self):
+        """Плавная остановка: перестаём принимать и дообрабатываем очередь"""
+        self._accepting = False
+        await self.drain()
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+def stop_on_signals() -> asyncio.Event:
+    """Событие, которое выставляется по SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+    return stop_event
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str, port: int, path: str,
+                      url: str = "", secret: Optional[str] = None,
+                      workers: int = 16, queue_size: int = 1000):
+    """Работа бота в режиме webhook до SIGINT/SIGTERM.
+
+    Если url пустой, webhook в Telegram не регистрируется - удобно для
+    локальной проверки отправкой сохранённых Update в формате JSON.
+    """
+    server = WebhookServer(dp, bot, path, secret, workers, queue_size)
+    metrics.queue_depth.set_function(server.queue.qsize)
+    stop_event = stop_on_signals()
+
+    await dp.emit_startup(bot=bot, **dp.workflow_data)
+    await server.start(host, port)
+    if url:
+        await bot.set_webhook(url + path, secret_token=secret or None)
+
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await dp.emit_shutdown(bot=bot, **dp.workflow_data)